@@ -0,0 +1,48 @@
+"""
+Times first match lookups over a synthetic dataplane.
+
+Run from the repository root: python benchmarks/bench_lookup.py [rule count] [lookup count]
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pancompare  # noqa: E402
+import panlookup  # noqa: E402
+from benchmarks.generate import ZONES, generate_dataplane  # noqa: E402
+
+
+def random_flows(count, seed=0):
+    rng = random.Random(seed)
+    zones = [zone.strip('"') for zone in ZONES]
+    return [{
+        'from_zone': rng.choice(zones),
+        'to_zone': rng.choice(zones),
+        'source': '10.{}.{}.{}'.format(rng.randrange(256), rng.randrange(256), rng.randrange(256)),
+        'destination': '172.{}.{}.9'.format(rng.randrange(16, 32), rng.randrange(256)),
+        'protocol': rng.choice(['tcp', 'udp']),
+        'destination_port': rng.choice([22, 53, 80, 443, 8080]),
+    } for _ in range(count)]
+
+
+def main(rule_count=10000, lookup_count=10000):
+    rules = list(pancompare.iter_dataplane_rules(generate_dataplane(rule_count, dataplanes=1)))
+    start = time.perf_counter()
+    policy = panlookup.PolicyLookup(rules)
+    build_seconds = time.perf_counter() - start
+
+    flows = random_flows(lookup_count)
+    start = time.perf_counter()
+    matches = panlookup.lookup_flows(policy, flows)
+    lookup_seconds = time.perf_counter() - start
+
+    print('{} rules, {} flows, {} matched'.format(len(rules), len(flows), sum(rule is not None for rule in matches)))
+    print('Index build: {:8.3f}s'.format(build_seconds))
+    print('Per lookup:  {:8.3f}ms'.format(lookup_seconds / len(flows) * 1000))
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
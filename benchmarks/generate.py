@@ -0,0 +1,259 @@
+"""
+Generators for synthetic configs and "show running security-policy" output used by the benchmarks.
+
+Run from the repository root to write fixtures to disk: python benchmarks/generate.py [rule count] [directory]
+"""
+import os
+import random
+import sys
+from xml.sax.saxutils import escape, quoteattr
+
+ZONES = ['Lan', 'Internet', 'DMZ', 'Guest', '"External DMZ"', '"Partner Net"', 'Voice', 'Management']
+APPLICATIONS = ['any/tcp/any/80', 'any/tcp/any/443', 'any/udp/any/53', 'ssl/tcp/any/443', 'ssh/tcp/any/22',
+                'icmp/icmp/any/any', 'any/tcp/any/1024-65535']
+ACTIONS = ['allow', 'allow', 'allow', 'deny', 'drop']
+
+
+def random_address(rng):
+    """
+    :return: A single dataplane address in one of the formats the dataplane uses
+    """
+    kind = rng.randrange(5)
+    if kind == 0:
+        return '10.{}.{}.{}'.format(rng.randrange(256), rng.randrange(256), rng.randrange(256))
+    if kind == 1:
+        return '172.{}.{}.0/24'.format(rng.randrange(16, 32), rng.randrange(256))
+    if kind == 2:
+        start = rng.randrange(1, 200)
+        return '192.168.{0}.{1}-192.168.{0}.{2}'.format(rng.randrange(256), start, start + rng.randrange(1, 50))
+    if kind == 3:
+        return '0x20010db8{:024x}/{}'.format(rng.getrandbits(96), rng.choice([48, 64, 128]))
+    return '0:0:0:0:0:0:{:x}:0/{}'.format(rng.randrange(0x800, 0xffff), rng.choice([104, 112, 120]))
+
+
+def random_addresses(rng):
+    """
+    :return: A dataplane address field, either any, a single address or a [ list ]
+    """
+    if rng.random() < 0.15:
+        return 'any'
+    count = rng.choice([1, 1, 2, 4, 8, 16])
+    if count == 1:
+        return random_address(rng)
+    return '[ {} ]'.format(' '.join(random_address(rng) for _ in range(count)))
+
+
+def random_zones(rng):
+    zones = rng.sample(ZONES, rng.choice([1, 1, 1, 2, 3]))
+    if len(zones) == 1:
+        return zones[0]
+    return '[ {} ]'.format(' '.join(zones))
+
+
+def generate_rule(rng, number):
+    """
+    :return: A single dataplane rule as text
+    """
+    applications = rng.sample(APPLICATIONS, rng.choice([1, 1, 2]))
+    application = applications[0] if len(applications) == 1 else '[ {} ]'.format(' '.join(applications))
+    return (
+        '"Rule {number}" {{\n'
+        '        from {from_zone};\n'
+        '        source {source};\n'
+        '        source-region none;\n'
+        '        to {to_zone};\n'
+        '        destination {destination};\n'
+        '        destination-region none;\n'
+        '        user any;\n'
+        '        category any;\n'
+        '        application/service {application};\n'
+        '        action {action};\n'
+        '        terminal yes;\n'
+        '}}\n'
+    ).format(number=number, from_zone=random_zones(rng), source=random_addresses(rng),
+             to_zone=random_zones(rng), destination=random_addresses(rng), application=application,
+             action=rng.choice(ACTIONS))
+
+
+def generate_dataplane(rule_count, seed=0, dataplanes=2):
+    """
+    Generates a "show running security-policy" result with the same rules on every dataplane.
+    :param rule_count: Number of rules per dataplane
+    :param seed: Random seed, the same seed always gives the same output
+    :param dataplanes: Number of DP sections
+    :return: Dataplane text
+    """
+    rng = random.Random(seed)
+    rules = '\n'.join(generate_rule(rng, number) for number in range(rule_count))
+    sections = ['DP dp{}:\n\n{}\ndynamic url: no\npol objs matched\n\n'.format(number, rules)
+                for number in range(dataplanes)]
+    return '\n'.join(sections)
+
+
+CONFIG_APPLICATIONS = ['ssl', 'web-browsing', 'dns', 'ssh', 'ping', 'ms-rdp', 'smtp', 'ntp', 'ldap', 'snmp']
+CONFIG_SERVICES = ['application-default', 'service-http', 'service-https', 'tcp-8080', 'udp-514']
+TAGS = ['Outbound', 'Inbound', 'Legacy', 'Audit', 'Temporary']
+# Share of the rules in the pre rulebase, on the device and in the post rulebase
+RULEBASE_SHARES = [0.3, 0.4, 0.3]
+
+
+def random_config_address(rng):
+    """
+    :return: A literal address as written in a config: IPv4 host or network, IPv4 range or IPv6 network
+    """
+    kind = rng.randrange(4)
+    if kind == 0:
+        return '10.{}.{}.{}'.format(rng.randrange(256), rng.randrange(256), rng.randrange(256))
+    if kind == 1:
+        return '172.{}.{}.0/24'.format(rng.randrange(16, 32), rng.randrange(256))
+    if kind == 2:
+        start = rng.randrange(1, 200)
+        return '192.168.{0}.{1}-192.168.{0}.{2}'.format(rng.randrange(256), start, start + rng.randrange(1, 50))
+    return '2001:db8:{:x}:{:x}::/64'.format(rng.randrange(0x10000), rng.randrange(0x10000))
+
+
+def generate_objects(rng, object_count, group_count, prefix=''):
+    """
+    :param prefix: Prefix of the object names, keeps the objects of several configs apart
+    :return: Tuple of (address names, group names, <address> XML, <address-group> XML). Groups nest up to three
+    levels deep.
+    """
+    addresses = []
+    address_xml = []
+    for number in range(object_count):
+        name = '{}Host {}'.format(prefix, number)
+        value = random_config_address(rng)
+        kind = 'ip-range' if '-' in value else 'ip-netmask'
+        addresses.append(name)
+        address_xml.append('<entry name={}><{kind}>{}</{kind}></entry>'.format(quoteattr(name), value, kind=kind))
+    groups = []
+    group_xml = []
+    for number in range(group_count):
+        name = '{}Group {}'.format(prefix, number)
+        # Later groups may contain earlier ones, which gives nesting without cycles
+        candidates = addresses + groups[-20:]
+        members = rng.sample(candidates, min(len(candidates), rng.choice([2, 4, 8])))
+        groups.append(name)
+        group_xml.append('<entry name={}><static>{}</static></entry>'.format(quoteattr(name), members_xml(members)))
+    return (addresses, groups, '<address>{}</address>'.format(''.join(address_xml)),
+            '<address-group>{}</address-group>'.format(''.join(group_xml)))
+
+
+def members_xml(members):
+    return ''.join('<member>{}</member>'.format(escape(member)) for member in members)
+
+
+def random_config_members(rng, names):
+    """
+    :return: Members of a rule source or destination: any, or a mix of objects, groups and literal addresses
+    """
+    if rng.random() < 0.15:
+        return ['any']
+    members = []
+    for _ in range(rng.choice([1, 1, 2, 4])):
+        if names and rng.random() < 0.6:
+            members.append(rng.choice(names))
+        else:
+            members.append(random_config_address(rng))
+    return members
+
+
+def generate_config_rule(rng, name, names):
+    """
+    :return: A single security rule <entry> as it appears in a config
+    """
+    zones = [zone.strip('"') for zone in ZONES]
+    fields = [
+        ('to', rng.sample(zones, rng.choice([1, 1, 2]))),
+        ('from', rng.sample(zones, rng.choice([1, 1, 2]))),
+        ('source', random_config_members(rng, names)),
+        ('destination', random_config_members(rng, names)),
+        ('source-user', ['any']),
+        ('category', ['any']),
+        ('application', rng.sample(CONFIG_APPLICATIONS, rng.choice([1, 1, 2, 3])) if rng.random() < 0.8 else ['any']),
+        ('service', rng.sample(CONFIG_SERVICES, 1)),
+        ('hip-profiles', ['any']),
+    ]
+    xml = ''.join('<{0}>{1}</{0}>'.format(field, members_xml(members)) for field, members in fields)
+    xml += '<action>{}</action>'.format(rng.choice(ACTIONS))
+    if rng.random() < 0.5:
+        xml += '<tag>{}</tag>'.format(members_xml(rng.sample(TAGS, rng.choice([1, 2]))))
+    if rng.random() < 0.5:
+        xml += '<description>Generated rule {}</description>'.format(escape(name))
+    if rng.random() < 0.3:
+        xml += '<profile-setting><group><member>default</member></group></profile-setting>'
+    if rng.random() < 0.2:
+        xml += '<log-start>yes</log-start>'
+    if rng.random() < 0.05:
+        xml += '<disabled>yes</disabled>'
+    return '<entry name={}>{}</entry>'.format(quoteattr(name), xml)
+
+
+def generate_config(rule_count, seed=0):
+    """
+    Generates the running and pushed-shared-policy configs of a firewall managed by Panorama.
+    Rules are split between the pre rulebase, the device and the post rulebase, and reference address objects and
+    nested groups of both configs as well as literal IPv4, IPv6 and range addresses and multi-word zones.
+    :param rule_count: Number of rules in the combined rulebase, not counting the two default rules
+    :param seed: Random seed, the same seed always gives the same output
+    :return: Dictionary of config name ('running', 'pushed-shared-policy') to XML text
+    """
+    rng = random.Random(seed)
+    object_count = max(10, rule_count // 5)
+    pushed_names, pushed_groups, pushed_addresses, pushed_address_groups = generate_objects(
+        rng, object_count, object_count // 10)
+    device_names, device_groups, device_addresses, device_address_groups = generate_objects(
+        rng, object_count // 4, object_count // 40, 'Device ')
+
+    pre_count = int(rule_count * RULEBASE_SHARES[0])
+    device_count = int(rule_count * RULEBASE_SHARES[1])
+    post_count = rule_count - pre_count - device_count
+    pushed_references = pushed_names + pushed_groups
+    device_references = pushed_references + device_names + device_groups
+    pre_rules = ''.join(generate_config_rule(rng, 'Pre Rule {}'.format(number), pushed_references)
+                        for number in range(pre_count))
+    device_rules = ''.join(generate_config_rule(rng, 'Device Rule {}'.format(number), device_references)
+                           for number in range(device_count))
+    post_rules = ''.join(generate_config_rule(rng, 'Post Rule {}'.format(number), pushed_references)
+                         for number in range(post_count))
+    default_rules = ('<entry name="intrazone-default"><action>allow</action><log-end>yes</log-end></entry>'
+                     '<entry name="interzone-default"><action>deny</action><log-end>yes</log-end></entry>')
+    zones = ''.join('<entry name={}/>'.format(quoteattr(zone.strip('"'))) for zone in ZONES)
+
+    running = (
+        '<config version="10.1.0"><shared><application/><service/></shared><devices>'
+        '<entry name="localhost.localdomain"><deviceconfig><system><hostname>bench-fw</hostname></system>'
+        '</deviceconfig><vsys><entry name="vsys1"><zone>{zones}</zone>{addresses}{groups}'
+        '<rulebase>{rules}</rulebase></entry></vsys></entry></devices></config>'
+    ).format(zones=zones, addresses=device_addresses, groups=device_address_groups, rules=device_rules)
+    pushed = (
+        '<policy><panorama>{addresses}{groups}'
+        '<pre-rulebase><security><rules>{pre}</rules></security></pre-rulebase>'
+        '<post-rulebase><security><rules>{post}</rules></security>'
+        '<default-security-rules><rules>{default}</rules></default-security-rules></post-rulebase>'
+        '</panorama></policy>'
+    ).format(addresses=pushed_addresses, groups=pushed_address_groups, pre=pre_rules, post=post_rules,
+             default=default_rules)
+    return {'running': running, 'pushed-shared-policy': pushed}
+
+
+def write_fixtures(rule_count, directory, seed=0):
+    """
+    Writes running.xml, pushed-shared-policy.xml and dataplane.txt for a synthetic firewall.
+    The layout is the one pandiff reads snapshots from.
+    :param rule_count: Number of rules
+    :param directory: Directory to write to, created when needed
+    :param seed: Random seed
+    :return:
+    """
+    os.makedirs(directory, exist_ok=True)
+    files = {'{}.xml'.format(config): xml for config, xml in generate_config(rule_count, seed).items()}
+    files['dataplane.txt'] = generate_dataplane(rule_count, seed)
+    for filename, content in files.items():
+        with open(os.path.join(directory, filename), mode='w', encoding='utf-8') as file:
+            file.write(content)
+
+
+if __name__ == '__main__':
+    write_fixtures(int(sys.argv[1]) if len(sys.argv) > 1 else 1000,
+                   sys.argv[2] if len(sys.argv) > 2 else 'bench-fixtures')
@@ -0,0 +1,231 @@
+"""
+Times the main stages of panexport and pancompare on synthetic rulebases and compares them with stored baselines.
+
+Run from the repository root:
+    python benchmarks/harness.py                   compare with benchmarks/baselines.json
+    python benchmarks/harness.py --save            store the results as the new baselines
+    python benchmarks/harness.py --sizes 1000 --benchmarks filter_dataplane_rules
+
+Baselines are stored with the time of a fixed calibration workload, results are scaled by the calibration of the
+machine running the comparison so baselines recorded on another machine stay usable.
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pancompare  # noqa: E402
+import panexport  # noqa: E402
+from benchmarks.generate import generate_config, generate_dataplane  # noqa: E402
+
+DEFAULT_SIZES = [1000, 10000, 50000]
+DEFAULT_BASELINES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines.json')
+DEFAULT_TOLERANCE = 0.3
+# Differences smaller than this are timer noise, not regressions
+MIN_REGRESSION_SECONDS = 0.01
+
+FILTERS = {'zones': ['DMZ', 'External DMZ'], 'ip_addresses': ['10.20.0.0/16', '172.20.5.0/24', '2001:db8::/48']}
+
+
+class Fixture:
+    def __init__(self, rule_count):
+        """
+        Generated inputs of a given size, built once and shared by every benchmark.
+        """
+        self.rule_count = rule_count
+        self.configs = generate_config(rule_count)
+        self.dataplane = generate_dataplane(rule_count)
+        self.parsed = {config: panexport.parse_firewall_configuration(xml, config)
+                       for config, xml in self.configs.items()}
+        self.rulebase = combine_configs(self.parsed)
+        first_dataplane = pancompare.iter_dataplane_rules(self.dataplane)
+        self.address_fields = [field for rule in first_dataplane for field in (rule.source, rule.destination)]
+        # Real dataplanes repeat shared address lists, every field is one of a twentieth of the generated ones
+        rng = random.Random(rule_count)
+        shared = self.address_fields[:max(1, len(self.address_fields) // 20)]
+        self.repeated_address_fields = [rng.choice(shared) for _ in self.address_fields]
+
+
+def combine_configs(parsed):
+    return panexport.combine_the_rulebase(parsed['pushed-shared-policy'], parsed['running'])
+
+
+def bench_parse_config(fixture):
+    for config, xml in fixture.configs.items():
+        panexport.parse_firewall_configuration(xml, config)
+
+
+def bench_combine_the_rulebase(fixture):
+    combine_configs(fixture.parsed)
+
+
+def bench_write_to_excel(fixture):
+    directory = tempfile.mkdtemp()
+    try:
+        panexport.write_to_excel(fixture.rulebase, os.path.join(directory, 'bench.xlsx'), panexport.HEADERS_ORDER,
+                                 panexport.HEADERS_REMOVE, panexport.HEADERS_DEFAULT_MAP)
+    finally:
+        shutil.rmtree(directory)
+
+
+def bench_convert_to_ipobject(fixture):
+    pancompare.clear_address_caches()
+    for field in fixture.address_fields:
+        pancompare.convert_to_ipobject(field)
+
+
+def bench_convert_to_intervals(fixture):
+    pancompare.clear_address_caches()
+    for field in fixture.address_fields:
+        pancompare.convert_to_intervals(field)
+
+
+def bench_convert_repeated_addresses(fixture):
+    pancompare.clear_address_caches()
+    pancompare.convert_many_to_intervals(fixture.repeated_address_fields)
+
+
+def bench_filter_dataplane_rules(fixture):
+    pancompare.clear_address_caches()
+    pancompare.filter_dataplane_rules(fixture.dataplane, FILTERS)
+
+
+BENCHMARKS = OrderedDict([
+    ('parse_config', bench_parse_config),
+    ('combine_the_rulebase', bench_combine_the_rulebase),
+    ('write_to_excel', bench_write_to_excel),
+    ('convert_to_ipobject', bench_convert_to_ipobject),
+    ('convert_to_intervals', bench_convert_to_intervals),
+    ('convert_repeated_addresses', bench_convert_repeated_addresses),
+    ('filter_dataplane_rules', bench_filter_dataplane_rules),
+])
+
+
+def timed(function, *args, repeat=3):
+    """
+    :return: Fastest of repeat runs in seconds, the least disturbed by other load on the machine
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(*args)
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return best
+
+
+def calibrate():
+    """
+    :return: Seconds taken by a fixed pure Python workload, used to compare machines
+    """
+    def workload():
+        rng = random.Random(0)
+        values = sorted(rng.getrandbits(128) for _ in range(200000))
+        return sum(value >> 64 for value in values) + len({str(value)[:6] for value in values})
+    return timed(workload, repeat=5)
+
+
+def run_benchmarks(sizes, names, repeat=5):
+    """
+    :param sizes: Rule counts to generate
+    :param names: Names of the BENCHMARKS to run
+    :param repeat: Runs per benchmark, the fastest is kept
+    :return: OrderedDict of benchmark name to OrderedDict of size (as string) to seconds
+    """
+    results = OrderedDict((name, OrderedDict()) for name in names)
+    for size in sizes:
+        fixture = Fixture(size)
+        for name in names:
+            # The large sizes take long enough on their own
+            seconds = timed(BENCHMARKS[name], fixture, repeat=repeat if size < 50000 else 1)
+            results[name][str(size)] = seconds
+            print('{:<24} {:>7} rules {:>10.3f}s'.format(name, size, seconds), flush=True)
+    return results
+
+
+def compare_with_baselines(results, calibration, baselines, tolerance=DEFAULT_TOLERANCE):
+    """
+    :param results: Results of run_benchmarks
+    :param calibration: Result of calibrate on this machine
+    :param baselines: Stored baselines, as written by save_baselines
+    :param tolerance: Allowed slow down, 0.3 reports benchmarks over 30% slower than their baseline
+    :return: List of (name, size, seconds, expected seconds) for every regression
+    """
+    scale = calibration / baselines['calibration']
+    regressions = []
+    for name, sizes in results.items():
+        for size, seconds in sizes.items():
+            baseline = baselines['results'].get(name, {}).get(size)
+            if baseline is None:
+                continue
+            expected = baseline * scale
+            if seconds > expected * (1 + tolerance) and seconds - expected > MIN_REGRESSION_SECONDS:
+                regressions.append((name, size, seconds, expected))
+    return regressions
+
+
+def load_baselines(filename):
+    with open(filename, mode='r', encoding='utf-8') as file:
+        return json.load(file)
+
+
+def save_baselines(results, calibration, filename):
+    """
+    Stores results as baselines, keeping the baselines of benchmarks and sizes which weren't run.
+    """
+    baselines = {'calibration': calibration, 'python': sys.version.split()[0], 'results': {}}
+    if os.path.exists(filename):
+        previous = load_baselines(filename)
+        scale = calibration / previous['calibration']
+        for name, sizes in previous['results'].items():
+            baselines['results'][name] = {size: seconds * scale for size, seconds in sizes.items()}
+    for name, sizes in results.items():
+        baselines['results'].setdefault(name, {}).update(sizes)
+    with open(filename, mode='w', encoding='utf-8') as file:
+        json.dump(baselines, file, indent=2, sort_keys=True)
+        file.write('\n')
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark panexport and pancompare on synthetic rulebases.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='Rule counts to benchmark')
+    parser.add_argument('--benchmarks', nargs='+', choices=list(BENCHMARKS), default=list(BENCHMARKS),
+                        help='Benchmarks to run, all by default')
+    parser.add_argument('--repeat', type=int, default=5, help='Runs per benchmark, the fastest is kept')
+    parser.add_argument('--baselines', default=DEFAULT_BASELINES, help='Baseline file. Defaults to %(default)s')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='Allowed slow down before a benchmark counts as a regression. Defaults to %(default)s')
+    parser.add_argument('--save', action='store_true', help='Store the results as the new baselines')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    arguments = parse_arguments(argv)
+    calibration = calibrate()
+    print('Calibration: {:.3f}s'.format(calibration))
+    results = run_benchmarks(arguments.sizes, arguments.benchmarks, arguments.repeat)
+    if arguments.save:
+        save_baselines(results, calibration, arguments.baselines)
+        print('Baselines written to {}'.format(arguments.baselines))
+        return 0
+    if not os.path.exists(arguments.baselines):
+        print('No baselines found at {}, run with --save to create them'.format(arguments.baselines))
+        return 0
+    regressions = compare_with_baselines(results, calibration, load_baselines(arguments.baselines),
+                                         arguments.tolerance)
+    for name, size, seconds, expected in regressions:
+        print('REGRESSION {} at {} rules: {:.3f}s, baseline {:.3f}s'.format(name, size, seconds, expected))
+    if not regressions:
+        print('No regressions')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
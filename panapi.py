@@ -0,0 +1,333 @@
+"""
+Shared client for the PAN-OS XML API.
+
+Connections are kept alive and reused per host, the number of requests in flight is limited per host and overall,
+and transient failures are retried with jittered exponential back-off. Every request is timed in ApiMetrics.
+"""
+import http.client
+import random
+import re
+import ssl
+import threading
+import time
+from urllib.parse import urlencode
+from xml.etree import ElementTree
+
+import pan.xapi
+
+DEFAULT_MAX_PER_HOST = 2
+DEFAULT_MAX_TOTAL = 16
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 1.0
+DEFAULT_MAX_BACKOFF = 30.0
+DEFAULT_TIMEOUT = 120
+DEFAULT_TOTAL_TIMEOUT = 600
+
+# 429 is how Panorama and firewalls throttle API clients
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+QUOTED_ARGUMENT_REGEX = re.compile(r'^"(.*)"$')
+
+
+class PanApiError(pan.xapi.PanXapiError):
+    """
+    Raised when a request fails or the API answers with an error.
+    Subclasses pan.xapi.PanXapiError so existing handlers keep working.
+    """
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+def cmd_to_xml(cmd):
+    """
+    Turns an operational command into its XML form, the same way pan.xapi does for cmd_xml=True.
+    Quoted words are the text of the element before them.
+    :param cmd: ex. 'show config running' or 'show jobs id "5"'
+    :return: ex. '<show><config><running></running></config></show>'
+    """
+    words = cmd.split()
+    opened = []
+    xml = []
+    while words:
+        word = words.pop(0)
+        if words and QUOTED_ARGUMENT_REGEX.match(words[0]):
+            xml.append('<{0}>{1}</{0}>'.format(word, QUOTED_ARGUMENT_REGEX.match(words.pop(0)).group(1)))
+        else:
+            xml.append('<{}>'.format(word))
+            opened.append(word)
+    xml.extend('</{}>'.format(word) for word in reversed(opened))
+    return ''.join(xml)
+
+
+def parse_response(body):
+    """
+    Checks an API response and returns the content of its result element.
+    :param body: Response body as bytes or string
+    :return: The XML inside <result> as string, like pan.xapi.PanXapi.xml_result(). None when the result is empty.
+    """
+    try:
+        response = ElementTree.fromstring(body)
+    except ElementTree.ParseError as error:
+        raise PanApiError('invalid XML response: {}'.format(error))
+    if response.get('status') != 'success':
+        message = ' '.join(text.strip() for text in response.itertext() if text.strip())
+        raise PanApiError(message or 'request failed', response.get('code'))
+    result = response.find('result')
+    if result is None:
+        return None
+    content = (result.text or '') + ''.join(ElementTree.tostring(element, encoding='unicode') for element in result)
+    return content or None
+
+
+class ApiMetrics:
+    def __init__(self):
+        """
+        Thread safe request timings per host.
+        """
+        self.lock = threading.Lock()
+        self.hosts = {}
+
+    def record(self, hostname, seconds, attempts, succeeded):
+        """
+        :param hostname: Host the request went to
+        :param seconds: Time spent on the request including retries and back-off
+        :param attempts: Number of attempts made
+        :param succeeded: False if the request failed after all attempts
+        :return:
+        """
+        with self.lock:
+            host = self.hosts.setdefault(hostname, {'requests': 0, 'failures': 0, 'retries': 0,
+                                                    'total_seconds': 0.0, 'max_seconds': 0.0})
+            host['requests'] += 1
+            host['retries'] += attempts - 1
+            host['failures'] += 0 if succeeded else 1
+            host['total_seconds'] += seconds
+            host['max_seconds'] = max(host['max_seconds'], seconds)
+
+    def summary(self):
+        """
+        :return: Dictionary of hostname to requests, failures, retries, total_seconds, max_seconds and mean_seconds
+        """
+        with self.lock:
+            summary = {}
+            for hostname, host in self.hosts.items():
+                summary[hostname] = dict(host, mean_seconds=host['total_seconds'] / host['requests'])
+            return summary
+
+
+class PanApiClient:
+    def __init__(self, max_per_host=DEFAULT_MAX_PER_HOST, max_total=DEFAULT_MAX_TOTAL, retries=DEFAULT_RETRIES,
+                 backoff=DEFAULT_BACKOFF, max_backoff=DEFAULT_MAX_BACKOFF, timeout=DEFAULT_TIMEOUT,
+                 total_timeout=DEFAULT_TOTAL_TIMEOUT, use_http=False, port=None, verify_tls=True):
+        """
+        XML API client safe to share between threads.
+        :param max_per_host: Requests in flight to a single host at most, also the number of connections kept open
+        :param max_total: Requests in flight overall at most
+        :param retries: Retries of a request failing with a connection error, a timeout or a 429/5xx status
+        :param backoff: Base of the exponential back-off in seconds, each wait is random between 0 and the limit
+        :param max_backoff: Longest wait between two attempts in seconds
+        :param timeout: Socket timeout of a single attempt in seconds
+        :param total_timeout: No retry is started once a request has taken this many seconds
+        :param use_http: Use plain HTTP instead of HTTPS
+        :param port: Port to connect to, defaults to 80 or 443
+        :param verify_tls: Verify the firewall certificates, like pan.xapi does by default
+        """
+        self.max_per_host = max_per_host
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.total_timeout = total_timeout
+        self.use_http = use_http
+        self.port = port
+        self.ssl_context = ssl.create_default_context()
+        if not verify_tls:
+            self.ssl_context.check_hostname = False
+            self.ssl_context.verify_mode = ssl.CERT_NONE
+        self.metrics = ApiMetrics()
+        self.total_slots = threading.BoundedSemaphore(max_total)
+        self.lock = threading.Lock()
+        self.host_slots = {}
+        self.idle_connections = {}
+
+    def _host_slot(self, hostname):
+        with self.lock:
+            if hostname not in self.host_slots:
+                self.host_slots[hostname] = threading.BoundedSemaphore(self.max_per_host)
+                self.idle_connections[hostname] = []
+            return self.host_slots[hostname]
+
+    def _idle_connection(self, hostname):
+        """
+        :return: A kept-alive connection to the host, None when there is none
+        """
+        with self.lock:
+            if self.idle_connections[hostname]:
+                return self.idle_connections[hostname].pop()
+        return None
+
+    def _new_connection(self, hostname):
+        if self.use_http:
+            return http.client.HTTPConnection(hostname, self.port, timeout=self.timeout)
+        return http.client.HTTPSConnection(hostname, self.port, timeout=self.timeout, context=self.ssl_context)
+
+    def _release(self, hostname, connection):
+        with self.lock:
+            self.idle_connections[hostname].append(connection)
+
+    def _send(self, hostname, connection, body):
+        """
+        Sends a request over a connection, kept for the next request unless the server closes it.
+        :return: Tuple of (HTTP status, Retry-After header, response body)
+        """
+        try:
+            connection.request('POST', '/api/', body, {'Content-Type': 'application/x-www-form-urlencoded'})
+            response = connection.getresponse()
+            data = response.read()
+        except Exception:
+            connection.close()
+            raise
+        if response.will_close:
+            connection.close()
+        else:
+            self._release(hostname, connection)
+        return response.status, response.getheader('Retry-After'), data
+
+    def _attempt(self, hostname, body):
+        """
+        Sends a request over a pooled connection, holding a slot of the host and an overall slot while it does.
+        :return: Tuple of (HTTP status, Retry-After header, response body)
+        """
+        with self._host_slot(hostname), self.total_slots:
+            connection = self._idle_connection(hostname)
+            if connection is not None:
+                try:
+                    return self._send(hostname, connection, body)
+                except ConnectionError:
+                    # The server closed the connection while it was idle, the request never reached it
+                    pass
+            return self._send(hostname, self._new_connection(hostname), body)
+
+    def _wait(self, attempt, retry_after):
+        """
+        :return: Seconds to wait before the next attempt, random between 0 and the back-off limit ("full jitter")
+        """
+        wait = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+        if retry_after is not None and retry_after.isdigit():
+            wait = max(wait, min(self.max_backoff, int(retry_after)))
+        return wait
+
+    def request(self, hostname, params):
+        """
+        Sends an API request, retrying transient failures.
+        :param hostname: Hostname (FQDN) of the firewall or Panorama
+        :param params: Dictionary of query parameters, ex. {'type': 'op', 'cmd': '...', 'key': '...'}
+        :return: The XML inside the <result> of the response as string, see parse_response
+        """
+        body = urlencode(params)
+        start = time.monotonic()
+        attempt = 0
+        succeeded = False
+        try:
+            while True:
+                attempt += 1
+                retry_after = None
+                try:
+                    status, retry_after, data = self._attempt(hostname, body)
+                    error = None
+                except (OSError, http.client.HTTPException) as exception:
+                    status, data, error = None, None, exception
+                if status is not None and status not in RETRY_STATUSES:
+                    if status != 200:
+                        raise PanApiError('{}: HTTP {}'.format(hostname, status), status)
+                    result = parse_response(data)
+                    succeeded = True
+                    return result
+
+                wait = self._wait(attempt - 1, retry_after)
+                if attempt > self.retries or time.monotonic() - start + wait > self.total_timeout:
+                    if error is not None:
+                        raise PanApiError('{}: {}'.format(hostname, error))
+                    raise PanApiError('{}: HTTP {}'.format(hostname, status), status)
+                # The slots are free while waiting, other requests to the host go ahead meanwhile
+                time.sleep(wait)
+        finally:
+            self.metrics.record(hostname, time.monotonic() - start, attempt, succeeded)
+
+    def op(self, hostname, api_key, cmd):
+        """
+        Runs an operational command.
+        :param hostname: Hostname (FQDN) of the firewall or Panorama
+        :param api_key: API key
+        :param cmd: Command as text, ex. 'show config running', converted with cmd_to_xml. Commands which need
+        attributes, ex. <entry name="vsys1">, can't be written as text and are given as XML, starting with '<'.
+        :return: The XML inside the <result> of the response as string
+        """
+        if not cmd.startswith('<'):
+            cmd = cmd_to_xml(cmd)
+        return self.request(hostname, {'type': 'op', 'cmd': cmd, 'key': api_key})
+
+    def close(self):
+        """
+        Closes every idle connection.
+        """
+        with self.lock:
+            for connections in self.idle_connections.values():
+                for connection in connections:
+                    connection.close()
+                connections.clear()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """
+    :return: The client shared by the scripts, created with the defaults on first use
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = PanApiClient()
+        return _client
+
+
+def set_client(client):
+    """
+    Replaces the shared client, ex. with one configured from config.yml.
+    :param client: PanApiClient
+    :return:
+    """
+    global _client
+    with _client_lock:
+        _client = client
+
+
+def client_from_config(config):
+    """
+    Builds a client from the api_* options of config.yml.
+    :param config: Dictionary of the api_* options, missing options use the defaults
+    :return: PanApiClient
+    """
+    return PanApiClient(max_per_host=config.get('api_max_per_host', DEFAULT_MAX_PER_HOST),
+                        max_total=config.get('api_max_total', DEFAULT_MAX_TOTAL),
+                        retries=config.get('api_retries', DEFAULT_RETRIES),
+                        backoff=config.get('api_backoff', DEFAULT_BACKOFF),
+                        max_backoff=config.get('api_max_backoff', DEFAULT_MAX_BACKOFF),
+                        timeout=config.get('api_timeout', DEFAULT_TIMEOUT),
+                        total_timeout=config.get('api_total_timeout', DEFAULT_TOTAL_TIMEOUT),
+                        verify_tls=config.get('api_verify_tls', True))
+
+
+def print_metrics(metrics):  # pragma: no cover
+    summary = metrics.summary()
+    if not summary:
+        return
+    requests = sum(host['requests'] for host in summary.values())
+    retries = sum(host['retries'] for host in summary.values())
+    failures = sum(host['failures'] for host in summary.values())
+    slowest = max(summary.items(), key=lambda item: item[1]['max_seconds'])
+    print('{} API request(s), {} retried, {} failed. Slowest: {} ({:.2f}s)'.format(
+        requests, retries, failures, slowest[0], slowest[1]['max_seconds']))
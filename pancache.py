@@ -0,0 +1,188 @@
+"""
+On-disk cache of firewall configurations, used to skip firewalls whose configuration hasn't changed.
+
+Each entry is stored under <directory>/<hostname>/ as three files:
+<config>.xml (raw XML), <config>.parsed.json (parsed configuration) and <config>.meta.json (hash, fetch time,
+parse version and the options of the last export).
+"""
+import hashlib
+import json
+import os
+import time
+
+DEFAULT_CACHE_DIR = '.panexport_cache'
+DEFAULT_MAX_AGE_DAYS = 30
+DEFAULT_MAX_SIZE_MB = 512
+
+META_SUFFIX = '.meta.json'
+PARSED_SUFFIX = '.parsed.json'
+XML_SUFFIX = '.xml'
+
+# Bumped whenever what gets parsed out of a config changes, entries parsed by an older version are fetched again
+PARSE_VERSION = 2
+
+
+def content_hash(xml):
+    """
+    Hashes a raw configuration so it can be compared with the cached copy.
+    :param xml: Configuration XML as string
+    :return: Hex digest of the configuration
+    """
+    return hashlib.sha256(xml.encode('utf-8')).hexdigest()
+
+
+def _safe_name(name):
+    """
+    Makes a hostname or config name safe to use as a single path component.
+    """
+    return name.replace(os.sep, '_').replace('/', '_')
+
+
+def _atomic_write(path, data):
+    """
+    Writes a file so readers never see it half written.
+    """
+    temp_path = path + '.tmp'
+    with open(temp_path, mode='w', encoding='utf-8') as file:
+        file.write(data)
+    os.replace(temp_path, path)
+
+
+class ConfigCache:
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_age_days=DEFAULT_MAX_AGE_DAYS,
+                 max_size_mb=DEFAULT_MAX_SIZE_MB, use_when_unreachable=False):
+        """
+        :param directory: Directory the cache is kept in, created when needed
+        :param max_age_days: Entries older than this are evicted. None keeps entries forever.
+        :param max_size_mb: Oldest entries are evicted once the cache grows past this size. None for no limit.
+        :param use_when_unreachable: If True the cached config is used when a firewall can't be reached
+        """
+        self.directory = directory
+        self.max_age_days = max_age_days
+        self.max_size_mb = max_size_mb
+        self.use_when_unreachable = use_when_unreachable
+
+    def _path(self, hostname, config, suffix):
+        return os.path.join(self.directory, _safe_name(hostname), _safe_name(config) + suffix)
+
+    def _load_meta(self, hostname, config):
+        """
+        :return: The meta of the cached config or None if it isn't cached or was parsed by another PARSE_VERSION
+        """
+        try:
+            with open(self._path(hostname, config, META_SUFFIX), mode='r', encoding='utf-8') as file:
+                meta = json.load(file)
+        except (OSError, ValueError):
+            return None
+        if not isinstance(meta, dict) or meta.get('version') != PARSE_VERSION:
+            return None
+        return meta
+
+    def lookup_hash(self, hostname, config):
+        """
+        :return: The content hash of the cached config or None if it isn't cached
+        """
+        return (self._load_meta(hostname, config) or {}).get('hash')
+
+    def lookup_options(self, hostname, config):
+        """
+        :return: The output options fingerprint of the last export of the cached config, None if there is none
+        """
+        return (self._load_meta(hostname, config) or {}).get('options')
+
+    def load_parsed(self, hostname, config):
+        """
+        :return: The cached parsed configuration or None if it isn't cached
+        """
+        if self._load_meta(hostname, config) is None:
+            return None
+        try:
+            with open(self._path(hostname, config, PARSED_SUFFIX), mode='r', encoding='utf-8') as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    def load_xml(self, hostname, config):
+        """
+        :return: The cached raw configuration XML or None if it isn't cached
+        """
+        try:
+            with open(self._path(hostname, config, XML_SUFFIX), mode='r', encoding='utf-8') as file:
+                return file.read()
+        except OSError:
+            return None
+
+    def store(self, hostname, config, xml, parsed, options=None):
+        """
+        Stores a configuration, replacing any previously cached copy.
+        :param hostname: Firewall the configuration belongs to
+        :param config: Configuration type, ex. running
+        :param xml: Raw configuration XML as string
+        :param parsed: Parsed configuration, must be JSON serializable
+        :param options: Fingerprint of the output options the configuration was exported with
+        :return:
+        """
+        os.makedirs(os.path.join(self.directory, _safe_name(hostname)), exist_ok=True)
+        _atomic_write(self._path(hostname, config, XML_SUFFIX), xml)
+        _atomic_write(self._path(hostname, config, PARSED_SUFFIX), json.dumps(parsed))
+        # Meta is written last, an entry only counts as cached once it exists
+        _atomic_write(self._path(hostname, config, META_SUFFIX),
+                      json.dumps({'hash': content_hash(xml), 'fetched': time.time(), 'version': PARSE_VERSION,
+                                  'options': options}))
+
+    def store_options(self, hostname, config, options):
+        """
+        Records the output options an unchanged cached configuration was exported again with.
+        :param hostname: Firewall the configuration belongs to
+        :param config: Configuration type, ex. running
+        :param options: Fingerprint of the output options
+        :return:
+        """
+        meta = self._load_meta(hostname, config)
+        if meta is not None:
+            meta['options'] = options
+            _atomic_write(self._path(hostname, config, META_SUFFIX), json.dumps(meta))
+
+    def _entries(self):
+        """
+        :return: List of (modified time, size in bytes, [paths]) for every cached entry
+        """
+        entries = []
+        if not os.path.isdir(self.directory):
+            return entries
+        for host in os.listdir(self.directory):
+            host_dir = os.path.join(self.directory, host)
+            if not os.path.isdir(host_dir):
+                continue
+            for filename in os.listdir(host_dir):
+                if not filename.endswith(META_SUFFIX):
+                    continue
+                base = os.path.join(host_dir, filename[:-len(META_SUFFIX)])
+                paths = [base + suffix for suffix in (META_SUFFIX, PARSED_SUFFIX, XML_SUFFIX)]
+                existing = [path for path in paths if os.path.exists(path)]
+                entries.append((os.path.getmtime(paths[0]), sum(map(os.path.getsize, existing)), existing))
+        return entries
+
+    def evict(self, now=None):
+        """
+        Removes entries older than max_age_days, then the oldest entries until the cache fits in max_size_mb.
+        :param now: Current time as a unix timestamp, defaults to time.time()
+        :return: Number of entries removed
+        """
+        if now is None:
+            now = time.time()
+        entries = sorted(self._entries())
+        evicted = []
+        if self.max_age_days is not None:
+            oldest_allowed = now - self.max_age_days * 24 * 60 * 60
+            evicted = [entry for entry in entries if entry[0] < oldest_allowed]
+            entries = entries[len(evicted):]
+        if self.max_size_mb is not None:
+            total_size = sum(entry[1] for entry in entries)
+            while entries and total_size > self.max_size_mb * 1024 * 1024:
+                total_size -= entries[0][1]
+                evicted.append(entries.pop(0))
+        for entry in evicted:
+            for path in entry[2]:
+                os.remove(path)
+        return len(evicted)
@@ -2,21 +2,90 @@
 
 # noinspection PyPackageRequirements
 
+import argparse
+import bisect
+import csv
+import functools
+import io
+import json
+import os
 import re
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import NamedTuple
 
 import netaddr
-import pan.xapi
 import yaml
 
+import panapi
+import panfleet
+import panprofile
+import pansnapshot
+
+IPV4_RANGE_REGEX = re.compile(
+    r'([0-9]{1,3}\.[0-9]{1,3}\.[0-9]{1,3}\.[0-9]{1,3})-([0-9]{1,3}\.[0-9]{1,3}\.[0-9]{1,3}\.[0-9]{1,3})')
+IPV4_ADDRESS_REGEX = re.compile(
+    r'([0-9]{1,3}\.[0-9]{1,3}\.[0-9]{1,3}\.[0-9]{1,3}(?:\/[0-9]+)*)')
+IPV6_ADDRESS_REGEX = re.compile(
+    r'([0-9a-fA-F]{1,4}:[0-9a-fA-F]{1,4}:[0-9a-fA-F]{1,4}:[0-9a-fA-F]{1,4}:[0-9a-fA-F]{1,4}:[0-9a-fA-F]{1,4}:[0-9a-fA-F]{1,4}:[0-9a-fA-F]{1,4}(?:\/[0-9]+)*)')
+IP_HEX_REGEX = re.compile(r'0x([0-9a-f]+)(\/\d+)')
+# All of the above in a single pass, tried in the order convert_to_ipobject removes them from the string
+ADDRESS_TOKEN_REGEX = re.compile('|'.join(regex.pattern for regex in (
+    IP_HEX_REGEX, IPV4_RANGE_REGEX, IPV4_ADDRESS_REGEX, IPV6_ADDRESS_REGEX)))
+
+# Dataplanes repeat the same address strings ("any", shared lists) across many rules, conversions are cached per string
+ADDRESS_CACHE_SIZE = 4096
+
+DATAPLANE_HEADER_REGEX = re.compile(r'DP (dp\d+):')
+RULE_HEADER_REGEX = re.compile(r'\s*"(.+)"\s*\{\s*$')
+
+IPV6_MAX = (1 << 128) - 1
+
+PORT_MIN = 0
+PORT_MAX = 65535
+
+PROTOCOL_NUMBERS = {'1': 'icmp', '6': 'tcp', '17': 'udp', '58': 'icmp6'}
+
+# Dataplanes repeat the same application/service strings across many rules as well
+SERVICE_CACHE_SIZE = 1024
+
+# Dataplane parameters of rules which match every address except the listed ones
+NEGATE_PARAMETERS = {'source': 'negate-source', 'destination': 'negate-destination'}
+
+# Fields a filter expression can test and the parts of a rule each of them looks at
+FILTER_FIELDS = OrderedDict([
+    ('from_zone', ('from',)),
+    ('to_zone', ('to',)),
+    ('zone', ('from', 'to')),
+    ('source', ('source',)),
+    ('destination', ('destination',)),
+    ('address', ('source', 'destination')),
+    ('application', ('application',)),
+    ('service', ('service',)),
+    ('user', ('user',)),
+    ('action', ('action',)),
+    ('rule_name', ('rule_name',)),
+])
+FILTER_OPERATORS = ('and', 'or', 'not')
+# Keys of a filter laid out like rule_filters in config.yml
+RULE_FILTER_KEYS = ('zones', 'ip_addresses', 'rule_names')
+
 
 class Config:
     def __init__(self, filename):
-        with open(filename, 'r') as stream:
-            config = yaml.safe_load(stream)
+        """
+        :param filename: config.yml to read, None for the defaults of an offline run which needs no firewall details
+        """
+        config = {'top_domain': '', 'firewall_api_key': None, 'firewall_hostnames': []}
+        if filename is not None:
+            with open(filename, 'r') as stream:
+                config = yaml.safe_load(stream)
         self.top_domain = config['top_domain']
         self.firewall_api_key = config['firewall_api_key']
         self.firewall_hostnames = config['firewall_hostnames']
-        self.rule_filters = config['rule_filters']
+        self.rule_filters = config.get('rule_filters')
+        self.max_workers = config.get('max_workers', panfleet.DEFAULT_MAX_WORKERS)
+        self.api_options = {key: value for key, value in config.items() if key.startswith('api_')}
 
 
 def retrieve_dataplane(hostname, api_key):
@@ -26,10 +95,11 @@ def retrieve_dataplane(hostname, api_key):
     :param api_key:  API key to access firewall configuration
     :return: Dictionary containing dataplane or test unit if Debug is True
     """
-    firewall = pan.xapi.PanXapi(hostname=hostname, api_key=api_key)
     command = "show running security-policy"
-    firewall.op(cmd=command, cmd_xml=True)
-    return firewall.xml_result()
+    with panprofile.stage(hostname, 'fetch dataplane') as record:
+        dataplane = panapi.get_client().op(hostname, api_key, command)
+        record['bytes'] = len(dataplane or '')
+    return dataplane
 
 
 def hex_to_ipv6(hex):
@@ -60,7 +130,7 @@ def range_to_set(rangelist):
     """
     ipset = netaddr.IPSet()
     for ip_range in rangelist:
-        ipset.add(netaddr.IPRange(ip_range[0], ip_range[1]))
+        ipset.add(netaddr.IPRange(map_to_address(ip_range[0]), map_to_address(ip_range[1])))
     return ipset
 
 
@@ -68,46 +138,171 @@ def convert_to_ipobject(string):
     """
     Takes a large single string of mixed IP Address types and returns a netaddr.IPSet
     Utilizes several helper and map functions to complete.
+    Results are cached per string, each call returns its own copy which can be modified.
     :param string: A string of ip addresses, networks, ranges, hex values.
     :return: An IPSet of extracted IPs
     """
-    ipv4_range_regex = re.compile(
-        r'([0-9]{1,3}\.[0-9]{1,3}\.[0-9]{1,3}\.[0-9]{1,3})-([0-9]{1,3}\.[0-9]{1,3}\.[0-9]{1,3}\.[0-9]{1,3})')
-    ipv4_address_regex = re.compile(
-        r'([0-9]{1,3}\.[0-9]{1,3}\.[0-9]{1,3}\.[0-9]{1,3}(?:\/[0-9]+)*)')
-    ipv6_address_regex = re.compile(
-        r'([0-9a-fA-F]{1,4}:[0-9a-fA-F]{1,4}:[0-9a-fA-F]{1,4}:[0-9a-fA-F]{1,4}:[0-9a-fA-F]{1,4}:[0-9a-fA-F]{1,4}:[0-9a-fA-F]{1,4}:[0-9a-fA-F]{1,4}(?:\/[0-9]+)*)')
-    ip_hex_regex = re.compile(r'0x([0-9a-f]+)(\/\d+)')
+    return _convert_to_ipset(string).copy()
+
+
+@functools.lru_cache(maxsize=ADDRESS_CACHE_SIZE)
+def _convert_to_ipset(string):
+    # The merged intervals turn into the CIDRs of the set without netaddr having to merge them again
+    cidrs = []
+    for first, last in convert_to_intervals(string):
+        cidrs.extend(netaddr.iprange_to_cidrs(netaddr.IPAddress(first, 6), netaddr.IPAddress(last, 6)))
+    return netaddr.IPSet(cidrs)
+
+
+def ipv4_to_int(ip):
+    """
+    Takes a dotted quad IPv4 address and returns it as an integer in IPv6 space.
+    Like map_to_address the address is IPv4-compatible, i.e. in the ::/96 range.
+    :param ip: IPv4 address as string, ex. '192.168.1.1'
+    :return: Integer
+    """
+    octets = ip.split('.')
+    value = 0
+    for octet in octets:
+        octet = int(octet)
+        if octet > 255:
+            raise netaddr.AddrFormatError('invalid IPv4 address: {}'.format(ip))
+        value = (value << 8) | octet
+    return value
+
+
+def network_to_interval(value, prefixlen):
+    """
+    Takes an IPv6 integer and prefix length and returns the first and last address of the network.
+    Host bits are ignored, same as netaddr.IPSet does.
+    :param value: IPv6 (or IPv4-compatible) address as integer
+    :param prefixlen: Prefix length in IPv6 bits
+    :return: Tuple of (first, last) integers
+    """
+    host_mask = IPV6_MAX >> prefixlen
+    first = value & ~host_mask & IPV6_MAX
+    return first, first | host_mask
+
+
+def merge_intervals(intervals):
+    """
+    Sorts a list of (first, last) integer intervals and merges the ones which overlap or touch.
+    :param intervals: Iterable of (first, last) tuples
+    :return: Sorted tuple of non overlapping (first, last) tuples
+    """
+    merged = []
+    for first, last in sorted(intervals):
+        if merged and first <= merged[-1][1] + 1:
+            if last > merged[-1][1]:
+                merged[-1] = (merged[-1][0], last)
+        else:
+            merged.append((first, last))
+    return tuple(merged)
 
+
+@functools.lru_cache(maxsize=ADDRESS_CACHE_SIZE)
+def convert_to_intervals(string):
+    """
+    Takes the same strings as convert_to_ipobject but returns integer intervals instead of a netaddr.IPSet.
+    IPv4 addresses, networks and ranges are mapped into IPv6 the same way map_to_address does.
+    Results are cached per string, and per address within the string as lists share most of their addresses.
+    :param string: A string of ip addresses, networks, ranges, hex values.
+    :return: Sorted tuple of non overlapping (first, last) integer tuples
+    """
     if string == 'any':
-        return netaddr.IPSet([netaddr.IPNetwork('::/0')])
-
-    # Look for Hexes first, convert them to form netaddr can understand
-    hex_addresses = ip_hex_regex.findall(string)
-    converted_hex_list = []
-    if len(hex_addresses) > 0:
-        for address in hex_addresses:
-            ipv6 = hex_to_ipv6(address[0]) + address[1]
-            converted_hex_list.append(ipv6)
-    iphex_objects = list(map(map_to_address, converted_hex_list))
-    string = ip_hex_regex.sub('', string)
-
-    # Look for Ranges second and remove from string, also convert them to range objects.
-    # This allows us to reduce complexity of the ip address regex.
-    # I'm not using a map like the other devices to due a bug in netaddr reported issue 121
-    ip_ranges = ipv4_range_regex.findall(string)
-    ipset_ranges = range_to_set(ip_ranges)
-    string = ipv4_range_regex.sub('', string)
-
-    # Find IPAddresses
-    ipv4_addresses = ipv4_address_regex.findall(string)
-    ipv6_addresses = ipv6_address_regex.findall(string)
-    ipv4_address_objects = list(map(map_to_address, ipv4_addresses))
-    ipv6_address_objects = list(map(map_to_address, ipv6_addresses))
-
-    # Combine Both Sets
-    ipset_add_hex = netaddr.IPSet(ipv4_address_objects + ipv6_address_objects + iphex_objects)
-    return ipset_ranges | ipset_add_hex
+        return ((0, IPV6_MAX),)
+    # No address contains whitespace, so the words can be converted on their own
+    intervals = []
+    for word in string.split():
+        intervals.extend(_word_to_intervals(word))
+    return merge_intervals(intervals)
+
+
+@functools.lru_cache(maxsize=ADDRESS_CACHE_SIZE * 16)
+def _word_to_intervals(word):
+    intervals = []
+    for match in ADDRESS_TOKEN_REGEX.finditer(word):
+        hex_address, hex_prefix, range_first, range_last, ipv4_address, ipv6_address = match.groups()
+        if hex_address is not None:
+            intervals.append(network_to_interval(int(hex_address, 16), int(hex_prefix[1:])))
+        elif range_first is not None:
+            intervals.append((ipv4_to_int(range_first), ipv4_to_int(range_last)))
+        elif ipv4_address is not None:
+            ip, _, prefix = ipv4_address.partition('/')
+            intervals.append(network_to_interval(ipv4_to_int(ip), int(prefix.split('/')[0]) + 96 if prefix else 128))
+        else:
+            ip, _, prefix = ipv6_address.partition('/')
+            value = 0
+            for group in ip.split(':'):
+                value = (value << 16) | int(group, 16)
+            intervals.append(network_to_interval(value, int(prefix.split('/')[0]) if prefix else 128))
+    return tuple(intervals)
+
+
+def convert_many_to_intervals(strings):
+    """
+    Converts the address strings of many rules at once, each distinct string is only converted once.
+    :param strings: Iterable of strings as taken by convert_to_intervals
+    :return: List of the intervals of each string, in the same order
+    """
+    converted = {}
+    intervals = []
+    for string in strings:
+        if string not in converted:
+            converted[string] = convert_to_intervals(string)
+        intervals.append(converted[string])
+    return intervals
+
+
+def clear_address_caches():
+    """
+    Empties the caches of convert_to_intervals and convert_to_ipobject, ex. to time them cold.
+    """
+    convert_to_intervals.cache_clear()
+    _word_to_intervals.cache_clear()
+    _convert_to_ipset.cache_clear()
+
+
+class IPIntervalIndex:
+    def __init__(self, intervals):
+        """
+        A compiled, sorted set of address intervals which can be tested for overlap with a binary search.
+        :param intervals: Iterable of (first, last) integer tuples
+        """
+        merged = merge_intervals(intervals)
+        self.firsts = [first for first, _ in merged]
+        self.lasts = [last for _, last in merged]
+
+    @classmethod
+    def from_networks(cls, networks):
+        """
+        Compiles a list of filter networks into an index.
+        :param networks: List of IPs or networks as strings, ex. ['198.51.100.0/24', '2001:db8::1']
+        :return: IPIntervalIndex
+        """
+        intervals = []
+        for network in map(map_to_address, networks):
+            if isinstance(network, netaddr.IPNetwork):
+                intervals.append((network.first, network.last))
+            else:
+                intervals.append((int(network), int(network)))
+        return cls(intervals)
+
+    def __len__(self):
+        return len(self.firsts)
+
+    def overlaps(self, intervals):
+        """
+        Checks if any of the given intervals shares at least one address with the index.
+        :param intervals: Iterable of (first, last) integer tuples, as returned by convert_to_intervals
+        :return: True if there is any overlap
+        """
+        for first, last in intervals:
+            # The only candidate is the last indexed interval starting at or before the end of this one
+            position = bisect.bisect_right(self.firsts, last) - 1
+            if position >= 0 and self.lasts[position] >= first:
+                return True
+        return False
 
 
 def split_multiple_zones(zone_string):
@@ -166,6 +361,11 @@ def filter_the_things(rule, subkeylist, filterlist):
     :param filterlist: Filterlist
     :return: Matching rules as set
     """
+    if isinstance(filterlist, IPIntervalIndex):
+        for subkey in subkeylist:
+            if filterlist.overlaps(rule[1][subkey]):
+                return rule[0]
+        return None
     if isinstance(filterlist, netaddr.IPSet):
         filters = filterlist
         values = netaddr.IPSet()
@@ -184,81 +384,790 @@ def filter_the_things(rule, subkeylist, filterlist):
     return None
 
 
-def filter_dataplane_rules(dataplane_raw, filters):
-    # Define Regex Matches
-    dataplane_regex = re.compile('DP dp0:\n\n(.+)\n\nDP dp1:', re.DOTALL)
-    find_rules_regex = re.compile(r"""
-        "(.+?)"     # Find Rule Name
-        \s          # Skip WhiteSpace
-        ({.+?})     # Find Variables in Rule
-        """, re.VERBOSE)
-    parameters_regex = re.compile(r"""
-        (\w+)       # Parameter Name
-        \s          # Whitespace
-        (.+?)       # Parameter
-        ;           # End of Parameter String
-        """, re.VERBOSE)
-
-    # Strip \n and focus only on first dataplane
-    # We are assuming dataplanes match because otherwise you need to call PaloAlto TAC Support
-    dataplane_stripped = re.sub('\n', '', (dataplane_regex.search(dataplane_raw).group(1)))
-
-    # Gather the raw_rules including parameters and create empty dictionary
-    raw_rules = find_rules_regex.findall(dataplane_stripped)
-    dataplane_rules = {}
-
-    # Iterate over the raw_rules to tease out the parameters and store
-    # We will also drop any rules in the hard filter list at this time
-    matched_rulelist_static = set()
-    for rule in raw_rules:
-        rule_name = rule[0]
-        if rule_name in filters['rule_names']['include']:
-            matched_rulelist_static.add(rule_name)
-        elif rule_name in filters['rule_names']['exclude']:
+class DataplaneRule(NamedTuple):
+    """
+    A single rule as found in the "show running security-policy" output.
+    Zones are split into tuples, everything else is kept as the raw dataplane string.
+    """
+    name: str
+    from_zones: tuple
+    to_zones: tuple
+    source: str
+    destination: str
+    application_service: str
+    action: str
+    parameters: dict
+
+
+class ServiceEntry(NamedTuple):
+    """
+    One application/protocol/source-port/destination-port entry of a dataplane rule.
+    Application and protocol are 'any' when not restricted, ports are (first, last) tuples.
+    """
+    application: str
+    protocol: str
+    source_ports: tuple
+    destination_ports: tuple
+
+
+ANY_SERVICE = ServiceEntry('any', 'any', (PORT_MIN, PORT_MAX), (PORT_MIN, PORT_MAX))
+
+
+def parse_ports(ports):
+    """
+    Takes a dataplane port field and returns the port ranges it contains.
+    :param ports: 'any', a port '443', a range '1024-65535' or a comma separated list of those
+    :return: List of (first, last) tuples
+    """
+    if ports == 'any':
+        return [(PORT_MIN, PORT_MAX)]
+    ranges = []
+    for port in ports.split(','):
+        first, _, last = port.partition('-')
+        ranges.append((int(first), int(last or first)))
+    return ranges
+
+
+@functools.lru_cache(maxsize=SERVICE_CACHE_SIZE)
+def parse_application_service(string):
+    """
+    Takes the application/service field of a dataplane rule and returns its entries.
+    Entries which aren't application/protocol/source ports/destination ports are skipped.
+    :param string: ex. 'any', 'icmp/icmp/any/any' or '[ any/tcp/any/20 ssl/tcp/any/443 ]'
+    :return: Tuple of ServiceEntry
+    """
+    entries = []
+    for token in string.replace('[', ' ').replace(']', ' ').split():
+        if token == 'any':
+            entries.append(ANY_SERVICE)
+            continue
+        parts = token.split('/')
+        if len(parts) != 4:
+            continue
+        application, protocol, source_ports, destination_ports = parts
+        try:
+            source_ranges, destination_ranges = parse_ports(source_ports), parse_ports(destination_ports)
+        except ValueError:
+            continue
+        for source_range in source_ranges:
+            for destination_range in destination_ranges:
+                entries.append(ServiceEntry(application, protocol, source_range, destination_range))
+    return tuple(entries)
+
+
+def normalize_protocol(protocol):
+    """
+    :param protocol: Protocol name or number, ex. 'TCP' or '6'
+    :return: Lower case protocol name as used by the dataplane, ex. 'tcp'
+    """
+    protocol = str(protocol).strip().lower()
+    return PROTOCOL_NUMBERS.get(protocol, protocol)
+
+
+def _zones_to_tuple(zone_string):
+    """
+    Wraps split_multiple_zones so a single multi-word zone comes back as a tuple as well.
+    """
+    zones = split_multiple_zones(zone_string)
+    if isinstance(zones, str):
+        return (zones,)
+    return tuple(zones)
+
+
+def _parse_parameter(statement):
+    """
+    Splits a rule statement such as 'source [ 10.0.0.1 10.0.0.2 ];' or 'icmp-unreachable: no' in key and value.
+    """
+    statement = statement.strip()
+    if statement.endswith(';'):
+        statement = statement[:-1]
+    key, _, value = statement.partition(' ')
+    return key.rstrip(':'), value.strip()
+
+
+def _build_rule(name, parameters):
+    return DataplaneRule(
+        name=name,
+        from_zones=_zones_to_tuple(parameters.get('from', '')),
+        to_zones=_zones_to_tuple(parameters.get('to', '')),
+        source=parameters.get('source', ''),
+        destination=parameters.get('destination', ''),
+        application_service=parameters.get('application/service', ''),
+        action=parameters.get('action', ''),
+        parameters=parameters,
+    )
+
+
+def iter_dataplane_sections(source):
+    """
+    Reads "show running security-policy" output line by line and yields every rule of every dataplane.
+    Rules found before the first "DP dpN:" header are treated as dp0.
+    :param source: Dataplane output as a string, a file-like object or any iterable of lines
+    :return: Generator of (dataplane name, DataplaneRule) tuples, ex. ('dp0', DataplaneRule(...))
+    """
+    if isinstance(source, str):
+        source = io.StringIO(source)
+    dataplane = 'dp0'
+    name = None
+    parameters = None
+    statement = ''
+    for line in source:
+        if name is None:
+            header = DATAPLANE_HEADER_REGEX.search(line)
+            if header:
+                dataplane = header.group(1)
+                continue
+            rule_header = RULE_HEADER_REGEX.match(line)
+            if rule_header:
+                name = rule_header.group(1)
+                parameters = {}
             continue
+
+        if not statement and line.strip() == '}':
+            yield dataplane, _build_rule(name, parameters)
+            name = None
+            continue
+        statement += line.strip() if not statement else ' ' + line.strip()
+        # Lists may be wrapped over several lines, wait until they are closed
+        if not statement or statement.count('[') > statement.count(']'):
+            continue
+        key, value = _parse_parameter(statement)
+        parameters[key] = value
+        statement = ''
+
+
+def iter_dataplane_rules(source, dataplane='dp0'):
+    """
+    Yields the rules of a single dataplane, see iter_dataplane_sections.
+    Reading stops as soon as the requested dataplane has been read.
+    :param source: Dataplane output as a string, a file-like object or any iterable of lines
+    :param dataplane: Name of the dataplane to return, defaults to dp0
+    :return: Generator of DataplaneRule
+    """
+    found = False
+    for rule_dataplane, rule in iter_dataplane_sections(source):
+        if rule_dataplane == dataplane:
+            found = True
+            yield rule
+        elif found:
+            return
+
+
+def split_dataplane_sections(source):
+    """
+    Splits "show running security-policy" output into one chunk of text per dataplane.
+    Lines before the first "DP dpN:" header are treated as dp0.
+    :param source: Dataplane output as a string, a file-like object or any iterable of lines
+    :return: OrderedDict of dataplane name to the text of its section, in the order they were found
+    """
+    if isinstance(source, str):
+        source = io.StringIO(source)
+    sections = OrderedDict()
+    lines = sections.setdefault('dp0', [])
+    for line in source:
+        header = DATAPLANE_HEADER_REGEX.search(line)
+        if header:
+            lines = sections.setdefault(header.group(1), [])
+        else:
+            lines.append(line)
+    if not any(line.strip() for line in sections['dp0']):
+        del sections['dp0']
+    return OrderedDict((dataplane, ''.join(lines)) for dataplane, lines in sections.items())
+
+
+def parse_dataplane_section(section):
+    """
+    Parses the text of a single dataplane section as returned by split_dataplane_sections.
+    :param section: Text of the section without its "DP dpN:" header
+    :return: List of DataplaneRule in dataplane order
+    """
+    return [rule for _, rule in iter_dataplane_sections(section)]
+
+
+def parse_dataplanes(source, processes=None):
+    """
+    Parses every dataplane section, optionally in a pool of processes with one section per task.
+    :param source: Dataplane output as a string, a file-like object or any iterable of lines
+    :param processes: Number of worker processes. None or 1 parses in the current process.
+    :return: OrderedDict of dataplane name to its list of DataplaneRule
+    """
+    sections = split_dataplane_sections(source)
+    if processes is None or processes <= 1 or len(sections) <= 1:
+        parsed = map(parse_dataplane_section, sections.values())
+        return OrderedDict(zip(sections, parsed))
+    with ProcessPoolExecutor(max_workers=min(processes, len(sections))) as executor:
+        parsed = executor.map(parse_dataplane_section, sections.values())
+        return OrderedDict(zip(sections, parsed))
+
+
+def longest_increasing_subsequence(values):
+    """
+    :param values: List of distinct numbers
+    :return: Set of the indexes into values forming one longest increasing subsequence, in O(n log n)
+    """
+    tails = []
+    tail_indexes = []
+    previous = [None] * len(values)
+    for index, value in enumerate(values):
+        position = bisect.bisect_left(tails, value)
+        if position == len(tails):
+            tails.append(value)
+            tail_indexes.append(index)
+        else:
+            tails[position] = value
+            tail_indexes[position] = index
+        previous[index] = tail_indexes[position - 1] if position else None
+
+    subsequence = set()
+    index = tail_indexes[-1] if tail_indexes else None
+    while index is not None:
+        subsequence.add(index)
+        index = previous[index]
+    return subsequence
+
+
+def find_dataplane_differences(dataplanes):
+    """
+    Compares the compiled rules of every dataplane against each other.
+    :param dataplanes: Dictionary of dataplane name to list of DataplaneRule, as returned by parse_dataplanes
+    :return: OrderedDict of rule name to an OrderedDict of dataplane name to (position, DataplaneRule), or None when
+    the dataplane doesn't have the rule. Only rules which are missing from a dataplane, compiled differently or out
+    of order are included. A rule is out of order when it isn't part of the longest run of rules a dataplane has
+    in the same order as the first one, so a missing rule doesn't make every later rule differ.
+    """
+    positions = OrderedDict()
+    for dataplane, rules in dataplanes.items():
+        for position, rule in enumerate(rules):
+            positions.setdefault(rule.name, OrderedDict())[dataplane] = (position, rule)
+
+    names = list(dataplanes)
+    common = [name for name, found in positions.items() if len(found) == len(dataplanes)]
+    moved = set()
+    for dataplane in names[1:]:
+        in_dataplane = sorted(common, key=lambda name: positions[name][dataplane][0])
+        in_order = longest_increasing_subsequence([positions[name][names[0]][0] for name in in_dataplane])
+        moved.update(name for index, name in enumerate(in_dataplane) if index not in in_order)
+
+    differences = OrderedDict()
+    for name, found in positions.items():
+        compiled = set(tuple(sorted(rule.parameters.items())) for _, rule in found.values())
+        if len(found) != len(dataplanes) or len(compiled) > 1 or name in moved:
+            differences[name] = OrderedDict((dataplane, found.get(dataplane)) for dataplane in dataplanes)
+    return differences
+
+
+class IntervalTree:
+    def __init__(self, items):
+        """
+        Static interval tree over a sorted list, built once and queried for every interval overlapping a range.
+        Each element of the sorted list is the root of the sublist around it and stores the largest end found
+        in that sublist, so whole sublists ending before the queried range are skipped.
+        :param items: Iterable of (first, last, value) tuples
+        """
+        items = sorted(items, key=lambda item: (item[0], item[1]))
+        self.firsts = [item[0] for item in items]
+        self.lasts = [item[1] for item in items]
+        self.values = [item[2] for item in items]
+        self.max_lasts = list(self.lasts)
+        self._build(0, len(items))
+
+    def _build(self, low, high):
+        if low >= high:
+            return -1
+        middle = (low + high) // 2
+        self.max_lasts[middle] = max(self.lasts[middle], self._build(low, middle), self._build(middle + 1, high))
+        return self.max_lasts[middle]
+
+    def __len__(self):
+        return len(self.firsts)
+
+    def query(self, first, last):
+        """
+        :return: Generator of the values of every interval sharing at least one point with first-last
+        """
+        stack = [(0, len(self.firsts))]
+        while stack:
+            low, high = stack.pop()
+            if low >= high:
+                continue
+            middle = (low + high) // 2
+            if self.max_lasts[middle] < first:
+                continue
+            stack.append((low, middle))
+            if self.firsts[middle] <= last:
+                if self.lasts[middle] >= first:
+                    yield self.values[middle]
+                stack.append((middle + 1, high))
+
+
+def intervals_cover(outer, inner):
+    """
+    Checks if every address of inner is also in outer.
+    :param outer: Sorted tuple of non overlapping (first, last) integer tuples, as returned by merge_intervals
+    :param inner: Iterable of (first, last) integer tuples
+    :return: True if outer contains all of inner
+    """
+    firsts = [first for first, _ in outer]
+    for first, last in inner:
+        position = bisect.bisect_right(firsts, first) - 1
+        if position < 0 or outer[position][1] < last:
+            return False
+    return True
+
+
+def _ranges_overlap(first, last, ranges):
+    return any(first <= range_last and range_first <= last for range_first, range_last in ranges)
+
+
+class RulebaseIndex:
+    def __init__(self, rules):
+        """
+        Index of a parsed dataplane which many filters can be evaluated against without parsing it again.
+        Every rule is a bit at its dataplane position. Zones, applications, users, actions and names map to the bitmask
+        of the rules using them. Addresses are kept in interval trees, and so are destination ports, one tree per
+        protocol. A filter expression is evaluated with a few bitwise operations over the whole rulebase instead of
+        rule by rule.
+        Rules negating their source or destination match every address but the listed ones.
+        :param rules: Iterable of DataplaneRule in dataplane order
+        """
+        self.rules = OrderedDict((rule.name, rule) for rule in rules)
+        self.names = list(self.rules)
+        self.all_rules = (1 << len(self.names)) - 1
+        self.members = {'from': {}, 'to': {}, 'application': {}, 'user': {}, 'action': {}, 'rule_name': {}}
+        # Rules allowing any application or user match every application or user filter
+        self.any_members = {'application': 0, 'user': 0}
+        self.negated = {'source': [], 'destination': []}
+        address_items = {'source': [], 'destination': []}
+        rules = list(self.rules.values())
+        self.services = [parse_application_service(rule.application_service) for rule in rules]
+        # Rules with an 'any' service entry match every service filter
+        self.any_service = 0
+        port_items = {}
+        for position, (rule, entries) in enumerate(zip(rules, self.services)):
+            bit = 1 << position
+            for entry in entries:
+                if entry.protocol == 'any':
+                    self.any_service |= bit
+                else:
+                    port_items.setdefault(entry.protocol, []).append(
+                        (entry.destination_ports[0], entry.destination_ports[1], position))
+            for part, values in (('from', rule.from_zones), ('to', rule.to_zones),
+                                 ('application', {entry.application for entry in entries}),
+                                 ('user', _zones_to_tuple(rule.parameters.get('user', 'any'))),
+                                 ('action', (rule.action,)),
+                                 ('rule_name', (rule.name,))):
+                for value in values:
+                    if value == 'any' and part in self.any_members:
+                        self.any_members[part] |= bit
+                    else:
+                        self.members[part][value] = self.members[part].get(value, 0) | bit
+        for direction in address_items:
+            addresses = convert_many_to_intervals(getattr(rule, direction) for rule in rules)
+            for position, (rule, intervals) in enumerate(zip(rules, addresses)):
+                if rule.parameters.get(NEGATE_PARAMETERS[direction]) == 'yes':
+                    self.negated[direction].append((position, intervals))
+                else:
+                    address_items[direction].extend((first, last, position) for first, last in intervals)
+        self.addresses = {direction: IntervalTree(items) for direction, items in address_items.items()}
+        self.ports = {protocol: IntervalTree(items) for protocol, items in port_items.items()}
+        # Filters in a batch share most of their fields, each mask is only computed once
+        self._masks = {}
+
+    def rule_names(self, mask):
+        """
+        :param mask: Bitmask of rule positions
+        :return: Set of the names of the rules in the mask
+        """
+        bits = bin(mask)[:1:-1]
+        return {self.names[position] for position, bit in enumerate(bits) if bit == '1'}
+
+    def _address_mask(self, direction, intervals):
+        mask = 0
+        for first, last in intervals:
+            for position in self.addresses[direction].query(first, last):
+                mask |= 1 << position
+        # A negated rule shares an address with the filter unless it excludes all of the filter
+        for position, excluded in self.negated[direction]:
+            if intervals and not intervals_cover(excluded, intervals):
+                mask |= 1 << position
+        return mask
+
+    def _service_mask(self, services):
+        mask = 0
+        for application, protocol, ranges in services:
+            found = self.any_service
+            if protocol in self.ports:
+                for first, last in ranges:
+                    for position in self.ports[protocol].query(first, last):
+                        found |= 1 << position
+            if application is not None:
+                # The trees only know ports, the application has to be allowed by the same entry
+                candidates, found = found, 0
+                while candidates:
+                    lowest = candidates & -candidates
+                    if any(entry.application in ('any', application) and entry.protocol in ('any', protocol) and
+                           _ranges_overlap(entry.destination_ports[0], entry.destination_ports[1], ranges)
+                           for entry in self.services[lowest.bit_length() - 1]):
+                        found |= lowest
+                    candidates ^= lowest
+            mask |= found
+        return mask
+
+    def match_mask(self, part, values):
+        """
+        :param part: 'from', 'to', 'source', 'destination', 'application', 'service', 'user', 'action' or
+        'rule_name'
+        :param values: Tuple of values, for source and destination a tuple of (first, last) address intervals, for
+        service a tuple of (application or None, protocol, destination port ranges) as returned by
+        parse_service_filter
+        :return: Bitmask of the rules matching at least one of the values in that part
+        """
+        key = (part, values)
+        if key not in self._masks:
+            if part in self.addresses:
+                mask = self._address_mask(part, values)
+            elif part == 'service':
+                mask = self._service_mask(values)
+            else:
+                mask = self.any_members.get(part, 0) if values else 0
+                for value in values:
+                    mask |= self.members[part].get(value, 0)
+            self._masks[key] = mask
+        return self._masks[key]
+
+    def evaluate(self, expression):
+        """
+        :param expression: Compiled filter expression, as returned by compile_filter
+        :return: Bitmask of the rules matching the expression
+        """
+        operator = expression[0]
+        if operator == 'match':
+            return self.match_mask(expression[1], expression[2])
+        if operator == 'not':
+            return self.all_rules & ~self.evaluate(expression[1])
+        if operator == 'and':
+            mask = self.all_rules
+            for operand in expression[1]:
+                mask &= self.evaluate(operand)
+                if not mask:
+                    break
+            return mask
+        mask = 0
+        for operand in expression[1]:
+            mask |= self.evaluate(operand)
+            if mask == self.all_rules:
+                break
+        return mask
+
+    def rules_in_zones(self, direction, zones):
+        """
+        :param direction: 'from' or 'to'
+        :param zones: Iterable of zone names
+        :return: Set of names of the rules with at least one of the zones in that direction
+        """
+        return self.rule_names(self.match_mask(direction, tuple(zones)))
+
+    def rules_overlapping(self, direction, ip_filter):
+        """
+        :param direction: 'source' or 'destination'
+        :param ip_filter: IPIntervalIndex of the filter addresses
+        :return: Set of names of the rules sharing at least one address with the filter in that direction
+        """
+        return self.rule_names(self.match_mask(direction, tuple(zip(ip_filter.firsts, ip_filter.lasts))))
+
+    def rules_with_services(self, services):
+        """
+        :param services: Iterable of service filters, ex. 'tcp/443', see parse_service_filter
+        :return: Set of names of the rules allowing at least one of the services
+        """
+        return self.rule_names(self.match_mask('service', tuple(parse_service_filter(service)
+                                                                for service in services)))
+
+
+class FilterError(ValueError):
+    pass
+
+
+def _as_list(value):
+    if value is None:
+        return []
+    if isinstance(value, (str, int)):
+        return [value]
+    return list(value)
+
+
+def normalize_filter(filters):
+    """
+    Fills in the optional parts of a rule filter and turns single values into lists.
+    :param filters: Rule filter as found in config.yml
+    :return: Dictionary with zones, ip_addresses and rule_names include/exclude lists
+    """
+    filters = filters or {}
+    rule_names = filters.get('rule_names') or {}
+    return {
+        'zones': _as_list(filters.get('zones')),
+        'ip_addresses': _as_list(filters.get('ip_addresses')),
+        'rule_names': {
+            'include': _as_list(rule_names.get('include')),
+            'exclude': _as_list(rule_names.get('exclude')),
+        },
+    }
+
+
+def _compile_networks(networks):
+    try:
+        ip_filter = IPIntervalIndex.from_networks([str(network) for network in networks])
+    except (netaddr.AddrFormatError, ValueError) as error:
+        raise FilterError('Invalid address in filter: {}'.format(error)) from error
+    return tuple(zip(ip_filter.firsts, ip_filter.lasts))
+
+
+def parse_service_filter(value):
+    """
+    Parses a service filter, [application/]protocol[/ports] where ports is a port, a range or a comma separated
+    list of those. ex. 'tcp/443', 'udp', '6/8000-8100' or 'ssl/tcp/443'.
+    :param value: Service filter as string
+    :return: Tuple of (application or None, protocol, tuple of (first, last) destination port ranges)
+    :raises FilterError: On a malformed filter
+    """
+    parts = str(value).strip().split('/')
+    if len(parts) > 3 or not all(parts):
+        raise FilterError('Invalid service "{}", expected [application/]protocol[/ports]'.format(value))
+    application = parts.pop(0) if len(parts) == 3 else None
+    protocol = normalize_protocol(parts[0])
+    if protocol == 'any':
+        raise FilterError('Invalid service "{}", a service filter names a protocol'.format(value))
+    try:
+        ranges = tuple(parse_ports(parts[1] if len(parts) == 2 else 'any'))
+    except ValueError:
+        raise FilterError('Invalid ports in service "{}"'.format(value)) from None
+    if not all(PORT_MIN <= first <= last <= PORT_MAX for first, last in ranges):
+        raise FilterError('Invalid ports in service "{}"'.format(value))
+    return application, protocol, ranges
+
+
+def _compile_rule_filter(filters):
+    """
+    Compiles a filter laid out like rule_filters in config.yml. A rule matches when one of its source zones and
+    source addresses, or one of its destination zones and destination addresses, are in the filter.
+    Rules named in rule_names include/exclude are always/never returned.
+    """
+    filters = normalize_filter(filters)
+    zones = tuple(filters['zones'])
+    networks = _compile_networks(filters['ip_addresses'])
+    include = ('match', 'rule_name', tuple(filters['rule_names']['include']))
+    exclude = ('match', 'rule_name', tuple(filters['rule_names']['exclude']))
+    matched = ('or', (('and', (('match', 'from', zones), ('match', 'source', networks))),
+                      ('and', (('match', 'to', zones), ('match', 'destination', networks)))))
+    return 'or', (('and', (matched, ('not', include), ('not', exclude))), include)
+
+
+def _compile_expression(node):
+    """
+    Compiles a filter expression, a mapping of operators and fields. Several keys in one mapping must all match.
+    """
+    if not isinstance(node, dict) or not node:
+        raise FilterError('Expected a mapping of operators or fields, got {!r}'.format(node))
+    operands = []
+    for key, value in node.items():
+        if key in ('and', 'or'):
+            if not isinstance(value, list) or not value:
+                raise FilterError('"{}" needs a list of expressions'.format(key))
+            operands.append((key, tuple(_compile_expression(operand) for operand in value)))
+        elif key == 'not':
+            operands.append(('not', _compile_expression(value)))
+        elif key in FILTER_FIELDS:
+            parts = FILTER_FIELDS[key]
+            if parts[0] in ('source', 'destination'):
+                values = _compile_networks(_as_list(value))
+            elif parts[0] == 'service':
+                values = tuple(parse_service_filter(service) for service in _as_list(value))
+            else:
+                values = tuple(str(member) for member in _as_list(value))
+            matches = tuple(('match', part, values) for part in parts)
+            operands.append(matches[0] if len(matches) == 1 else ('or', matches))
         else:
-            parameters = dict(parameters_regex.findall(rule[1]))
-            dataplane_rules.update({rule_name: parameters})
-
-    # Iterate over the filterable parameters in each rule to split out into objects we can work with.
-    # This includes a list or string of zones and netaddr ip objects for IPs
-    for rule in dataplane_rules:
-        dataplane_rules[rule]['from'] = split_multiple_zones(dataplane_rules[rule]['from'])
-        dataplane_rules[rule]['to'] = split_multiple_zones(dataplane_rules[rule]['to'])
-        dataplane_rules[rule]['source'] = convert_to_ipobject(dataplane_rules[rule]['source'])
-        dataplane_rules[rule]['destination'] = convert_to_ipobject(dataplane_rules[rule]['destination'])
-
-    matched_source_zone = set()
-    matched_destination_zone = set()
-    for rule in dataplane_rules.items():
-        source_zone_result = filter_the_things(rule, ['from'], filters['zones'])
-        destination_zone_result = filter_the_things(rule, ['to'], filters['zones'])
-        if source_zone_result is not None:
-            matched_source_zone.add(source_zone_result)
-        if destination_zone_result is not None:
-            matched_destination_zone.add(destination_zone_result)
-
-    # Convert filters to netaddr/network objects
-    network_filter = list(map(map_to_address, filters['ip_addresses']))
-    ipset_filter = netaddr.IPSet(network_filter)
-
-    # Now that the zone rules have been matched we need to iterate over the ip objects.
-    matched_rulelist_source = set()
-    matched_rulelist_destination = set()
-    for rule in dataplane_rules.items():
-        source_address_result = filter_the_things(rule, ['source'], ipset_filter)
-        destination_address_result = filter_the_things(rule, ['destination'], ipset_filter)
-        if source_address_result is not None:
-            matched_rulelist_source.add(source_address_result)
-        if destination_address_result is not None:
-            matched_rulelist_destination.add(destination_address_result)
-
-    source_filter = matched_rulelist_source.intersection(matched_source_zone)
-    destination_filter = matched_rulelist_destination.intersection(matched_destination_zone)
-
-    completed_filter = source_filter | destination_filter
-    completed_filter.update(matched_rulelist_static)
-    return completed_filter
+            raise FilterError('Unknown filter field or operator "{}", expected one of: {}'.format(
+                key, ', '.join(FILTER_OPERATORS + tuple(FILTER_FIELDS))))
+    return operands[0] if len(operands) == 1 else ('and', tuple(operands))
+
+
+def compile_filter(filters):
+    """
+    Compiles a rule filter into an expression RulebaseIndex.evaluate takes.
+    Filters laid out like rule_filters in config.yml (zones, ip_addresses, rule_names) keep their meaning, any other
+    mapping is an expression of and/or/not over the FILTER_FIELDS, ex.
+    {'and': [{'zone': 'DMZ'}, {'not': {'application': ['ssl', 'web-browsing']}}]} or
+    {'and': [{'to_zone': 'DMZ'}, {'service': 'tcp/443'}, {'action': 'allow'}]}
+    :param filters: Rule filter as found in config.yml or a batch filter file
+    :return: Expression as nested tuples, ('match', part, values) at the leaves
+    :raises FilterError: On unknown fields or operators and invalid addresses
+    """
+    if not filters or set(filters) <= set(RULE_FILTER_KEYS):
+        return _compile_rule_filter(filters)
+    return _compile_expression(filters)
+
+
+def evaluate_filter(index, filters):
+    """
+    Matches a rule filter against an indexed dataplane, see compile_filter.
+    :param index: RulebaseIndex of the dataplane
+    :param filters: Rule filter as found in config.yml or a batch filter file
+    :return: Set of matching rule names
+    """
+    return index.rule_names(index.evaluate(compile_filter(filters)))
+
+
+def evaluate_filters(index, named_filters):
+    """
+    Matches many rule filters against the same indexed dataplane.
+    :param index: RulebaseIndex of the dataplane
+    :param named_filters: Dictionary of filter name to rule filter
+    :return: OrderedDict of filter name to set of matching rule names
+    """
+    return OrderedDict((name, evaluate_filter(index, filters)) for name, filters in named_filters.items())
+
+
+def index_dataplane(dataplane_raw, firewall=None):
+    """
+    Parses the rules of the first dataplane into a RulebaseIndex.
+    :param dataplane_raw: Dataplane output as a string, a file-like object or any iterable of lines
+    :param firewall: Firewall the dataplane comes from, only used to attribute the parse in profile reports
+    :return: RulebaseIndex
+    """
+    with panprofile.stage(firewall, 'parse dataplane') as record:
+        index = RulebaseIndex(iter_dataplane_rules(dataplane_raw))
+        record['rules'] = len(index.rules)
+    return index
+
+
+def filter_dataplane_rules(dataplane_raw, filters, firewall=None):
+    """
+    Filters the rules of the first dataplane.
+    We are assuming dataplanes match because otherwise you need to call PaloAlto TAC Support
+    :param dataplane_raw: Dataplane output as a string, a file-like object or any iterable of lines
+    :param filters: Rule filter as found in config.yml
+    :param firewall: Firewall the dataplane comes from, only used to attribute the stages in profile reports
+    :return: Set of matching rule names
+    """
+    index = index_dataplane(dataplane_raw, firewall)
+    with panprofile.stage(firewall, 'filter') as record:
+        matches = evaluate_filter(index, filters)
+        record['rules'] = len(matches)
+    return matches
+
+
+def check_filters(named_filters):
+    """
+    Compiles every filter once up front, so a mistake in a filter stops the run before any firewall is queried.
+    :param named_filters: Dictionary of filter name to rule filter
+    :return:
+    """
+    for name, filters in named_filters.items():
+        try:
+            compile_filter(filters)
+        except FilterError as error:
+            raise SystemExit('Invalid filter {}: {}'.format(name, error))
+
+
+def load_filters(filename):
+    """
+    Reads a batch filter file, a YAML mapping of filter name to a filter laid out like rule_filters in config.yml.
+    :param filename: Path of the filter file
+    :return: Dictionary of filter name to rule filter
+    """
+    with open(filename, 'r') as stream:
+        return yaml.safe_load(stream) or {}
+
+
+def batch_compare_firewall(firewall, api_key, named_filters):
+    """
+    Retrieves the dataplane of a single firewall once and evaluates every filter against it.
+    :param firewall: Firewall to query
+    :param api_key: API key to query
+    :param named_filters: Dictionary of filter name to rule filter
+    :return: OrderedDict of filter name to set of matching rule names
+    """
+    index = index_dataplane(retrieve_dataplane(firewall, api_key), firewall)
+    with panprofile.stage(firewall, 'filter') as record:
+        matches = evaluate_filters(index, named_filters)
+        record['rules'] = sum(len(rules) for rules in matches.values())
+    return matches
+
+
+def write_batch_results(results, filename):
+    """
+    Writes the batch results of every firewall as CSV (firewall, filter, rule rows) or JSON
+    ({firewall: {filter: [rules]}}), depending on the file extension.
+    :param results: Dictionary of firewall to the result of batch_compare_firewall
+    :param filename: Output file, ending in .json or .csv
+    :return:
+    """
+    if filename.endswith('.json'):
+        output = OrderedDict(
+            (firewall, OrderedDict((name, sorted(rules)) for name, rules in matches.items()))
+            for firewall, matches in results.items())
+        with open(filename, 'w') as file:
+            json.dump(output, file, indent=2)
+        return
+    with open(filename, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['firewall', 'filter', 'rule'])
+        for firewall, matches in results.items():
+            for name, rules in matches.items():
+                for rule in sorted(rules):
+                    writer.writerow([firewall, name, rule])
+
+
+def compare_firewall(firewall, api_key, filters):
+    """
+    Retrieves the dataplane of a single firewall and filters its rules.
+    :param firewall: Firewall to query
+    :param api_key: API key to query
+    :param filters: Rule filters as found in config.yml
+    :return: A set of matching rule names
+    """
+    dataplane_raw = retrieve_dataplane(firewall, api_key)
+    return filter_dataplane_rules(dataplane_raw, filters, firewall)
+
+
+def check_firewall_dataplanes(firewall, api_key, processes=None):
+    """
+    Retrieves the dataplane of a single firewall and compares the rules compiled on each of its dataplanes.
+    :param firewall: Firewall to query
+    :param api_key: API key to query
+    :param processes: Number of processes used to parse the dataplane sections
+    :return: Tuple of (list of dataplane names, differences as returned by find_dataplane_differences)
+    """
+    dataplane_raw = retrieve_dataplane(firewall, api_key)
+    with panprofile.stage(firewall, 'parse dataplanes') as record:
+        dataplanes = parse_dataplanes(dataplane_raw, processes)
+        record['rules'] = sum(len(rules) for rules in dataplanes.values())
+    with panprofile.stage(firewall, 'compare dataplanes'):
+        differences = find_dataplane_differences(dataplanes)
+    return list(dataplanes), differences
+
+
+def print_dataplane_differences(firewall, dataplanes, differences):  # pragma: no cover
+    """
+    Prints out the rules which differ between the dataplanes of a firewall
+    :param firewall: Firewall being processed as string
+    :param dataplanes: List of dataplane names found on the firewall
+    :param differences: Differences as returned by find_dataplane_differences
+    :return:
+    """
+    print('{} ({})'.format(firewall, ', '.join(dataplanes)))
+    if not differences:
+        print('All dataplanes match')
+    for name, found in differences.items():
+        print(name)
+        for dataplane, position_rule in found.items():
+            if position_rule is None:
+                print('  {}: missing'.format(dataplane))
+            else:
+                position, rule = position_rule
+                print('  {}: position {} {}'.format(dataplane, position, rule.parameters))
+    print('\n')
 
 
 def print_out(firewall, completed_filter):  # pragma: no cover
@@ -275,12 +1184,63 @@ def print_out(firewall, completed_filter):  # pragma: no cover
     print('\n')
 
 
-def main():
-    script_config = Config('config.yml')
-    for firewall in script_config.firewall_hostnames:
-        dataplane_raw = retrieve_dataplane(firewall, script_config.firewall_api_key)
-        completed_filter = filter_dataplane_rules(dataplane_raw, script_config.rule_filters)
-        print_out(firewall, completed_filter)
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description='Filter the dataplane rules of each firewall in config.yml.')
+    parser.add_argument('--check-dataplanes', action='store_true',
+                        help='Instead of filtering, report rules which differ between the dataplanes of a firewall')
+    parser.add_argument('--processes', type=int, default=None,
+                        help='Parse the dataplane sections of a firewall in this many processes')
+    parser.add_argument('--batch', metavar='FILTER_FILE',
+                        help='Evaluate every named filter in FILTER_FILE instead of rule_filters in config.yml')
+    parser.add_argument('--output', default='pancompare-results.csv',
+                        help='File the batch results are written to, .csv or .json. Defaults to %(default)s')
+    parser.add_argument('--snapshot', metavar='PATH',
+                        help='Read the dataplanes saved in a snapshot directory or archive instead of querying the '
+                             'firewalls, config.yml is optional')
+    panprofile.add_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def run_task(task, script_config, arguments, *args):
+    """
+    Runs task(firewall, api_key, *args) across the firewalls of config.yml, or of the snapshot when --snapshot is given.
+    :return: Tuple of (results, failures), see panfleet.run_across_firewalls
+    """
+    task = panprofile.get_profiler().wrap(task)
+    if arguments.snapshot is None:
+        return panfleet.run_across_firewalls(task, script_config.firewall_hostnames, script_config.max_workers,
+                                             script_config.firewall_api_key, *args)
+    with pansnapshot.open_snapshot(arguments.snapshot) as client:
+        # Profiled stages are recorded in this process, the firewalls then run as threads
+        use_processes = isinstance(panprofile.get_profiler(), panprofile.NullProfiler)
+        return pansnapshot.run_across_snapshot(task, client, None, use_processes,
+                                               script_config.firewall_api_key, *args)
+
+
+def main(argv=None):
+    arguments = parse_arguments(argv)
+    offline = arguments.snapshot is not None
+    script_config = Config(None if offline and not os.path.exists('config.yml') else 'config.yml')
+    panapi.set_client(panapi.client_from_config(script_config.api_options))
+    profiler = panprofile.start(arguments)
+    if arguments.check_dataplanes:
+        results, failures = run_task(check_firewall_dataplanes, script_config, arguments, arguments.processes)
+        for firewall, (dataplanes, differences) in results.items():
+            print_dataplane_differences(firewall, dataplanes, differences)
+    elif arguments.batch:
+        named_filters = load_filters(arguments.batch)
+        check_filters(named_filters)
+        results, failures = run_task(batch_compare_firewall, script_config, arguments, named_filters)
+        write_batch_results(results, arguments.output)
+        print('Results of {} firewall(s) written to {}'.format(len(results), arguments.output))
+    else:
+        check_filters({'rule_filters': script_config.rule_filters})
+        results, failures = run_task(compare_firewall, script_config, arguments, script_config.rule_filters)
+        for firewall, completed_filter in results.items():
+            print_out(firewall, completed_filter)
+    panprofile.finish(profiler, arguments)
+    panfleet.report_failures(failures)
+    panapi.print_metrics(panapi.get_client().metrics)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+
+# noinspection PyPackageRequirements
+
+import argparse
+import csv
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from typing import NamedTuple
+
+import panapi
+import pancompare
+import panexport
+
+RUNNING_FILE = 'running.xml'
+PUSHED_FILE = 'pushed-shared-policy.xml'
+
+# Columns added by the writers which aren't part of a rule
+EXPORT_ONLY_COLUMNS = ['Order']
+# Columns an export may get from address resolution, shadow detection or hit counters, a config doesn't have them
+ANALYSIS_COLUMNS = ['hit-count', 'last-hit', 'shadowed-by', 'source-resolved', 'destination-resolved']
+
+
+class RulebaseDiff(NamedTuple):
+    """
+    Differences between an old and a new rulebase, rules are identified by name.
+    modified is a list of (name, {field: (old value, new value)}), moved lists the rules whose position relative to
+    the other rules changed.
+    """
+    added: list
+    removed: list
+    modified: list
+    moved: list
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.modified or self.moved)
+
+
+def normalize_rule(rule, default_map=None):
+    """
+    Turns a rule into a flat dictionary of strings so rules from a config and from an export compare equal.
+    Fields are formatted like the export cells, defaults are filled in and empty fields are dropped.
+    :param rule: Rule as dictionary, either parsed from a config or a row of an export
+    :param default_map: Dictionary of field to the value used when the rule doesn't have it
+    :return: Dictionary of field to string
+    """
+    if default_map is None:
+        default_map = panexport.HEADERS_DEFAULT_MAP
+    fields = [field for field in rule if field not in EXPORT_ONLY_COLUMNS]
+    fields += [field for field in default_map if field not in rule]
+    normalized = dict(zip(fields, panexport.format_rule(rule, fields, default_map)))
+    return {field: value for field, value in normalized.items() if value != ''}
+
+
+def rule_digest(normalized_rule, ignore_fields=()):
+    """
+    :param normalized_rule: Rule as returned by normalize_rule
+    :param ignore_fields: Fields left out of the digest
+    :return: Hex digest of the rule content, equal for rules with equal fields whatever their order
+    """
+    content = '\0'.join(sorted('{}\1{}'.format(field, value) for field, value in normalized_rule.items()
+                               if field not in ignore_fields))
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+def index_rulebase(rule_list, ignore_fields=()):
+    """
+    Normalizes and hashes every rule of a rulebase once.
+    A name occurring more than once is keyed as '<name> (2)', '<name> (3)'... for the later occurrences.
+    :param rule_list: Rules as dictionaries in rulebase order
+    :param ignore_fields: Fields left out of the digests
+    :return: OrderedDict of name to (digest, normalized rule), in rulebase order
+    """
+    index = OrderedDict()
+    for rule in rule_list:
+        normalized = normalize_rule(rule)
+        name = normalized.get('@name', '')
+        key = name
+        occurrence = 1
+        while key in index:
+            occurrence += 1
+            key = '{} ({})'.format(name, occurrence)
+        index[key] = (rule_digest(normalized, ignore_fields), normalized)
+    return index
+
+
+def diff_rulebases(old_rules, new_rules, ignore_fields=()):
+    """
+    Compares two rulebases in linear time (plus n log n to find moved rules).
+    Rules are matched by name and compared by digest, only rules whose digests differ are compared field by field.
+    The fewest rules that explain the new order are reported as moved, found as the complement of the longest
+    increasing subsequence of old positions.
+    :param old_rules: Rules as dictionaries, from a config or an export
+    :param new_rules: Rules as dictionaries, from a config or an export
+    :param ignore_fields: Fields which aren't compared
+    :return: RulebaseDiff
+    """
+    old_index = index_rulebase(old_rules, ignore_fields)
+    new_index = index_rulebase(new_rules, ignore_fields)
+
+    added = [name for name in new_index if name not in old_index]
+    removed = [name for name in old_index if name not in new_index]
+
+    modified = []
+    old_positions = {name: position for position, name in enumerate(old_index)}
+    common = [name for name in new_index if name in old_index]
+    for name in common:
+        old_digest, old_rule = old_index[name]
+        new_digest, new_rule = new_index[name]
+        if old_digest != new_digest:
+            changes = OrderedDict()
+            for field in list(old_rule) + [field for field in new_rule if field not in old_rule]:
+                if field in ignore_fields:
+                    continue
+                old_value = old_rule.get(field, '')
+                new_value = new_rule.get(field, '')
+                if old_value != new_value:
+                    changes[field] = (old_value, new_value)
+            modified.append((name, changes))
+
+    in_order = pancompare.longest_increasing_subsequence([old_positions[name] for name in common])
+    moved = [name for position, name in enumerate(common) if position not in in_order]
+    return RulebaseDiff(added, removed, modified, moved)
+
+
+def load_export(filename):
+    """
+    Reads a rulebase exported as CSV or JSON Lines by panexport.
+    :param filename: Path of the export
+    :return: List of rules as dictionaries of column to cell
+    """
+    with open(filename, mode='r', newline='', encoding='utf-8') as file:
+        if filename.endswith('.jsonl'):
+            return [json.loads(line) for line in file if line.strip()]
+        return list(csv.DictReader(file))
+
+
+def combine_every_vsys(pushed_config, running_config, vsys=None):
+    """
+    Combines the rulebase of every vsys of a firewall. The pushed rules appear in every vsys, so on firewalls running
+    several vsys each rule is named '<vsys>/<rule>' to keep the names unique.
+    :param pushed_config: Parsed pushed-shared-policy config
+    :param running_config: Parsed running config
+    :param vsys: Name of a vsys to combine only its rulebase, with the rule names unchanged
+    :return: List of rules as dictionaries
+    """
+    if vsys is not None:
+        return panexport.combine_the_rulebase(pushed_config, running_config, vsys)
+    vsys_names = [entry.get('@name') for entry in panexport.list_vsys(running_config)]
+    if len(vsys_names) < 2:
+        return panexport.combine_the_rulebase(pushed_config, running_config)
+    rule_list = []
+    for vsys_name in vsys_names:
+        for rule in panexport.combine_the_rulebase(pushed_config, running_config, vsys_name):
+            rule = rule.copy()
+            rule['@name'] = '{}/{}'.format(vsys_name, rule.get('@name', ''))
+            rule_list.append(rule)
+    return rule_list
+
+
+def load_snapshot(directory, vsys=None):
+    """
+    Reads a combined rulebase from a directory holding running.xml and pushed-shared-policy.xml, such as a
+    firewall's directory in the panexport cache.
+    :param directory: Path of the directory
+    :param vsys: Name of a vsys to read only its rulebase, see combine_every_vsys
+    :return: List of rules as dictionaries
+    """
+    configs = {}
+    for config, filename in (('running', RUNNING_FILE), ('pushed-shared-policy', PUSHED_FILE)):
+        path = os.path.join(directory, filename)
+        if os.path.exists(path):
+            with open(path, mode='r', encoding='utf-8') as file:
+                configs[config] = panexport.parse_firewall_configuration(file.read(), config)
+        else:
+            configs[config] = {}
+    return combine_every_vsys(configs['pushed-shared-policy'], configs['running'], vsys)
+
+
+def load_rulebase(source, api_key=None, vsys=None):
+    """
+    Loads a combined rulebase from whatever source is given.
+    :param source: A snapshot directory, a CSV or JSON Lines export or the hostname of a firewall
+    :param api_key: API key used when source is a firewall
+    :param vsys: Name of a vsys to load only its rulebase, exports hold a single vsys already
+    :return: Tuple of (list of rules as dictionaries, True if the rules come from an export)
+    """
+    if os.path.isdir(source):
+        return load_snapshot(source, vsys), False
+    if os.path.isfile(source):
+        return load_export(source), True
+    running, pushed = panexport.load_both_configurations(source, api_key)
+    return combine_every_vsys(pushed.parsed, running.parsed, vsys), False
+
+
+def print_diff(old_source, new_source, diff):  # pragma: no cover
+    print('{} -> {}'.format(old_source, new_source))
+    if not diff:
+        print('  No differences.')
+        return
+    for name in diff.added:
+        print('  + {}'.format(name))
+    for name in diff.removed:
+        print('  - {}'.format(name))
+    for name, changes in diff.modified:
+        print('  ~ {}'.format(name))
+        for field, (old_value, new_value) in changes.items():
+            print('      {}: {!r} -> {!r}'.format(field, old_value, new_value))
+    for name in diff.moved:
+        print('  > {} moved'.format(name))
+
+
+def write_diff(diff, filename):
+    """
+    Writes a diff as JSON.
+    :param diff: RulebaseDiff
+    :param filename: Output file
+    :return:
+    """
+    with open(filename, mode='w', encoding='utf-8') as file:
+        json.dump({'added': diff.added,
+                   'removed': diff.removed,
+                   'modified': [{'name': name, 'changes': changes} for name, changes in diff.modified],
+                   'moved': diff.moved}, file, indent=2)
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description='Show the differences between two combined rulebases. Each side '
+                                                 'is a snapshot directory with running.xml and '
+                                                 'pushed-shared-policy.xml (such as a panexport cache entry), a CSV '
+                                                 'or JSON Lines export, or a firewall hostname.')
+    parser.add_argument('old', help='Rulebase to compare from')
+    parser.add_argument('new', help='Rulebase to compare to')
+    parser.add_argument('--output', help='Also write the differences to this JSON file')
+    parser.add_argument('--vsys', help='Only compare this vsys of firewalls running several vsys')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    arguments = parse_arguments(argv)
+    api_key = None
+    if not all(os.path.exists(source) for source in (arguments.old, arguments.new)):
+        script_config = panexport.Config('config.yml')
+        panapi.set_client(panapi.client_from_config(script_config.api_options))
+        api_key = script_config.firewall_api_key
+    old_rules, old_is_export = load_rulebase(arguments.old, api_key, arguments.vsys)
+    new_rules, new_is_export = load_rulebase(arguments.new, api_key, arguments.vsys)
+    # Exports don't contain the removed headers and may contain analysis columns, comparing them with a config would
+    # flag every rule
+    ignore_fields = panexport.HEADERS_REMOVE + ANALYSIS_COLUMNS if old_is_export or new_is_export else ()
+    diff = diff_rulebases(old_rules, new_rules, ignore_fields)
+    print_diff(arguments.old, arguments.new, diff)
+    if arguments.output:
+        write_diff(diff, arguments.output)
+    # Like diff, exit with 1 when there are differences so CI can fail on them
+    return 1 if diff else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
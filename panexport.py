@@ -1,31 +1,145 @@
 #!/usr/bin/env python3
 
 # noinspection PyPackageRequirements
+import argparse
+import csv
+import functools
+import io
+import json
+import os
+import re
+import threading
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from xml.etree import ElementTree
 
-import pan.xapi
-import tablib
+import xlsxwriter
 import xmltodict
 import yaml
 
+import panapi
+import pancache
+import panfleet
+import panhits
+import panobjects
+import panprofile
+import panrules
+import panshadow
+import pansnapshot
+import panwatch
+
 HEADERS_DEFAULT_MAP = {'rule-type': 'universal', 'negate-source': 'no', 'negate-destination': 'no'}
 
 HEADERS_REMOVE = ['option', 'profile-setting', 'disabled', 'log-end', 'log-start', 'category']
 
-HEADERS_ORDER = ['@name', 'action', 'tag', 'rule-type', 'from', 'source', 'negate-source', 'source-user',
-                 'hip-profiles',
-                 'to', 'destination', 'negate-destination', 'application', 'service', 'profile-setting', 'description']
+HEADERS_ORDER = ['@name', 'action', 'shadowed-by', 'hit-count', 'last-hit',
+                 'tag', 'rule-type', 'from', 'source', 'source-resolved', 'negate-source',
+                 'source-user', 'hip-profiles',
+                 'to', 'destination', 'destination-resolved', 'negate-destination', 'application', 'service',
+                 'profile-setting', 'description']
+
+# Paths of the config sections we actually use, everything else is dropped while parsing
+CONFIG_PATHS = {
+    'running': [
+        ('config', 'devices', 'entry', 'vsys', 'entry', 'rulebase', 'entry'),
+        ('config', 'devices', 'entry', 'vsys', 'entry', 'address', 'entry'),
+        ('config', 'devices', 'entry', 'vsys', 'entry', 'address-group', 'entry'),
+        ('config', 'shared', 'address', 'entry'),
+        ('config', 'shared', 'address-group', 'entry'),
+    ],
+    'pushed-shared-policy': [
+        ('policy', 'panorama', 'pre-rulebase', 'security', 'rules', 'entry'),
+        ('policy', 'panorama', 'post-rulebase', 'security', 'rules', 'entry'),
+        ('policy', 'panorama', 'post-rulebase', 'default-security-rules', 'rules', 'entry'),
+        ('policy', 'panorama', 'address', 'entry'),
+        ('policy', 'panorama', 'address-group', 'entry'),
+    ],
+}
+
+# A Panorama's running config, parsed for the rulebases and objects of every device group in a single pull
+PANORAMA_CONFIG = 'panorama'
+CONFIG_PATHS[PANORAMA_CONFIG] = [
+    ('config', 'shared', 'pre-rulebase', 'security', 'rules', 'entry'),
+    ('config', 'shared', 'post-rulebase', 'security', 'rules', 'entry'),
+    ('config', 'shared', 'post-rulebase', 'default-security-rules', 'rules', 'entry'),
+    ('config', 'shared', 'address', 'entry'),
+    ('config', 'shared', 'address-group', 'entry'),
+    ('config', 'devices', 'entry', 'device-group', 'entry', 'pre-rulebase', 'security', 'rules', 'entry'),
+    ('config', 'devices', 'entry', 'device-group', 'entry', 'post-rulebase', 'security', 'rules', 'entry'),
+    ('config', 'devices', 'entry', 'device-group', 'entry', 'post-rulebase', 'default-security-rules', 'rules',
+     'entry'),
+    ('config', 'devices', 'entry', 'device-group', 'entry', 'address', 'entry'),
+    ('config', 'devices', 'entry', 'device-group', 'entry', 'address-group', 'entry'),
+    ('config', 'readonly', 'devices', 'entry', 'device-group', 'entry', 'parent-dg'),
+]
+
+CONFIG_CHANGED = 'changed'
+CONFIG_UNCHANGED = 'unchanged'
+CONFIG_STALE = 'stale'
+
+# Configs of a firewall kept in the cache, in the order load_both_configurations returns them
+CACHED_CONFIGS = ('running', 'pushed-shared-policy')
+
+LoadedConfig = namedtuple('LoadedConfig', ['parsed', 'xml', 'status'])
 
 __author__ = 'Jay Shepherd'
 
 
 class Config:
     def __init__(self, filename):
-        with open(filename, 'r') as stream:
-            config = yaml.load(stream)
+        """
+        :param filename: config.yml to read, None for the defaults of an offline run which needs no firewall details
+        """
+        config = {'top_domain': '', 'firewall_api_key': None, 'firewall_hostnames': []}
+        if filename is not None:
+            with open(filename, 'r') as stream:
+                config = yaml.safe_load(stream)
         self.top_domain = config['top_domain']
         self.firewall_api_key = config['firewall_api_key']
         self.firewall_hostnames = config['firewall_hostnames']
+        self.max_workers = config.get('max_workers', panfleet.DEFAULT_MAX_WORKERS)
+        self.cache_dir = config.get('cache_dir', pancache.DEFAULT_CACHE_DIR)
+        self.cache_max_age_days = config.get('cache_max_age_days', pancache.DEFAULT_MAX_AGE_DAYS)
+        self.cache_max_size_mb = config.get('cache_max_size_mb', pancache.DEFAULT_MAX_SIZE_MB)
+        self.use_cache_when_unreachable = config.get('use_cache_when_unreachable', False)
+        self.output_format = config.get('output_format', 'xlsx')
+        self.resolve_addresses = config.get('resolve_addresses', False)
+        self.detect_shadowed_rules = config.get('detect_shadowed_rules', False)
+        self.hit_counts = config.get('hit_counts', False)
+        self.watch_interval = config.get('watch_interval', panwatch.DEFAULT_INTERVAL)
+        self.watch_max_backoff = config.get('watch_max_backoff', panwatch.DEFAULT_MAX_BACKOFF)
+        self.api_options = {key: value for key, value in config.items() if key.startswith('api_')}
+
+
+def fetch_firewall_configuration(hostname, api_key, config='running'):
+    """
+    This takes the FQDN of the firewall and retrieves the requested config as raw XML.
+    :param hostname: Hostname (FQDN) of firewall to retrieve configuration from
+    :param api_key:  API key to access firewall configuration
+    :param config: Which config to retrieve, defaults to running.
+    :return: Configuration XML as string
+    """
+    command = "show config {}".format(config)
+    with panprofile.stage(hostname, 'fetch ' + config) as record:
+        xml = panapi.get_client().op(hostname, api_key, command)
+        record['bytes'] = len(xml or '')
+    return xml
+
+
+def parse_firewall_configuration(xml, config='running', hostname=None):
+    """
+    Parses a configuration retrieved with fetch_firewall_configuration.
+    :param xml: Configuration XML as string
+    :param config: Which config the XML is, defaults to running.
+    :param hostname: Firewall the configuration comes from, only used to attribute the parse in profile reports
+    :return: Dictionary containing firewall configuration. For known configs only the sections listed in
+    CONFIG_PATHS are included.
+    """
+    with panprofile.stage(hostname, 'parse ' + config):
+        if config in CONFIG_PATHS:
+            return parse_config(xml, CONFIG_PATHS[config])
+        return xmltodict.parse(xml)
 
 
 def retrieve_firewall_configuration(hostname, api_key, config='running'):
@@ -37,21 +151,267 @@ def retrieve_firewall_configuration(hostname, api_key, config='running'):
     ;param config: Which config to retrieve, defaults to running.
     :return: Dictionary containing firewall configuration
     """
-    firewall = pan.xapi.PanXapi(hostname=hostname, api_key=api_key)
-    command = "show config {}".format(config)
-    firewall.op(cmd=command, cmd_xml=True)
-    return xmltodict.parse(firewall.xml_result())
+    return parse_firewall_configuration(fetch_firewall_configuration(hostname, api_key, config), config, hostname)
+
+
+def parse_config(xml_source, paths):
+    """
+    Incrementally parses a configuration document keeping only the elements found on the given paths.
+    The returned dictionary has the same layout xmltodict.parse would give for those paths, so safeget
+    works on it unchanged, but the rest of the document is discarded as soon as it has been read.
+    :param xml_source: XML document as string or a file-like object
+    :param paths: List of tag tuples, ex. ('config', 'devices', 'entry'). Every element at the end of a path
+    is converted in full, elements leading up to it only keep their attributes.
+    :return: Dictionary containing the requested parts of the configuration
+    """
+    if isinstance(xml_source, str):
+        xml_source = io.StringIO(xml_source)
+    wanted = set(paths)
+    prefixes = {path[:depth] for path in wanted for depth in range(1, len(path))}
 
+    document = {}
+    nodes = [document]
+    open_elements = []
+    path = ()
+    capture_depth = None
+    for event, element in ElementTree.iterparse(xml_source, events=('start', 'end')):
+        if event == 'start':
+            path += (element.tag,)
+            open_elements.append(element)
+            if capture_depth is not None:
+                continue
+            if path in wanted:
+                capture_depth = len(path)
+            elif path in prefixes:
+                node = {'@' + key: value for key, value in element.attrib.items()}
+                _add_child(nodes[-1], element.tag, node)
+                nodes.append(node)
+            continue
 
-def combine_the_rulebase(pushed_config, running_config):
+        open_elements.pop()
+        if capture_depth is None or capture_depth == len(path):
+            if capture_depth is not None:
+                _add_child(nodes[-1], element.tag, _element_to_dict(element))
+                capture_depth = None
+            elif path in prefixes:
+                nodes.pop()
+            # Every child of the parent has now been handled, free them
+            if open_elements:
+                del open_elements[-1][:]
+        path = path[:-1]
+    return document
+
+
+def _add_child(node, tag, value):
+    """
+    Adds a child to a parsed node the way xmltodict does, repeated tags are turned into a list.
+    """
+    if tag not in node:
+        node[tag] = value
+    elif isinstance(node[tag], list):
+        node[tag].append(value)
+    else:
+        node[tag] = [node[tag], value]
+
+
+def _element_to_dict(element):
+    """
+    Converts an ElementTree element into the same structure xmltodict.parse produces for it.
+    """
+    item = {'@' + key: value for key, value in element.attrib.items()}
+    text = [element.text or '']
+    for child in element:
+        _add_child(item, child.tag, _element_to_dict(child))
+        text.append(child.tail or '')
+    text = ''.join(text).strip() or None
+    if not item:
+        return text
+    if text is not None:
+        item['#text'] = text
+    return item
+
+
+def load_configuration(hostname, api_key, config='running', cache=None):
+    """
+    Retrieves a configuration, using the cache to avoid parsing it again when it hasn't changed.
+    :param hostname: Hostname (FQDN) of firewall to retrieve configuration from
+    :param api_key: API key to access firewall configuration
+    :param config: Which config to retrieve, defaults to running.
+    :param cache: pancache.ConfigCache or None to always fetch and parse
+    :return: LoadedConfig with the parsed config, the raw XML when it has to be stored in the cache and
+    the status of the config compared to the cache (CONFIG_CHANGED, CONFIG_UNCHANGED or CONFIG_STALE)
+    """
+    if cache is None:
+        return LoadedConfig(retrieve_firewall_configuration(hostname, api_key, config), None, CONFIG_CHANGED)
+
+    try:
+        xml = fetch_firewall_configuration(hostname, api_key, config)
+    except (panapi.PanApiError, OSError) as error:
+        parsed = cache.load_parsed(hostname, config) if cache.use_when_unreachable else None
+        if parsed is None:
+            raise
+        print('{} unreachable ({}), using cached {} config.'.format(hostname, error, config))
+        return LoadedConfig(parsed, None, CONFIG_STALE)
+
+    if cache.lookup_hash(hostname, config) == pancache.content_hash(xml):
+        parsed = cache.load_parsed(hostname, config)
+        if parsed is not None:
+            return LoadedConfig(parsed, None, CONFIG_UNCHANGED)
+    return LoadedConfig(parse_firewall_configuration(xml, config, hostname), xml, CONFIG_CHANGED)
+
+
+def load_both_configurations(hostname, api_key, cache=None):
+    """
+    Retrieves the running and the pushed-shared-policy configurations of a firewall at the same time.
+    :param hostname: Hostname (FQDN) of firewall to retrieve configuration from
+    :param api_key: API key to access firewall configuration
+    :param cache: pancache.ConfigCache or None to always fetch and parse
+    :return: Tuple of (running, pushed) LoadedConfig
+    """
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        running = executor.submit(load_configuration, hostname, api_key, 'running', cache)
+        pushed = executor.submit(load_configuration, hostname, api_key, 'pushed-shared-policy', cache)
+        return running.result(), pushed.result()
+
+
+def list_vsys(running_config):
+    """
+    :param running_config: Parsed running config
+    :return: List of the vsys entries of the config, a single one unless the firewall runs multiple vsys
+    """
+    vsys_entries = []
+    for device in safeget(running_config, 'config', 'devices', 'entry'):
+        vsys_entries += safeget(device, 'vsys', 'entry')
+    return vsys_entries
+
+
+def find_vsys(running_config, vsys=None):
+    """
+    :param running_config: Parsed running config
+    :param vsys: Name of the vsys, None for the first one
+    :return: The vsys entry, an empty dictionary when the config has no such vsys
+    """
+    for entry in list_vsys(running_config):
+        if vsys is None or entry.get('@name') == vsys:
+            return entry
+    return {}
+
+
+def combine_the_rulebase(pushed_config, running_config, vsys=None):
+    """
+    Combines the rules pushed from Panorama and the rules of a vsys into the order the firewall evaluates them.
+    :param pushed_config: Parsed pushed-shared-policy config
+    :param running_config: Parsed running config
+    :param vsys: Name of the vsys whose rules are combined, None for the first one
+    :return: List of panrules.Rule
+    """
     pre_rulebase = safeget(pushed_config, 'policy', 'panorama', 'pre-rulebase', 'security', 'rules', 'entry')
-    device_rulebase = safeget(running_config, 'config', 'devices', 'entry', 'vsys', 'entry', 'rulebase', 'entry')
+    device_rulebase = safeget(find_vsys(running_config, vsys), 'rulebase', 'entry')
     post_rulebase = safeget(pushed_config, 'policy', 'panorama', 'post-rulebase', 'security', 'rules', 'entry')
     default_rulebase = safeget(pushed_config, 'policy', 'panorama', 'post-rulebase', 'default-security-rules', 'rules',
                                'entry')
     # Combine the pre, on-device, and post rule sets into a single ordered view
     combined_rulebase = pre_rulebase + device_rulebase + post_rulebase + default_rulebase
-    return combined_rulebase
+    return panrules.build_rules(combined_rulebase)
+
+
+def build_address_resolver(pushed_config, running_config, vsys=None):
+    """
+    Indexes the address objects available to the combined rulebase.
+    Objects pushed from Panorama are overridden by shared objects on the device, which are overridden by vsys objects.
+    :param pushed_config: Parsed pushed-shared-policy config
+    :param running_config: Parsed running config
+    :param vsys: Name of the vsys whose objects are used, None for the first one
+    :return: panobjects.AddressResolver
+    """
+    address_paths = [
+        (pushed_config, ('policy', 'panorama')),
+        (running_config, ('config', 'shared')),
+        (find_vsys(running_config, vsys), ()),
+    ]
+    address = []
+    address_groups = []
+    for config, path in address_paths:
+        address += safeget(config, *(path + ('address', 'entry')))
+        address_groups += safeget(config, *(path + ('address-group', 'entry')))
+    return panobjects.AddressResolver(address, address_groups)
+
+
+def list_device_groups(panorama_config):
+    """
+    :param panorama_config: Panorama running config parsed with CONFIG_PATHS[PANORAMA_CONFIG]
+    :return: List of the names of every device group
+    """
+    device_groups = []
+    for device in safeget(panorama_config, 'config', 'devices', 'entry'):
+        device_groups += [entry['@name'] for entry in safeget(device, 'device-group', 'entry')]
+    return device_groups
+
+
+def device_group_levels(panorama_config, device_group):
+    """
+    Lists the places a device group inherits rules and objects from, starting with shared, then every ancestor
+    from the top of the hierarchy down and finally the device group itself.
+    :param panorama_config: Panorama running config parsed with CONFIG_PATHS[PANORAMA_CONFIG]
+    :param device_group: Name of the device group
+    :return: List of config sections, each holding pre-rulebase, post-rulebase, address and address-group
+    """
+    entries = {}
+    for device in safeget(panorama_config, 'config', 'devices', 'entry'):
+        entries.update((entry['@name'], entry) for entry in safeget(device, 'device-group', 'entry'))
+    if device_group not in entries:
+        raise KeyError('Device group {} not found'.format(device_group))
+    parents = {}
+    for device in safeget(panorama_config, 'config', 'readonly', 'devices', 'entry'):
+        for entry in safeget(device, 'device-group', 'entry'):
+            if entry.get('parent-dg'):
+                parents[entry['@name']] = entry['parent-dg']
+
+    chain = []
+    name = device_group
+    # A broken hierarchy ends at the first device group seen twice or missing from the config
+    while name in entries and name not in chain:
+        chain.append(name)
+        name = parents.get(name)
+    return safeget(panorama_config, 'config', 'shared') + [entries[name] for name in reversed(chain)]
+
+
+def combine_device_group_rulebase(panorama_config, device_group):
+    """
+    Combines the rules Panorama pushes to the firewalls of a device group in the order they are evaluated:
+    pre rules from shared down to the device group, post rules from the device group up to shared and the default
+    rules, each taken from the closest level which overrides it. Rules local to the firewalls are not included.
+    :param panorama_config: Panorama running config parsed with CONFIG_PATHS[PANORAMA_CONFIG]
+    :param device_group: Name of the device group
+    :return: List of panrules.Rule
+    """
+    levels = device_group_levels(panorama_config, device_group)
+    pre_rulebase = []
+    post_rulebase = []
+    default_rules = OrderedDict()
+    for level in levels:
+        pre_rulebase += safeget(level, 'pre-rulebase', 'security', 'rules', 'entry')
+        for rule in safeget(level, 'post-rulebase', 'default-security-rules', 'rules', 'entry'):
+            default_rules[rule.get('@name')] = rule
+    for level in reversed(levels):
+        post_rulebase += safeget(level, 'post-rulebase', 'security', 'rules', 'entry')
+    return panrules.build_rules(pre_rulebase + post_rulebase + list(default_rules.values()))
+
+
+def build_device_group_resolver(panorama_config, device_group):
+    """
+    Indexes the address objects available to a device group. Shared objects are overridden by the ones of
+    ancestor device groups, which are overridden by the device group's own.
+    :param panorama_config: Panorama running config parsed with CONFIG_PATHS[PANORAMA_CONFIG]
+    :param device_group: Name of the device group
+    :return: panobjects.AddressResolver
+    """
+    address = []
+    address_groups = []
+    for level in device_group_levels(panorama_config, device_group):
+        address += safeget(level, 'address', 'entry')
+        address_groups += safeget(level, 'address-group', 'entry')
+    return panobjects.AddressResolver(address, address_groups)
 
 
 def safeget(dct, *keys):
@@ -91,8 +451,7 @@ def get_headers(data_dict, preferred_header_order=None, headers_to_remove=None):
         headers_to_remove = []
     scraped_headers = set()
     for item in data_dict:
-        for header in item:
-            scraped_headers.add(header)
+        scraped_headers.update(item)
 
     ordered_headers = []
     scraped_headers = scraped_headers.difference(set(headers_to_remove))
@@ -113,73 +472,225 @@ def check_default(object_to_check, default_key, default_map=None):
     :param default_map:
     :return:
     """
-    if object_to_check is '' and default_key in default_map.keys():
+    if object_to_check == '' and default_map and default_key in default_map:
         return default_map[default_key]
     return object_to_check
 
 
-def write_to_excel(rule_list, filename, preferred_header_order=None, headers_to_remove=None, default_map=None):
-    # Initialize Tablib Data
-    dataset = tablib.Dataset()
+def format_rule(rule, headers, default_map=None):
+    """
+    Takes a single rule and turns it into a row of strings, one per header.
+    Member lists are joined with ', ' and empty fields are filled in from default_map.
+    :param rule: panrules.Rule or rule as dictionary
+    :param headers: List of headers, as returned by get_headers
+    :param default_map: Dictionary of header to the value used when the rule doesn't have it
+    :return: List of cells
+    """
+    return next(format_rules([rule], headers, default_map))[1:]
+
+
+def format_rules(rule_list, headers, default_map=None):
+    """
+    Generator of the rows written for a rulebase, each starting with the order of the rule.
+    :param rule_list: Iterable of panrules.Rule or rules as dictionaries
+    :param headers: List of headers, as returned by get_headers
+    :param default_map: Dictionary of header to the value used when the rule doesn't have it
+    :return: Generator of lists of cells
+    """
+    defaults = [(position, default_map[header]) for position, header in enumerate(headers)
+                if default_map and header in default_map]
+    for index_num, rule in enumerate(rule_list, start=1):
+        row = panrules.as_rule(rule).cells(headers)
+        for position, default in defaults:
+            if row[position] == '':
+                row[position] = default
+        yield [index_num] + row
+
+
+def write_worksheet(workbook, worksheet, headers, rows):
+    """
+    Writes a header row and then every row in order, so it works on constant_memory workbooks.
+    :param workbook: xlsxwriter Workbook the worksheet belongs to
+    :param worksheet: xlsxwriter Worksheet to write to
+    :param headers: List of column names
+    :param rows: Iterable of lists of cells
+    :return:
+    """
+    worksheet.write_row(0, 0, headers, workbook.add_format({'bold': True}))
+    worksheet.freeze_panes(1, 0)
+    for row_number, row in enumerate(rows, start=1):
+        worksheet.write_row(row_number, 0, row)
+
+
+def new_workbook(filename):
+    """
+    Creates a workbook which flushes every row to disk as soon as the next one is written.
+    Cells are always written as plain text, never turned into formulas or links.
+    """
+    return xlsxwriter.Workbook(filename, {
+        'constant_memory': True,
+        'strings_to_formulas': False,
+        'strings_to_urls': False,
+    })
 
+
+def write_to_excel(rule_list, filename, preferred_header_order=None, headers_to_remove=None, default_map=None,
+                   headers=None):
+    """
+    Writes a rulebase to an excel spreadsheet, one row at a time so memory stays flat however large it is.
+    :param rule_list: Rules as dictionaries. May be any iterable, such as a generator, when headers are given.
+    :param filename: Spreadsheet to write
+    :param preferred_header_order: See get_headers
+    :param headers_to_remove: See get_headers
+    :param default_map: Dictionary of header to the value used when the rule doesn't have it
+    :param headers: List of headers to write. When None they are gathered from rule_list with get_headers.
+    :return:
+    """
     # Define headers we would like to include
-    rule_headers = get_headers(rule_list, preferred_header_order, headers_to_remove)
-    dataset.headers = ["Order"] + rule_headers
-
-    # Add rules to dataset
-    index_num = 0
-    for rule in rule_list:
-        index_num += 1
-        formatted_rule = [index_num]
-
-        for header in rule_headers:
-            cell = rule.get(header, '')
-            if isinstance(cell, dict):
-                cell = cell.get('member', cell)
-            if isinstance(cell, list):
-                combined_cell = ''
-                first_item = True
-                for item in cell:
-                    if first_item is True:
-                        combined_cell += item
-                        first_item = False
-                    else:
-                        combined_cell += ', {}'.format(item)
-                formatted_rule.append(combined_cell)
-            else:
-                safe_cell = check_default(str(cell), header, default_map)
-                formatted_rule.append(safe_cell)
+    if headers is None:
+        headers = get_headers(rule_list, preferred_header_order, headers_to_remove)
 
-        dataset.append(formatted_rule)
+    workbook = new_workbook(filename)
+    write_worksheet(workbook, workbook.add_worksheet(), ["Order"] + headers,
+                    format_rules(rule_list, headers, default_map))
+    workbook.close()
 
-    # Use tablib to write rules
-    with open(filename, mode='wb') as file:
-        file.write(dataset.xlsx)
+
+def write_to_csv(rule_list, filename, preferred_header_order=None, headers_to_remove=None, default_map=None,
+                 headers=None):
+    """
+    Writes a rulebase to a CSV file with the same columns and cells as write_to_excel.
+    See write_to_excel for the parameters.
+    """
+    if headers is None:
+        headers = get_headers(rule_list, preferred_header_order, headers_to_remove)
+    with open(filename, mode='w', newline='', encoding='utf-8') as file:
+        writer = csv.writer(file)
+        writer.writerow(["Order"] + headers)
+        writer.writerows(format_rules(rule_list, headers, default_map))
 
 
-def do_the_things(firewall, api_key, top_domain=''):
+def write_to_jsonl(rule_list, filename, preferred_header_order=None, headers_to_remove=None, default_map=None,
+                   headers=None):
     """
-    This is the primary meat of the script. It takes a firewall and API key and writes out excel
-    sheets with the rulebase.
-    :param firewall: Firewall to query
-    :param api_key: API key to query
-    ;return:
+    Writes a rulebase as JSON Lines, one object per rule keyed by the same columns as write_to_excel.
+    See write_to_excel for the parameters.
     """
-    # "Zhu Li, do the thing!"
-    # Retrieve both possible configurations from firewall
-    running_config = retrieve_firewall_configuration(firewall,
-                                                     api_key,
-                                                     config='running')
-    pushed_config = retrieve_firewall_configuration(firewall,
-                                                    api_key,
-                                                    config='pushed-shared-policy')
-
-    # Store objects from config in separate dictionaries.
-    # Use helper functions to achieve.
-    # Safety First
-    address = safeget(pushed_config, 'policy', 'panorama', 'address', 'entry')
-    address_groups = safeget(pushed_config, 'policy', 'panorama', 'address-group', 'entry')
-    combined_rulebase = combine_the_rulebase(pushed_config, running_config)
+    if headers is None:
+        headers = get_headers(rule_list, preferred_header_order, headers_to_remove)
+    columns = ["Order"] + headers
+    with open(filename, mode='w', encoding='utf-8') as file:
+        for row in format_rules(rule_list, headers, default_map):
+            file.write(json.dumps(dict(zip(columns, row))) + '\n')
+
+
+def write_to_parquet(rule_list, filename, preferred_header_order=None, headers_to_remove=None, default_map=None,
+                     headers=None, batch_size=10000):
+    """
+    Writes a rulebase to a Parquet file with the same columns and cells as write_to_excel.
+    Rows are written in row groups of batch_size so memory stays bounded. Requires pyarrow.
+    See write_to_excel for the other parameters.
+    """
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise RuntimeError('Parquet output requires pyarrow, install it with: pip install pyarrow')
+
+    if headers is None:
+        headers = get_headers(rule_list, preferred_header_order, headers_to_remove)
+    columns = ["Order"] + headers
+    schema = pyarrow.schema([("Order", pyarrow.int64())] + [(header, pyarrow.string()) for header in headers])
+    with pyarrow.parquet.ParquetWriter(filename, schema) as writer:
+        batch = []
+        for row in format_rules(rule_list, headers, default_map):
+            batch.append(dict(zip(columns, row)))
+            if len(batch) == batch_size:
+                writer.write_table(pyarrow.Table.from_pylist(batch, schema))
+                batch = []
+        if batch:
+            writer.write_table(pyarrow.Table.from_pylist(batch, schema))
+
+
+WRITERS = {
+    'xlsx': write_to_excel,
+    'csv': write_to_csv,
+    'jsonl': write_to_jsonl,
+    'parquet': write_to_parquet,
+}
+
+# Not a file per firewall but a single spreadsheet with a sheet per firewall, see FleetWorkbook
+WORKBOOK_FORMAT = 'workbook'
+
+OUTPUT_FORMATS = sorted(WRITERS) + [WORKBOOK_FORMAT]
+
+
+class FleetWorkbook:
+    def __init__(self, filename):
+        """
+        A single excel spreadsheet with one sheet per firewall, safe to add to from several threads.
+        :param filename: Spreadsheet to write
+        """
+        self.workbook = new_workbook(filename)
+        self.sheet_names = set()
+        self.lock = threading.Lock()
+
+    def _sheet_name(self, name):
+        # Excel limits sheet names to 31 characters without []:*?/\ and requires them to be unique
+        name = re.sub(r'[\[\]:*?/\\]', '-', name)[:31] or 'Sheet'
+        candidate = name
+        number = 1
+        while candidate.lower() in self.sheet_names:
+            number += 1
+            suffix = '-{}'.format(number)
+            candidate = name[:31 - len(suffix)] + suffix
+        self.sheet_names.add(candidate.lower())
+        return candidate
+
+    def add_rulebase(self, name, rule_list, preferred_header_order=None, headers_to_remove=None, default_map=None,
+                     headers=None):
+        """
+        Adds a sheet with the same columns and cells write_to_excel would write.
+        :param name: Sheet name, shortened and made unique as excel requires
+        See write_to_excel for the other parameters.
+        """
+        if headers is None:
+            headers = get_headers(rule_list, preferred_header_order, headers_to_remove)
+        with self.lock:
+            worksheet = self.workbook.add_worksheet(self._sheet_name(name))
+            write_worksheet(self.workbook, worksheet, ["Order"] + headers,
+                            format_rules(rule_list, headers, default_map))
+
+    def close(self):
+        self.workbook.close()
+
+
+def export_rulebase(firewall, name, combined_rulebase, build_resolver, output_format='xlsx', workbook=None,
+                    resolve_addresses=False, detect_shadowed_rules=False, hit_counts=None):
+    """
+    Adds the analysis columns to a combined rulebase and writes it out.
+    :param firewall: Firewall or Panorama the rulebase comes from, attributes the stages in profile reports
+    :param name: Sheet name, or the part of the filename naming the firewall
+    :param combined_rulebase: List of rules
+    :param build_resolver: Called without arguments for the panobjects.AddressResolver of the rulebase, only when
+    addresses are resolved or shadowed rules detected
+    :param output_format: One of WRITERS, the format of the file written
+    :param workbook: FleetWorkbook to add the rulebase to as a sheet instead of writing a file
+    :param resolve_addresses: See do_the_things
+    :param detect_shadowed_rules: See do_the_things
+    :param hit_counts: Dictionary of rule name to panhits.HitCount added as columns, None to leave them out
+    :return:
+    """
+    if hit_counts is not None:
+        combined_rulebase = panhits.add_hit_count_columns(combined_rulebase, hit_counts)
+    if resolve_addresses or detect_shadowed_rules:
+        with panprofile.stage(firewall, 'analyze') as record:
+            resolver = build_resolver()
+            if detect_shadowed_rules:
+                combined_rulebase = panshadow.add_shadow_column(combined_rulebase, resolver)
+            if resolve_addresses:
+                combined_rulebase = panobjects.add_resolved_addresses(combined_rulebase, resolver)
+            record['rules'] = len(combined_rulebase)
 
     # Define headers we care about being ordered in the order they should be.
     rulebase_headers_order = HEADERS_ORDER
@@ -196,25 +707,187 @@ def do_the_things(firewall, api_key, top_domain=''):
     rulebase_default_map = HEADERS_DEFAULT_MAP
 
     # Finally let's write the damn thing
+    # Rows are formatted while they are written, the write stage includes formatting
+    with panprofile.stage(firewall, 'format and write') as record:
+        record['rules'] = len(combined_rulebase)
+        # Gathered once here, the writers then go through the rules a single time while they format them
+        headers = get_headers(combined_rulebase, rulebase_headers_order, rulebase_headers_remove)
+        if workbook is not None:
+            workbook.add_rulebase(
+                name,
+                combined_rulebase,
+                rulebase_headers_order,
+                rulebase_headers_remove,
+                rulebase_default_map,
+                headers=headers
+            )
+        else:
+            filename = get_filename(name, output_format)
+            WRITERS[output_format](
+                combined_rulebase,
+                filename,
+                rulebase_headers_order,
+                rulebase_headers_remove,
+                rulebase_default_map,
+                headers=headers
+            )
+            if os.path.exists(filename):
+                record['bytes'] = os.path.getsize(filename)
 
-    write_to_excel(
-        combined_rulebase,
-        get_filename(firewall.strip(top_domain)),
-        rulebase_headers_order,
-        rulebase_headers_remove,
-        rulebase_default_map
-    )
+
+def list_outputs(firewall, top_domain, running_config):
+    """
+    :param firewall: Hostname (FQDN) of the firewall
+    :param top_domain: Domain stripped from the firewall name in the output filename
+    :param running_config: Parsed running config
+    :return: List of (vsys, name) for every rulebase exported, vsys is None when the config has none
+    """
+    vsys_names = [entry.get('@name') for entry in list_vsys(running_config)]
+    name = firewall.strip(top_domain)
+    # Only firewalls running several vsys get an output per vsys, named after both
+    if len(vsys_names) > 1:
+        return [(vsys, '{}-{}'.format(name, vsys)) for vsys in vsys_names]
+    return [(vsys, name) for vsys in vsys_names or [None]]
+
+
+def output_options_fingerprint(output_format, resolve_addresses, detect_shadowed_rules):
+    """
+    Summarises the options changing what an export writes, an unchanged firewall is exported again when they differ.
+    See do_the_things for the parameters.
+    :return: Fingerprint as string, stored in the cache alongside the configs
+    """
+    return json.dumps({'format': output_format, 'resolve-addresses': bool(resolve_addresses),
+                       'detect-shadowed-rules': bool(detect_shadowed_rules)}, sort_keys=True)
+
+
+def do_the_things(firewall, api_key, top_domain='', cache=None, output_format='xlsx', workbook=None,
+                  resolve_addresses=False, detect_shadowed_rules=False, hit_counts=False):
+    """
+    This is the primary meat of the script. It takes a firewall and API key and writes out excel
+    sheets with the rulebase.
+    :param firewall: Firewall to query
+    :param api_key: API key to query
+    :param top_domain: Domain stripped from the firewall name in the output filename
+    :param cache: pancache.ConfigCache, firewalls whose configs match the cache are skipped. None disables caching.
+    :param output_format: One of WRITERS, the format of the file written for this firewall
+    :param workbook: FleetWorkbook to add the rulebase to as a sheet instead of writing a file per firewall
+    :param resolve_addresses: If True source-resolved and destination-resolved columns list the networks behind
+    address objects and groups
+    :param detect_shadowed_rules: If True a shadowed-by column names the earlier rule covering each rule which can
+    never match
+    :param hit_counts: If True hit-count and last-hit columns show how often and when each rule last matched. The
+    counts are pulled in one call while the configs download.
+    ;return:
+    """
+    # "Zhu Li, do the thing!"
+    # Retrieve both possible configurations from firewall, and the hit counts alongside them
+    vsys_hit_counts = None
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        if hit_counts:
+            vsys_hit_counts = {panhits.DEFAULT_VSYS: executor.submit(panhits.load_hit_counts, firewall, api_key)}
+        running, pushed = load_both_configurations(firewall, api_key, cache)
+    running_config = running.parsed
+    pushed_config = pushed.parsed
+    outputs = list_outputs(firewall, top_domain, running_config)
+    options = output_options_fingerprint(output_format, resolve_addresses, detect_shadowed_rules)
+    # A shared workbook needs every firewall, unchanged or not. Hit counts move without a commit.
+    if (workbook is None and not hit_counts and running.status == CONFIG_UNCHANGED
+            and pushed.status == CONFIG_UNCHANGED
+            and (all(cache.lookup_options(firewall, config) == options for config in CACHED_CONFIGS)
+                 or all(os.path.exists(get_filename(name, output_format)) for vsys, name in outputs))):
+        print('{} unchanged since last export, skipping.'.format(firewall))
+        return
+
+    for vsys, name in outputs:
+        with panprofile.stage(firewall, 'combine') as record:
+            combined_rulebase = combine_the_rulebase(pushed_config, running_config, vsys)
+            record['rules'] = len(combined_rulebase)
+        counts = None
+        if vsys_hit_counts is not None:
+            # Counts are per vsys, only firewalls running several need more than the call made up front
+            if (vsys or panhits.DEFAULT_VSYS) in vsys_hit_counts:
+                counts = vsys_hit_counts[vsys or panhits.DEFAULT_VSYS].result()
+            else:
+                counts = panhits.load_hit_counts(firewall, api_key, vsys)
+        export_rulebase(firewall, name, combined_rulebase,
+                        functools.partial(build_address_resolver, pushed_config, running_config, vsys),
+                        output_format, workbook, resolve_addresses, detect_shadowed_rules, counts)
+
+    # Only remember the configs once they have been exported, a failed write is retried next run
+    if cache is not None:
+        for config, loaded in zip(CACHED_CONFIGS, (running, pushed)):
+            if loaded.status == CONFIG_CHANGED:
+                cache.store(firewall, config, loaded.xml, loaded.parsed, options)
+            elif loaded.status == CONFIG_UNCHANGED:
+                cache.store_options(firewall, config, options)
 
     # I should print something to let user know it worked.
     # Dharma says feedback is important for good coding.
     print('{} processed. Please check directory for output files.'.format(firewall))
 
 
-def get_filename(firewall):
+# Parsed Panorama config export_device_group works on, set once per process instead of sent with every task
+_panorama_config = None
+
+
+def set_panorama_config(panorama_config):
+    """
+    :param panorama_config: Panorama running config parsed with CONFIG_PATHS[PANORAMA_CONFIG]
+    :return:
+    """
+    global _panorama_config
+    _panorama_config = panorama_config
+
+
+def export_device_group(device_group, panorama, top_domain='', output_format='xlsx', workbook=None,
+                        resolve_addresses=False, detect_shadowed_rules=False):
+    """
+    Writes out the combined rulebase of a device group of the Panorama config installed with set_panorama_config.
+    :param device_group: Name of the device group
+    :param panorama: Hostname of the Panorama, the output is named after it and the device group
+    See do_the_things for the other parameters.
+    :return:
+    """
+    with panprofile.stage(panorama, 'combine') as record:
+        combined_rulebase = combine_device_group_rulebase(_panorama_config, device_group)
+        record['rules'] = len(combined_rulebase)
+    export_rulebase(panorama, '{}-{}'.format(panorama.strip(top_domain), device_group), combined_rulebase,
+                    functools.partial(build_device_group_resolver, _panorama_config, device_group),
+                    output_format, workbook, resolve_addresses, detect_shadowed_rules)
+    print('{} device group {} processed.'.format(panorama, device_group))
+
+
+def export_panorama(panorama, api_key, top_domain='', output_format='xlsx', workbook=None, resolve_addresses=False,
+                    detect_shadowed_rules=False, max_workers=None, use_processes=True):
+    """
+    Exports every device group of a Panorama from a single pull of its running config, instead of pulling the
+    config of every firewall it manages. The device groups are combined and written in parallel.
+    :param panorama: Hostname (FQDN) of the Panorama
+    :param api_key: API key to access the Panorama configuration
+    :param max_workers: Number of workers, defaults to the number of cores
+    :param use_processes: False runs the device groups in threads of this process, needed when they share state
+    such as a FleetWorkbook
+    See do_the_things for the other parameters.
+    :return: Tuple of (results, failures) keyed by device group, see panfleet.run_across_firewalls
+    """
+    panorama_config = parse_firewall_configuration(fetch_firewall_configuration(panorama, api_key, 'running'),
+                                                   PANORAMA_CONFIG, panorama)
+    device_groups = list_device_groups(panorama_config)
+    task = panprofile.get_profiler().wrap(export_device_group)
+    task_arguments = (panorama, top_domain, output_format, workbook, resolve_addresses, detect_shadowed_rules)
+    set_panorama_config(panorama_config)
+    if use_processes:
+        return panfleet.run_in_processes(task, device_groups, max_workers, set_panorama_config, (panorama_config,),
+                                         *task_arguments)
+    return panfleet.run_across_firewalls(task, device_groups, max_workers or os.cpu_count() or 1, *task_arguments)
+
+
+def get_filename(firewall, extension='xlsx'):
     """
     Generate an excel spreadsheet filename from a firewall name and the current time.
     :param firewall: firewall name
-    :return: A filename in the format YYYY-MM-DD-{firewall}-combined-rules.xlsx
+    :param extension: file extension, defaults to xlsx
+    :return: A filename in the format YYYY-MM-DD-{firewall}-combined-rules.{extension}
     """
     current_time = datetime.now()
     return (
@@ -222,9 +895,10 @@ def get_filename(firewall):
         "{month}-"
         "{day}-"
         "{firewall}-combined-rules"
-        ".xlsx"
+        ".{extension}"
     ).format(
         firewall=firewall,
+        extension=extension,
         year=pad_to_two_digits(current_time.year),
         month=pad_to_two_digits(current_time.month),
         day=pad_to_two_digits(current_time.day),
@@ -240,12 +914,132 @@ def pad_to_two_digits(n):
     return str(n).zfill(2)
 
 
-def main():
-    script_config = Config('config.yml')
-    for firewall in script_config.firewall_hostnames:
-        do_the_things(firewall,
-                      script_config.firewall_api_key,
-                      script_config.top_domain)
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description='Export the combined rulebase of each firewall in config.yml.')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Always fetch, parse and export every firewall, ignoring and not updating the cache')
+    parser.add_argument('--format', choices=OUTPUT_FORMATS, default=None,
+                        help='Output format, overrides output_format in config.yml. "workbook" writes a single '
+                             'spreadsheet with a sheet per firewall')
+    parser.add_argument('--resolve-addresses', action='store_true',
+                        help='Add columns listing the networks behind address objects and groups, overrides '
+                             'resolve_addresses in config.yml')
+    parser.add_argument('--detect-shadowed-rules', action='store_true',
+                        help='Add a column naming the earlier rule which shadows each rule that can never match, '
+                             'overrides detect_shadowed_rules in config.yml')
+    parser.add_argument('--hit-counts', action='store_true',
+                        help='Add hit-count and last-hit columns pulled from each firewall, overrides hit_counts in '
+                             'config.yml')
+    parser.add_argument('--watch', action='store_true',
+                        help='Keep running, poll every firewall for new commits every watch_interval seconds and '
+                             'export the ones which committed')
+    parser.add_argument('--panorama', metavar='HOSTNAME',
+                        help='Export the device groups of this Panorama from a single pull of its config instead of '
+                             'querying the firewalls in config.yml')
+    parser.add_argument('--snapshot', metavar='PATH',
+                        help='Export the firewalls saved in a snapshot directory or archive instead of querying them, '
+                             'config.yml is optional')
+    panprofile.add_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def watch(script_config, cache, output_format, resolve_addresses=False, detect_shadowed_rules=False,
+          hit_counts=False):
+    """
+    Exports every firewall which commits, until interrupted. See panwatch.
+    :param script_config: Config
+    :param cache: pancache.ConfigCache or None
+    :param output_format: One of WRITERS
+    :param resolve_addresses: See do_the_things
+    :param detect_shadowed_rules: See do_the_things
+    :param hit_counts: See do_the_things
+    :return:
+    """
+    def export(firewall):
+        do_the_things(firewall, script_config.firewall_api_key, script_config.top_domain, cache, output_format,
+                      None, resolve_addresses, detect_shadowed_rules, hit_counts)
+
+    watcher = panwatch.Watcher(script_config.firewall_hostnames, script_config.firewall_api_key, export,
+                               script_config.watch_interval, script_config.watch_max_backoff,
+                               script_config.max_workers)
+    print('Watching {} firewall(s) for commits every {}s, press Ctrl+C to stop.'.format(
+        len(script_config.firewall_hostnames), script_config.watch_interval))
+    try:
+        watcher.run(panwatch.print_poll)
+    except KeyboardInterrupt:
+        watcher.stop()
+        print('Stopped watching.')
+
+
+def main(argv=None):
+    arguments = parse_arguments(argv)
+    offline = arguments.snapshot is not None
+    script_config = Config(None if offline and not os.path.exists('config.yml') else 'config.yml')
+    panapi.set_client(panapi.client_from_config(script_config.api_options))
+    cache = None
+    # A snapshot never changes, caching it would only skip its firewalls on the next run
+    if not offline and not arguments.no_cache and script_config.cache_dir:
+        cache = pancache.ConfigCache(script_config.cache_dir,
+                                     script_config.cache_max_age_days,
+                                     script_config.cache_max_size_mb,
+                                     script_config.use_cache_when_unreachable)
+        cache.evict()
+    output_format = arguments.format or script_config.output_format
+    hit_counts = arguments.hit_counts or script_config.hit_counts
+    if hit_counts and arguments.panorama:
+        raise SystemExit('--hit-counts reads the counters of each firewall, Panorama device groups have none.')
+    if arguments.watch:
+        if offline or arguments.panorama or output_format == WORKBOOK_FORMAT:
+            raise SystemExit('--watch exports each firewall to its own file as it commits, '
+                             'it works with neither --snapshot, --panorama nor the workbook format.')
+        watch(script_config, cache, output_format, arguments.resolve_addresses or script_config.resolve_addresses,
+              arguments.detect_shadowed_rules or script_config.detect_shadowed_rules, hit_counts)
+        return
+    workbook = None
+    if output_format == WORKBOOK_FORMAT:
+        workbook = FleetWorkbook(get_filename('fleet'))
+    profiler = panprofile.start(arguments)
+    task = panprofile.get_profiler().wrap(do_the_things)
+    task_arguments = (script_config.firewall_api_key,
+                      script_config.top_domain,
+                      cache,
+                      output_format,
+                      workbook,
+                      arguments.resolve_addresses or script_config.resolve_addresses,
+                      arguments.detect_shadowed_rules or script_config.detect_shadowed_rules,
+                      hit_counts)
+    panorama_arguments = (script_config.firewall_api_key,
+                          script_config.top_domain,
+                          output_format,
+                          workbook,
+                          arguments.resolve_addresses or script_config.resolve_addresses,
+                          arguments.detect_shadowed_rules or script_config.detect_shadowed_rules,
+                          None,
+                          workbook is None and profiler is None)
+    try:
+        if arguments.panorama is not None and offline:
+            with pansnapshot.open_snapshot(arguments.snapshot) as client:
+                panapi.set_client(client)
+                _, failures = export_panorama(arguments.panorama, *panorama_arguments)
+        elif arguments.panorama is not None:
+            _, failures = export_panorama(arguments.panorama, *panorama_arguments)
+        elif offline:
+            with pansnapshot.open_snapshot(arguments.snapshot) as client:
+                # The workbook and the profiler live in this process, the firewalls then share it as threads
+                _, failures = pansnapshot.run_across_snapshot(task, client, None,
+                                                              workbook is None and profiler is None,
+                                                              *task_arguments)
+        else:
+            _, failures = panfleet.run_across_firewalls(task,
+                                                        script_config.firewall_hostnames,
+                                                        script_config.max_workers,
+                                                        *task_arguments)
+    finally:
+        if workbook is not None:
+            workbook.close()
+        panprofile.finish(profiler, arguments)
+    panfleet.report_failures(failures)
+    panapi.print_metrics(panapi.get_client().metrics)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,80 @@
+"""
+Helpers shared by the scripts for running a per-firewall task across the whole fleet.
+"""
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+DEFAULT_MAX_WORKERS = 8
+
+
+def run_across_firewalls(task, firewalls, max_workers=DEFAULT_MAX_WORKERS, *args, **kwargs):
+    """
+    Runs task(firewall, *args, **kwargs) for every firewall using a bounded pool of worker threads.
+    A failure on one firewall is recorded and does not stop the remaining firewalls from being processed.
+    :param task: Callable taking the firewall hostname as first argument
+    :param firewalls: List of firewall hostnames
+    :param max_workers: Maximum number of firewalls processed at the same time
+    :return: Tuple of (results, failures), both ordered dictionaries keyed by firewall in the order given.
+    results holds the return value of task, failures holds the exception raised by task.
+    """
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        return _collect(executor, task, firewalls, args, kwargs)
+
+
+def run_in_processes(task, firewalls, max_workers=None, initializer=None, initargs=(), *args, **kwargs):
+    """
+    Same as run_across_firewalls but in a pool of processes, for tasks bound by CPU rather than the network such as
+    parsing saved configs. task, its arguments and its results must be picklable.
+    :param task: Module level function taking the firewall hostname as first argument
+    :param firewalls: List of firewall hostnames
+    :param max_workers: Number of processes, defaults to the number of cores
+    :param initializer: Called with initargs in every process before it runs tasks
+    :param initargs: Arguments of initializer
+    :return: Tuple of (results, failures), see run_across_firewalls
+    """
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=initializer, initargs=initargs) as executor:
+        return _collect(executor, task, firewalls, args, kwargs)
+
+
+def iter_completed(executor, task, firewalls, *args, **kwargs):
+    """
+    Submits task(firewall, *args, **kwargs) for every firewall and yields the firewalls in the order they finish.
+    Each result is released once yielded, so large results can be handled one firewall at a time.
+    :param executor: concurrent.futures executor the tasks run in
+    :param task: Callable taking the firewall hostname as first argument
+    :param firewalls: List of firewall hostnames
+    :return: Generator of (firewall, result, exception) tuples, exception is None when task succeeded
+    """
+    futures = {executor.submit(task, firewall, *args, **kwargs): firewall for firewall in firewalls}
+    for future in as_completed(futures):
+        firewall = futures.pop(future)
+        error = future.exception()
+        yield firewall, None if error is not None else future.result(), error
+
+
+def _collect(executor, task, firewalls, args, kwargs):
+    finished = {firewall: (result, error)
+                for firewall, result, error in iter_completed(executor, task, firewalls, *args, **kwargs)}
+
+    results = OrderedDict()
+    failures = OrderedDict()
+    for firewall in firewalls:
+        result, error = finished[firewall]
+        if error is None:
+            results[firewall] = result
+        else:
+            failures[firewall] = error
+    return results, failures
+
+
+def report_failures(failures):
+    """
+    Prints out a summary of the firewalls which could not be processed.
+    :param failures: Dictionary of firewall to exception as returned by run_across_firewalls
+    :return:
+    """
+    if not failures:
+        return
+    print('{} firewall(s) could not be processed:'.format(len(failures)))
+    for firewall, error in failures.items():
+        print('  {}: {}: {}'.format(firewall, type(error).__name__, error))
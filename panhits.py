@@ -0,0 +1,119 @@
+"""
+Rule usage of a firewall, pulled for the whole security rulebase of a vsys in a single API call.
+
+The firewall counts hits per rule name, for the rules of its own config and the ones pushed by Panorama alike, so
+the counts join onto the combined rulebase by name. Counters restart when they are reset, the time of the
+last reset is part of the response.
+"""
+from datetime import datetime, timezone
+from typing import NamedTuple
+from xml.etree import ElementTree
+
+import panapi
+import panprofile
+
+DEFAULT_VSYS = 'vsys1'
+
+HIT_COUNT_HEADER = 'hit-count'
+LAST_HIT_HEADER = 'last-hit'
+
+# Written in the last-hit column of rules the firewall has never matched
+NEVER_HIT = 'never'
+
+# 'show rule-hit-count' needs attributes, which the text form of operational commands can't express
+HIT_COUNT_COMMAND = ('<show><rule-hit-count><vsys><vsys-name><entry name="{}"><rule-base><entry name="security">'
+                     '<rules><all/></rules></entry></rule-base></entry></vsys-name></vsys></rule-hit-count></show>')
+
+
+class HitCount(NamedTuple):
+    """
+    Usage of a rule. The timestamps are seconds since the epoch, 0 when it never happened.
+    """
+    hit_count: int
+    last_hit: int
+    first_hit: int
+    last_reset: int
+
+
+def fetch_hit_counts(hostname, api_key, vsys=DEFAULT_VSYS):
+    """
+    Retrieves the hit counts of every security rule of a vsys as raw XML.
+    :param hostname: Hostname (FQDN) of the firewall
+    :param api_key: API key to access the firewall
+    :param vsys: Name of the vsys, defaults to vsys1 which every firewall has
+    :return: XML inside the <result> of the response as string
+    """
+    with panprofile.stage(hostname, 'fetch hit counts') as record:
+        xml = panapi.get_client().op(hostname, api_key, HIT_COUNT_COMMAND.format(vsys))
+        record['bytes'] = len(xml or '')
+    return xml
+
+
+def _timestamp(entry, tag):
+    text = entry.findtext(tag)
+    return int(text) if text and text.isdigit() else 0
+
+
+def parse_hit_counts(xml):
+    """
+    :param xml: Result of fetch_hit_counts
+    :return: Dictionary of rule name to HitCount
+    """
+    if not xml:
+        return {}
+    try:
+        root = ElementTree.fromstring(xml)
+    except ElementTree.ParseError as error:
+        raise panapi.PanApiError('invalid hit count response: {}'.format(error))
+    hit_counts = {}
+    for entry in root.iterfind('.//rules/entry'):
+        hit_counts[entry.get('name')] = HitCount(_timestamp(entry, 'hit-count'),
+                                                 _timestamp(entry, 'last-hit-timestamp'),
+                                                 _timestamp(entry, 'first-hit-timestamp'),
+                                                 _timestamp(entry, 'last-reset-timestamp'))
+    return hit_counts
+
+
+def load_hit_counts(hostname, api_key, vsys=DEFAULT_VSYS):
+    """
+    Retrieves and parses the hit counts of a vsys. The counts only add columns to the export, a firewall which
+    can't report them is exported without.
+    :param hostname: Hostname (FQDN) of the firewall
+    :param api_key: API key to access the firewall
+    :param vsys: Name of the vsys
+    :return: Dictionary of rule name to HitCount, None when they couldn't be retrieved
+    """
+    try:
+        return parse_hit_counts(fetch_hit_counts(hostname, api_key, vsys))
+    except (panapi.PanApiError, OSError) as error:
+        print('{} hit counts unavailable ({}), exporting without them.'.format(hostname, error))
+        return None
+
+
+def format_timestamp(timestamp):
+    """
+    :param timestamp: Seconds since the epoch, 0 for never
+    :return: ex. '2025-10-16 12:00:00' in UTC, NEVER_HIT for 0
+    """
+    if not timestamp:
+        return NEVER_HIT
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def add_hit_count_columns(rule_list, hit_counts):
+    """
+    Returns copies of the rules with hit-count and last-hit columns. Both are empty for rules the firewall didn't
+    report, ex. rules committed after the counts were read.
+    :param rule_list: Rules in rulebase order
+    :param hit_counts: Dictionary of rule name to HitCount, see parse_hit_counts
+    :return: List of rules
+    """
+    enriched_rules = []
+    for rule in rule_list:
+        enriched_rule = rule.copy()
+        hit_count = hit_counts.get(rule.get('@name'))
+        if hit_count is not None:
+            enriched_rule[HIT_COUNT_HEADER] = str(hit_count.hit_count)
+            enriched_rule[LAST_HIT_HEADER] = format_timestamp(hit_count.last_hit)
+        enriched_rules.append(enriched_rule)
+    return enriched_rules
@@ -0,0 +1,653 @@
+#!/usr/bin/env python3
+"""
+Persistent, fleet wide index of the security rules, answering questions such as "which rules on which firewalls
+reference 10.20.0.0/16 or application ssl" without querying the firewalls again.
+
+The index is a SQLite database built from the combined rulebase of every firewall (addresses resolved through
+address objects and groups) and optionally from the rules compiled on the dataplane. Each firewall is updated on its
+own and only when its config or dataplane changed since it was last indexed.
+
+Addresses are stored as CIDR blocks in the IPv6 space used by pancompare, with their first and last address as
+32 character hex strings so they sort like the numbers they stand for. A query block then matches the stored blocks it
+contains, found with one range scan, and the at most 129 blocks containing it, found with point lookups.
+
+The addresses of a negated source or destination are stored under negate-source or negate-destination instead. Such a
+rule shares an address with a query unless every query block is inside one of its excluded blocks.
+"""
+import argparse
+import csv
+import json
+import os
+import sqlite3
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import NamedTuple
+
+import panapi
+import pancache
+import pancompare
+import panexport
+import panfleet
+import panobjects
+import panshadow
+import pansnapshot
+
+DEFAULT_INDEX_FILE = 'panindex.sqlite'
+
+CONFIG = 'config'
+DATAPLANE = 'dataplane'
+ORIGINS = [CONFIG, DATAPLANE]
+
+# Rule fields stored as names, source and destination also get the address blocks they resolve to
+MEMBER_FIELDS = ['from', 'to', 'source', 'destination', 'source-user', 'application', 'service', 'category', 'tag']
+ADDRESS_FIELDS = ['source', 'destination']
+# Flag columns of the rules negating an address field
+NEGATE_COLUMNS = {'source': 'negate_source', 'destination': 'negate_destination'}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS firewalls (
+    hostname TEXT NOT NULL,
+    origin TEXT NOT NULL,
+    content_hash TEXT NOT NULL,
+    indexed_at REAL NOT NULL,
+    rule_count INTEGER NOT NULL,
+    PRIMARY KEY (hostname, origin)
+);
+CREATE TABLE IF NOT EXISTS rules (
+    id INTEGER PRIMARY KEY,
+    hostname TEXT NOT NULL,
+    origin TEXT NOT NULL,
+    vsys TEXT,
+    position INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    action TEXT,
+    disabled INTEGER NOT NULL DEFAULT 0,
+    negate_source INTEGER NOT NULL DEFAULT 0,
+    negate_destination INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS members (
+    rule_id INTEGER NOT NULL,
+    field TEXT NOT NULL,
+    value TEXT NOT NULL COLLATE NOCASE
+);
+CREATE TABLE IF NOT EXISTS blocks (
+    rule_id INTEGER NOT NULL,
+    field TEXT NOT NULL,
+    first TEXT NOT NULL,
+    last TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS ports (
+    rule_id INTEGER NOT NULL,
+    application TEXT NOT NULL COLLATE NOCASE,
+    protocol TEXT NOT NULL,
+    port_first INTEGER NOT NULL,
+    port_last INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS rules_firewall ON rules (hostname, origin);
+CREATE INDEX IF NOT EXISTS members_value ON members (field, value);
+CREATE INDEX IF NOT EXISTS members_rule ON members (rule_id);
+CREATE INDEX IF NOT EXISTS blocks_first ON blocks (field, first);
+CREATE INDEX IF NOT EXISTS blocks_rule ON blocks (rule_id);
+CREATE INDEX IF NOT EXISTS ports_first ON ports (protocol, port_first);
+CREATE INDEX IF NOT EXISTS ports_rule ON ports (rule_id);
+"""
+
+# Stored as the user_version of the database, an index of an older version is indexed again
+SCHEMA_VERSION = 2
+
+# Columns added to the rules table since it was first released, added to older index files when they are opened
+ADDED_RULE_COLUMNS = [('vsys', 'TEXT'), ('negate_source', 'INTEGER NOT NULL DEFAULT 0'),
+                      ('negate_destination', 'INTEGER NOT NULL DEFAULT 0')]
+
+
+class IndexedRule(NamedTuple):
+    """
+    A rule as stored in the index. members are (field, value) tuples, blocks are (field, first, last) tuples of
+    CIDR blocks as integers. position counts from the first rule of the vsys, vsys is None for dataplane rules.
+    negated lists the address fields the rule negates, their members and blocks are stored under the negate parameter.
+    ports are (application, protocol, first, last) tuples of the destination ports of dataplane services.
+    """
+    position: int
+    name: str
+    action: str
+    disabled: bool
+    members: tuple
+    blocks: tuple
+    vsys: str = None
+    negated: tuple = ()
+    ports: tuple = ()
+
+
+class IndexedFirewall(NamedTuple):
+    """
+    What index_firewall found for a firewall. rules is None for an origin whose content is unchanged.
+    """
+    hostname: str
+    origin: str
+    content_hash: str
+    rules: list
+
+
+class SearchResult(NamedTuple):
+    hostname: str
+    origin: str
+    vsys: str
+    position: int
+    name: str
+    action: str
+    disabled: bool
+
+
+def to_hex(value):
+    """
+    :param value: Integer in the IPv6 space
+    :return: 32 character lower case hex string, sorting like the integer
+    """
+    return '{:032x}'.format(value)
+
+
+def interval_to_blocks(first, last):
+    """
+    Splits an interval of the IPv6 space into the fewest CIDR blocks covering exactly the same addresses.
+    :param first: First address as integer
+    :param last: Last address as integer
+    :return: List of (first, last) integer tuples, one per block
+    """
+    blocks = []
+    while first <= last:
+        # Largest block starting at first which is aligned and doesn't run past last
+        size = first & -first if first else 1 << 128
+        while size > last - first + 1:
+            size >>= 1
+        blocks.append((first, first + size - 1))
+        first += size
+    return blocks
+
+
+def _containing_starts(first, last):
+    """
+    :return: First addresses of every CIDR block containing the block (first, last), including itself
+    """
+    starts = []
+    size = last - first + 1
+    while size <= 1 << 128:
+        starts.append(first & ~(size - 1))
+        size <<= 1
+    return starts
+
+
+def _member_values(value):
+    return [member for member in panobjects.members(value) if isinstance(member, str)]
+
+
+def _address_blocks(field, values):
+    """
+    :param values: Resolved address values of a rule field
+    :return: Tuple of (members, blocks) for the values which aren't names
+    """
+    addresses = panshadow.address_set(values)
+    if addresses is None:
+        return ((field, 'any'),), ()
+    members = tuple((field, token) for token in sorted(addresses.tokens))
+    blocks = tuple((field, block_first, block_last)
+                   for first, last in addresses.intervals
+                   for block_first, block_last in interval_to_blocks(first, last))
+    return members, blocks
+
+
+def index_config_rules(pushed_config, running_config):
+    """
+    :param pushed_config: Parsed pushed-shared-policy config
+    :param running_config: Parsed running config
+    :return: List of IndexedRule for the combined rulebase of every vsys
+    """
+    indexed_rules = []
+    vsys_names = [entry.get('@name') for entry in panexport.list_vsys(running_config)]
+    for vsys in vsys_names or [None]:
+        resolver = panexport.build_address_resolver(pushed_config, running_config, vsys)
+        for position, rule in enumerate(panexport.combine_the_rulebase(pushed_config, running_config, vsys)):
+            members = []
+            blocks = []
+            negated = tuple(field for field in ADDRESS_FIELDS
+                            if rule.get(pancompare.NEGATE_PARAMETERS[field]) == 'yes')
+            for field in MEMBER_FIELDS:
+                values = _member_values(rule.get(field))
+                stored_field = pancompare.NEGATE_PARAMETERS[field] if field in negated else field
+                members.extend((stored_field, value) for value in values)
+                if field in ADDRESS_FIELDS:
+                    address_members, address_blocks = _address_blocks(stored_field,
+                                                                      resolver.resolve_members(values))
+                    members.extend(address_members)
+                    blocks.extend(address_blocks)
+            indexed_rules.append(IndexedRule(position, rule.get('@name', ''), rule.get('action'),
+                                             rule.get('disabled') == 'yes', tuple(dict.fromkeys(members)),
+                                             tuple(blocks), vsys, negated))
+    return indexed_rules
+
+
+def _dataplane_list(value):
+    return value.strip('[] ').split()
+
+
+def index_dataplane_rules(dataplane_raw):
+    """
+    :param dataplane_raw: Dataplane output, see pancompare.iter_dataplane_rules
+    :return: List of IndexedRule for the rules of the first dataplane.
+    application/service entries such as ssl/tcp/any/443 are stored as application ssl and service tcp/443.
+    """
+    indexed_rules = []
+    for position, rule in enumerate(pancompare.iter_dataplane_rules(dataplane_raw)):
+        members = [('from', zone) for zone in rule.from_zones] + [('to', zone) for zone in rule.to_zones]
+        blocks = []
+        negated = tuple(field for field in ADDRESS_FIELDS
+                        if rule.parameters.get(pancompare.NEGATE_PARAMETERS[field]) == 'yes')
+        for field, value in (('source', rule.source), ('destination', rule.destination)):
+            if value.strip() in ('', 'any'):
+                members.append((field, 'any'))
+                continue
+            stored_field = pancompare.NEGATE_PARAMETERS[field] if field in negated else field
+            intervals = pancompare.convert_to_intervals(value)
+            blocks.extend((stored_field, block_first, block_last)
+                          for first, last in intervals
+                          for block_first, block_last in interval_to_blocks(first, last))
+        ports = []
+        for entry in pancompare.parse_application_service(rule.application_service):
+            members.append(('application', entry.application))
+            if entry.protocol == 'any':
+                members.append(('service', 'any'))
+            else:
+                ports.append((entry.application, entry.protocol) + entry.destination_ports)
+        for field, parameter in (('source-user', 'user'), ('category', 'category')):
+            members.extend((field, value) for value in _dataplane_list(rule.parameters.get(parameter, '')))
+        indexed_rules.append(IndexedRule(position, rule.name, rule.action, False,
+                                         tuple(dict.fromkeys(members)), tuple(blocks), None, negated,
+                                         tuple(dict.fromkeys(ports))))
+    return indexed_rules
+
+
+def index_firewall(firewall, api_key, known_hashes=None, include_dataplane=False):
+    """
+    Retrieves a firewall's configs, and optionally its dataplane, and indexes the rules of the ones which changed.
+    :param firewall: Firewall to query
+    :param api_key: API key to query
+    :param known_hashes: Dictionary of (hostname, origin) to the content hash stored in the index
+    :param include_dataplane: Also index the rules of the first dataplane
+    :return: List of IndexedFirewall, one per origin
+    """
+    known_hashes = known_hashes or {}
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        running = executor.submit(panexport.fetch_firewall_configuration, firewall, api_key, 'running')
+        pushed = executor.submit(panexport.fetch_firewall_configuration, firewall, api_key, 'pushed-shared-policy')
+        running_xml, pushed_xml = running.result() or '', pushed.result() or ''
+
+    indexed = []
+    content_hash = pancache.content_hash(running_xml + '\0' + pushed_xml)
+    rules = None
+    if known_hashes.get((firewall, CONFIG)) != content_hash:
+        rules = index_config_rules(panexport.parse_firewall_configuration(pushed_xml, 'pushed-shared-policy', firewall),
+                                   panexport.parse_firewall_configuration(running_xml, 'running', firewall))
+    indexed.append(IndexedFirewall(firewall, CONFIG, content_hash, rules))
+
+    if include_dataplane:
+        dataplane_raw = pancompare.retrieve_dataplane(firewall, api_key) or ''
+        content_hash = pancache.content_hash(dataplane_raw)
+        rules = None
+        if known_hashes.get((firewall, DATAPLANE)) != content_hash:
+            rules = index_dataplane_rules(dataplane_raw)
+        indexed.append(IndexedFirewall(firewall, DATAPLANE, content_hash, rules))
+    return indexed
+
+
+class FleetIndex:
+    def __init__(self, filename=DEFAULT_INDEX_FILE):
+        """
+        Opens or creates the index database.
+        :param filename: SQLite database file, ':memory:' for a throwaway index
+        """
+        self.connection = sqlite3.connect(filename)
+        self.connection.executescript(SCHEMA)
+        self._upgrade()
+
+    def _upgrade(self):
+        """
+        Brings an index created by an older version up to the current schema. Its rules lack what was added since,
+        so every firewall is indexed again on the next update.
+        """
+        if self.connection.execute('PRAGMA user_version').fetchone()[0] >= SCHEMA_VERSION:
+            return
+        columns = {row[1] for row in self.connection.execute('PRAGMA table_info(rules)')}
+        with self.connection:
+            for column, column_type in ADDED_RULE_COLUMNS:
+                if column not in columns:
+                    self.connection.execute('ALTER TABLE rules ADD COLUMN {} {}'.format(column, column_type))
+            self.connection.execute("UPDATE firewalls SET content_hash = ''")
+        self.connection.execute('PRAGMA user_version = {}'.format(SCHEMA_VERSION))
+
+    def hashes(self):
+        """
+        :return: Dictionary of (hostname, origin) to the content hash the rules were indexed from
+        """
+        rows = self.connection.execute('SELECT hostname, origin, content_hash FROM firewalls')
+        return {(hostname, origin): content_hash for hostname, origin, content_hash in rows}
+
+    def firewalls(self):
+        """
+        :return: List of (hostname, origin, indexed_at, rule_count) tuples
+        """
+        return self.connection.execute(
+            'SELECT hostname, origin, indexed_at, rule_count FROM firewalls ORDER BY hostname, origin').fetchall()
+
+    def _delete_rules(self, where, parameters):
+        rule_ids = 'SELECT id FROM rules WHERE ' + where
+        self.connection.execute('DELETE FROM members WHERE rule_id IN ({})'.format(rule_ids), parameters)
+        self.connection.execute('DELETE FROM blocks WHERE rule_id IN ({})'.format(rule_ids), parameters)
+        self.connection.execute('DELETE FROM ports WHERE rule_id IN ({})'.format(rule_ids), parameters)
+        self.connection.execute('DELETE FROM rules WHERE ' + where, parameters)
+
+    def store(self, indexed):
+        """
+        Replaces the rules of a firewall and origin in a single transaction. Unchanged firewalls only get their
+        indexed_at updated.
+        :param indexed: IndexedFirewall
+        :return: True if the rules were replaced
+        """
+        with self.connection:
+            if indexed.rules is None:
+                self.connection.execute('UPDATE firewalls SET indexed_at = ? WHERE hostname = ? AND origin = ?',
+                                        (time.time(), indexed.hostname, indexed.origin))
+                return False
+            self._delete_rules('hostname = ? AND origin = ?', (indexed.hostname, indexed.origin))
+            for rule in indexed.rules:
+                rule_id = self.connection.execute(
+                    'INSERT INTO rules (hostname, origin, vsys, position, name, action, disabled, negate_source, '
+                    'negate_destination) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (indexed.hostname, indexed.origin, rule.vsys, rule.position, rule.name, rule.action,
+                     int(rule.disabled), int('source' in rule.negated), int('destination' in rule.negated))
+                ).lastrowid
+                self.connection.executemany('INSERT INTO members VALUES (?, ?, ?)',
+                                            ((rule_id, field, value) for field, value in rule.members))
+                self.connection.executemany('INSERT INTO blocks VALUES (?, ?, ?, ?)',
+                                            ((rule_id, field, to_hex(first), to_hex(last))
+                                             for field, first, last in rule.blocks))
+                self.connection.executemany('INSERT INTO ports VALUES (?, ?, ?, ?, ?)',
+                                            ((rule_id,) + port for port in rule.ports))
+            self.connection.execute('INSERT OR REPLACE INTO firewalls VALUES (?, ?, ?, ?, ?)',
+                                    (indexed.hostname, indexed.origin, indexed.content_hash, time.time(),
+                                     len(indexed.rules)))
+        return True
+
+    def prune(self, hostnames):
+        """
+        Removes every firewall which isn't in hostnames.
+        :param hostnames: Firewalls to keep
+        :return: List of the removed hostnames
+        """
+        keep = set(hostnames)
+        removed = sorted({hostname for hostname, _ in self.hashes()} - keep)
+        with self.connection:
+            for hostname in removed:
+                self._delete_rules('hostname = ?', (hostname,))
+                self.connection.execute('DELETE FROM firewalls WHERE hostname = ?', (hostname,))
+        return removed
+
+    @staticmethod
+    def _address_condition(fields, values, include_any, parameters):
+        """
+        :return: SQL condition matching the rules with an address of fields overlapping any of values
+        """
+        field_marks = ', '.join('?' * len(fields))
+        conditions = []
+        tokens = []
+        query_blocks = []
+        for value in values:
+            addresses = panshadow.address_set([value])
+            if addresses is None:
+                tokens.append('any')
+                continue
+            tokens.extend(addresses.tokens)
+            for first, last in addresses.intervals:
+                for block_first, block_last in interval_to_blocks(first, last):
+                    query_blocks.append((block_first, block_last))
+                    # Stored blocks inside the query block
+                    conditions.append('id IN (SELECT rule_id FROM blocks WHERE field IN ({}) '
+                                      'AND first BETWEEN ? AND ?)'.format(field_marks))
+                    parameters.extend(fields + [to_hex(block_first), to_hex(block_last)])
+                    # Stored blocks containing it, each starts where one of its containing blocks would
+                    starts = _containing_starts(block_first, block_last)
+                    conditions.append('id IN (SELECT rule_id FROM blocks WHERE field IN ({}) AND first IN ({}) '
+                                      'AND last >= ?)'.format(field_marks, ', '.join('?' * len(starts))))
+                    parameters.extend(fields + [to_hex(start) for start in starts] + [to_hex(block_last)])
+        # Stored and query blocks are CIDRs, which nest or don't overlap, so a query block inside the excluded
+        # addresses is inside one of the excluded blocks
+        for field in fields:
+            if not query_blocks:
+                break
+            outside = []
+            for block_first, block_last in query_blocks:
+                starts = _containing_starts(block_first, block_last)
+                outside.append('id NOT IN (SELECT rule_id FROM blocks WHERE field = ? AND first IN ({}) '
+                               'AND last >= ?)'.format(', '.join('?' * len(starts))))
+                parameters.extend([pancompare.NEGATE_PARAMETERS[field]] + [to_hex(start) for start in starts] +
+                                  [to_hex(block_last)])
+            conditions.append('({} = 1 AND ({}))'.format(NEGATE_COLUMNS[field], ' OR '.join(outside)))
+        if include_any:
+            tokens.append('any')
+        if tokens:
+            conditions.append(FleetIndex._member_condition(fields, tokens, parameters))
+        return '({})'.format(' OR '.join(conditions))
+
+    @staticmethod
+    def _service_condition(values, include_any, parameters):
+        """
+        :return: SQL condition matching the rules with a service named like one of values, or with dataplane ports
+        overlapping one of the [application/]protocol[/ports] values
+        """
+        conditions = []
+        for value in values:
+            try:
+                application, protocol, ranges = pancompare.parse_service_filter(value)
+            except pancompare.FilterError:
+                continue
+            for first, last in ranges:
+                condition = 'protocol = ? AND port_first <= ? AND port_last >= ?'
+                parameters.extend([protocol, last, first])
+                if application is not None:
+                    condition += " AND application IN (?, 'any')"
+                    parameters.append(application)
+                conditions.append('id IN (SELECT rule_id FROM ports WHERE {})'.format(condition))
+        values = list(values) + (['any'] if include_any else [])
+        conditions.append(FleetIndex._member_condition(['service'], values, parameters))
+        return '({})'.format(' OR '.join(conditions))
+
+    @staticmethod
+    def _member_condition(fields, values, parameters):
+        parameters.extend(fields + list(values))
+        return 'id IN (SELECT rule_id FROM members WHERE field IN ({}) AND value IN ({}))'.format(
+            ', '.join('?' * len(fields)), ', '.join('?' * len(values)))
+
+    def search(self, addresses=(), sources=(), destinations=(), zones=(), from_zones=(), to_zones=(),
+               applications=(), services=(), users=(), tags=(), names=(), firewalls=(), origins=(),
+               include_any=False, vsys=()):
+        """
+        Finds the rules matching every given criterion, a rule matches a criterion when it matches any of its values.
+        Names and zones are compared without case.
+        :param addresses: IPs, networks, ranges or address names found in the source or the destination
+        :param sources: Same as addresses, in the source only
+        :param destinations: Same as addresses, in the destination only
+        :param zones: Zones found in from or to
+        :param from_zones: Zones found in from
+        :param to_zones: Zones found in to
+        :param applications: Application names
+        :param services: Service names, or [application/]protocol[/ports] matching the dataplane services whose
+        ports overlap them, ex. tcp/443 or tcp/8000-8100
+        :param users: Source users
+        :param tags: Tags
+        :param names: Rule names, may contain % and _ wildcards
+        :param firewalls: Hostnames of the firewalls to search
+        :param origins: CONFIG and/or DATAPLANE
+        :param include_any: Let 'any' in a rule match every value of the fields searched
+        :param vsys: Names of the vsys to search, dataplane rules have none
+        :return: List of SearchResult ordered by firewall, origin, vsys and position
+        """
+        conditions = []
+        parameters = []
+        for fields, values in ((ADDRESS_FIELDS, addresses), (['source'], sources), (['destination'], destinations)):
+            if values:
+                conditions.append(self._address_condition(list(fields), values, include_any, parameters))
+        for fields, values in ((['from', 'to'], zones), (['from'], from_zones), (['to'], to_zones),
+                               (['application'], applications), (['source-user'], users), (['tag'], tags)):
+            if values:
+                values = list(values) + (['any'] if include_any and fields != ['tag'] else [])
+                conditions.append(self._member_condition(fields, values, parameters))
+        if services:
+            conditions.append(self._service_condition(services, include_any, parameters))
+        if names:
+            conditions.append('({})'.format(' OR '.join('name LIKE ?' for _ in names)))
+            parameters.extend(names)
+        for column, values in (('hostname', firewalls), ('origin', origins), ('vsys', vsys)):
+            if values:
+                conditions.append('{} IN ({})'.format(column, ', '.join('?' * len(values))))
+                parameters.extend(values)
+        query = 'SELECT hostname, origin, vsys, position, name, action, disabled FROM rules'
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += ' ORDER BY hostname, origin, vsys, position'
+        return [SearchResult(hostname, origin, vsys, position, name, action, bool(disabled))
+                for hostname, origin, vsys, position, name, action, disabled
+                in self.connection.execute(query, parameters)]
+
+    def close(self):
+        self.connection.close()
+
+
+def update_index(fleet_index, indexed_firewalls):
+    """
+    Stores firewalls as they are indexed.
+    :param fleet_index: FleetIndex
+    :param indexed_firewalls: Iterable of (firewall, list of IndexedFirewall, exception) as yielded by
+    panfleet.iter_completed
+    :return: Tuple of (number of origins updated, number unchanged, dictionary of firewall to exception)
+    """
+    updated = unchanged = 0
+    failures = {}
+    for firewall, indexed, error in indexed_firewalls:
+        if error is not None:
+            failures[firewall] = error
+            continue
+        for origin in indexed:
+            if fleet_index.store(origin):
+                updated += 1
+            else:
+                unchanged += 1
+    return updated, unchanged, failures
+
+
+def write_results(results, output_format, file=sys.stdout):
+    """
+    :param results: List of SearchResult
+    :param output_format: 'text', 'csv' or 'json'
+    :param file: File to write to
+    :return:
+    """
+    if output_format == 'json':
+        json.dump([result._asdict() for result in results], file, indent=2)
+        file.write('\n')
+    elif output_format == 'csv':
+        writer = csv.writer(file)
+        writer.writerow(SearchResult._fields)
+        writer.writerows(results)
+    else:
+        for result in results:
+            hostname = result.hostname if result.vsys is None else '{}/{}'.format(result.hostname, result.vsys)
+            file.write('{:<30} {:<9} {:>5}  {}  ({}{})\n'.format(
+                hostname, result.origin, result.position + 1, result.name, result.action,
+                ', disabled' if result.disabled else ''))
+        file.write('{} rule(s) on {} firewall(s)\n'.format(len(results), len({result.hostname for result in results})))
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description='Index the rules of the fleet and search them.')
+    parser.add_argument('--index', default=DEFAULT_INDEX_FILE, help='Index database. Defaults to %(default)s')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    update = commands.add_parser('update', help='Index the firewalls in config.yml, skipping unchanged ones')
+    update.add_argument('--dataplane', action='store_true', help='Also index the rules of the first dataplane')
+    update.add_argument('--snapshot', metavar='PATH',
+                        help='Index the firewalls saved in a snapshot directory or archive instead of querying them')
+    update.add_argument('--prune', action='store_true', help='Remove firewalls which are no longer in the fleet')
+
+    query = commands.add_parser('query', help='Search the index')
+    query.add_argument('--address', action='append', default=[],
+                       help='IP, network, range or address name in the source or destination')
+    query.add_argument('--source', action='append', default=[], help='Same as --address, in the source only')
+    query.add_argument('--destination', action='append', default=[],
+                       help='Same as --address, in the destination only')
+    query.add_argument('--zone', action='append', default=[], help='Zone in from or to')
+    query.add_argument('--from-zone', action='append', default=[], help='Zone in from')
+    query.add_argument('--to-zone', action='append', default=[], help='Zone in to')
+    query.add_argument('--application', action='append', default=[], help='Application name')
+    query.add_argument('--service', action='append', default=[], help='Service name, or protocol/port on dataplanes')
+    query.add_argument('--user', action='append', default=[], help='Source user')
+    query.add_argument('--tag', action='append', default=[], help='Tag')
+    query.add_argument('--name', action='append', default=[], help='Rule name, %% matches any text')
+    query.add_argument('--firewall', action='append', default=[], help='Only search this firewall')
+    query.add_argument('--vsys', action='append', default=[], help='Only search the config rules of this vsys')
+    query.add_argument('--origin', action='append', choices=ORIGINS, default=[],
+                       help='Only search config or dataplane rules')
+    query.add_argument('--include-any', action='store_true', help='Let rules with "any" match the values searched')
+    query.add_argument('--format', choices=['text', 'csv', 'json'], default='text', help='Output format')
+
+    commands.add_parser('list', help='List the indexed firewalls')
+    return parser.parse_args(argv)
+
+
+def run_update(fleet_index, arguments):
+    offline = arguments.snapshot is not None
+    script_config = panexport.Config(None if offline and not os.path.exists('config.yml') else 'config.yml')
+    panapi.set_client(panapi.client_from_config(script_config.api_options))
+    known_hashes = fleet_index.hashes()
+    if offline:
+        with pansnapshot.open_snapshot(arguments.snapshot) as client:
+            panapi.set_client(client)
+            hostnames = client.hostnames()
+            with ProcessPoolExecutor(initializer=panapi.set_client, initargs=(client,)) as executor:
+                updated, unchanged, failures = update_index(fleet_index, panfleet.iter_completed(
+                    executor, index_firewall, hostnames, None, known_hashes, arguments.dataplane))
+    else:
+        hostnames = script_config.firewall_hostnames
+        with ThreadPoolExecutor(max_workers=max(1, script_config.max_workers)) as executor:
+            updated, unchanged, failures = update_index(fleet_index, panfleet.iter_completed(
+                executor, index_firewall, hostnames, script_config.firewall_api_key, known_hashes,
+                arguments.dataplane))
+    print('{} rulebase(s) indexed, {} unchanged.'.format(updated, unchanged))
+    if arguments.prune:
+        # A firewall which failed is kept, it may only be unreachable for now
+        for hostname in fleet_index.prune(list(hostnames)):
+            print('{} removed from the index.'.format(hostname))
+    panfleet.report_failures(failures)
+    panapi.print_metrics(panapi.get_client().metrics)
+
+
+def main(argv=None):
+    arguments = parse_arguments(argv)
+    fleet_index = FleetIndex(arguments.index)
+    try:
+        if arguments.command == 'update':
+            run_update(fleet_index, arguments)
+        elif arguments.command == 'list':
+            for hostname, origin, indexed_at, rule_count in fleet_index.firewalls():
+                print('{:<30} {:<9} {:>6} rule(s)  indexed {}'.format(
+                    hostname, origin, rule_count, time.strftime('%Y-%m-%d %H:%M', time.localtime(indexed_at))))
+        else:
+            results = fleet_index.search(arguments.address, arguments.source, arguments.destination, arguments.zone,
+                                         arguments.from_zone, arguments.to_zone, arguments.application,
+                                         arguments.service, arguments.user, arguments.tag, arguments.name,
+                                         arguments.firewall, arguments.origin, arguments.include_any, arguments.vsys)
+            write_results(results, arguments.format)
+    finally:
+        fleet_index.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+
+# noinspection PyPackageRequirements
+
+import argparse
+import bisect
+import csv
+
+import panapi
+import pancompare
+import panfleet
+
+FLOW_COLUMNS = ['from_zone', 'to_zone', 'source', 'destination', 'protocol', 'destination_port', 'source_port',
+                'application', 'user', 'category']
+
+# Rule parameters a flow only matches when it states a listed value, the dataplane writes 'any' for no restriction
+CONDITION_PARAMETERS = {'user': 'user', 'category': 'category'}
+
+
+def address_to_int(ip):
+    """
+    :param ip: IPv4 or IPv6 address as string
+    :return: Address as integer in the same IPv6 space pancompare.convert_to_intervals uses
+    """
+    return int(pancompare.map_to_address(ip))
+
+
+def _bits(positions):
+    """
+    :return: Integer with a bit set for every rule position
+    """
+    mask = 0
+    for position in positions:
+        mask |= 1 << position
+    return mask
+
+
+def _parameter_values(rule, parameter):
+    """
+    :return: The members of a dataplane rule parameter such as user, 'any' when the rule doesn't state it
+    """
+    values = pancompare.split_multiple_zones(rule.parameters.get(parameter, 'any'))
+    return (values,) if isinstance(values, str) else tuple(values)
+
+
+class SegmentIndex:
+    def __init__(self, items):
+        """
+        Splits a small space, such as ports, at every interval boundary and stores the bitmask of rules covering
+        each piece, so a point lookup is a single binary search. Only suited to spaces with few distinct
+        boundaries, every piece holds a full bitmask.
+        :param items: Iterable of (first, last, rule position) tuples
+        """
+        per_position = {}
+        for first, last, position in items:
+            per_position.setdefault(position, []).append((first, last))
+        # Intervals of a rule are merged first, so toggling its bit at every boundary is enough
+        toggles = {}
+        for position, intervals in per_position.items():
+            bit = 1 << position
+            for first, last in pancompare.merge_intervals(intervals):
+                toggles[first] = toggles.get(first, 0) ^ bit
+                toggles[last + 1] = toggles.get(last + 1, 0) ^ bit
+        self.boundaries = sorted(toggles)
+        self.masks = []
+        mask = 0
+        for boundary in self.boundaries:
+            mask ^= toggles[boundary]
+            self.masks.append(mask)
+
+    def mask_at(self, point):
+        """
+        :return: Bitmask of the rules with an interval containing point
+        """
+        position = bisect.bisect_right(self.boundaries, point) - 1
+        if position < 0:
+            return 0
+        return self.masks[position]
+
+
+class PolicyLookup:
+    def __init__(self, rules):
+        """
+        First match lookup engine over the rules of a dataplane.
+        Every field is indexed up front: zones and applications as bitmasks with one bit per rule position,
+        addresses as interval trees and destination ports per protocol as segment bitmasks. A lookup ANDs the masks
+        of all fields and only checks the remaining candidates in rule order.
+        Rules negating their source or destination match every address except the listed ones. Rules limited to
+        users or URL categories only match flows naming one of them.
+        :param rules: Iterable of pancompare.DataplaneRule in dataplane order
+        """
+        self.rules = list(rules)
+        self.all_rules = (1 << len(self.rules)) - 1
+        self.services = [pancompare.parse_application_service(rule.application_service) for rule in self.rules]
+
+        self.zones = {'from': {}, 'to': {}}
+        self.any_zone = {'from': 0, 'to': 0}
+        self.any_address = {'source': 0, 'destination': 0}
+        address_items = {'source': [], 'destination': []}
+        self.negated = {'source': [], 'destination': []}
+        self.conditions = {condition: {} for condition in CONDITION_PARAMETERS}
+        self.any_condition = {condition: 0 for condition in CONDITION_PARAMETERS}
+        self.applications = {}
+        self.any_application = 0
+        self.protocols = {}
+        self.any_protocol = 0
+        port_items = {}
+
+        for position, rule in enumerate(self.rules):
+            bit = 1 << position
+            for direction, zones in (('from', rule.from_zones), ('to', rule.to_zones)):
+                if 'any' in zones:
+                    self.any_zone[direction] |= bit
+                for zone in zones:
+                    self.zones[direction][zone] = self.zones[direction].get(zone, 0) | bit
+            for condition, parameter in CONDITION_PARAMETERS.items():
+                values = _parameter_values(rule, parameter)
+                if 'any' in values:
+                    self.any_condition[condition] |= bit
+                for value in values:
+                    self.conditions[condition][value] = self.conditions[condition].get(value, 0) | bit
+            for direction, addresses in (('source', rule.source), ('destination', rule.destination)):
+                intervals = pancompare.convert_to_intervals(addresses)
+                if rule.parameters.get(pancompare.NEGATE_PARAMETERS[direction]) == 'yes':
+                    self.negated[direction].append((position, intervals))
+                elif intervals == ((0, pancompare.IPV6_MAX),):
+                    self.any_address[direction] |= bit
+                else:
+                    address_items[direction].extend((first, last, position) for first, last in intervals)
+            for entry in self.services[position]:
+                if entry.application == 'any':
+                    self.any_application |= bit
+                else:
+                    self.applications[entry.application] = self.applications.get(entry.application, 0) | bit
+                if entry.protocol == 'any':
+                    self.any_protocol |= bit
+                else:
+                    self.protocols[entry.protocol] = self.protocols.get(entry.protocol, 0) | bit
+                    port_items.setdefault(entry.protocol, []).append(
+                        (entry.destination_ports[0], entry.destination_ports[1], position))
+
+        self.addresses = {direction: pancompare.IntervalTree(items) for direction, items in address_items.items()}
+        self.ports = {protocol: SegmentIndex(items) for protocol, items in port_items.items()}
+
+    def _zone_mask(self, direction, zone):
+        return self.any_zone[direction] | self.zones[direction].get(zone, 0)
+
+    def _address_mask(self, direction, ip):
+        value = address_to_int(ip)
+        mask = self.any_address[direction] | _bits(self.addresses[direction].query(value, value))
+        for position, excluded in self.negated[direction]:
+            if not pancompare.intervals_cover(excluded, ((value, value),)):
+                mask |= 1 << position
+        return mask
+
+    def _condition_mask(self, condition, value):
+        # A flow which doesn't name a user or category can't be said to match the rules limited to some
+        if value is None:
+            return self.any_condition[condition]
+        return self.any_condition[condition] | self.conditions[condition].get(value, 0)
+
+    def _service_mask(self, protocol, destination_port, application):
+        if protocol is None:
+            mask = self.all_rules
+        elif destination_port is None:
+            mask = self.any_protocol | self.protocols.get(protocol, 0)
+        else:
+            mask = self.any_protocol
+            if protocol in self.ports:
+                mask |= self.ports[protocol].mask_at(destination_port)
+        if application is not None:
+            mask &= self.any_application | self.applications.get(application, 0)
+        return mask
+
+    @staticmethod
+    def _entry_matches(entry, protocol, source_port, destination_port, application):
+        if application is not None and entry.application not in ('any', application):
+            return False
+        if protocol is not None and entry.protocol not in ('any', protocol):
+            return False
+        if source_port is not None and not entry.source_ports[0] <= source_port <= entry.source_ports[1]:
+            return False
+        if destination_port is not None and not (
+                entry.destination_ports[0] <= destination_port <= entry.destination_ports[1]):
+            return False
+        return True
+
+    def lookup(self, from_zone, to_zone, source, destination, protocol=None, destination_port=None,
+               source_port=None, application=None, user=None, category=None):
+        """
+        Finds the first rule a flow would match.
+        Fields given as None are not checked, a flow without application matches rules for any application.
+        Without user or category, rules limited to users or URL categories are passed over since whether they
+        match depends on who makes the request and where to.
+        :param from_zone: Source zone of the flow
+        :param to_zone: Destination zone of the flow
+        :param source: Source IP as string
+        :param destination: Destination IP as string
+        :param protocol: Protocol name or number, ex. 'tcp' or 6
+        :param destination_port: Destination port as integer
+        :param source_port: Source port as integer
+        :param application: Application name, ex. 'ssl'
+        :param user: User as the dataplane lists it, ex. 'corp\\alice'
+        :param category: URL category, ex. 'social-networking'
+        :return: The first matching pancompare.DataplaneRule or None if no rule matches
+        """
+        if protocol is not None:
+            protocol = pancompare.normalize_protocol(protocol)
+        candidates = (self._zone_mask('from', from_zone) & self._zone_mask('to', to_zone) &
+                      self._service_mask(protocol, destination_port, application) &
+                      self._condition_mask('user', user) & self._condition_mask('category', category))
+        if candidates:
+            candidates &= self._address_mask('source', source)
+        if candidates:
+            candidates &= self._address_mask('destination', destination)
+
+        # The indexes narrow down rules per field, a rule still needs one entry matching all service fields at once
+        while candidates:
+            lowest = candidates & -candidates
+            position = lowest.bit_length() - 1
+            for entry in self.services[position]:
+                if self._entry_matches(entry, protocol, source_port, destination_port, application):
+                    return self.rules[position]
+            candidates ^= lowest
+        return None
+
+
+def read_flows(filename):
+    """
+    Reads a CSV of flows with a header row naming the FLOW_COLUMNS used.
+    from_zone, to_zone, source and destination are required, the other columns may be left out or empty.
+    :param filename: Path of the CSV file
+    :return: List of dictionaries with the lookup arguments of each flow
+    """
+    flows = []
+    with open(filename, 'r', newline='') as file:
+        for row in csv.DictReader(file):
+            flow = {column: (row.get(column) or '').strip() or None for column in FLOW_COLUMNS}
+            for column in ('destination_port', 'source_port'):
+                if flow[column] is not None:
+                    flow[column] = int(flow[column])
+            flows.append(flow)
+    return flows
+
+
+def lookup_flows(policy, flows):
+    """
+    :param policy: PolicyLookup of a dataplane
+    :param flows: List of flows as returned by read_flows
+    :return: List of the first matching rule (or None) of each flow
+    """
+    return [policy.lookup(**flow) for flow in flows]
+
+
+def lookup_firewall(firewall, api_key, flows):
+    """
+    Retrieves the dataplane of a single firewall and looks up every flow.
+    :param firewall: Firewall to query
+    :param api_key: API key to query
+    :param flows: List of flows as returned by read_flows
+    :return: List of the first matching rule (or None) of each flow
+    """
+    dataplane = pancompare.retrieve_dataplane(firewall, api_key)
+    return lookup_flows(PolicyLookup(pancompare.iter_dataplane_rules(dataplane)), flows)
+
+
+def write_lookup_results(results, flows, filename):
+    """
+    Writes one row per firewall and flow with the matching rule and its action.
+    :param results: Dictionary of firewall to the result of lookup_firewall
+    :param flows: List of flows as returned by read_flows
+    :param filename: Output CSV file
+    :return:
+    """
+    with open(filename, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['firewall'] + FLOW_COLUMNS + ['rule', 'action'])
+        for firewall, matches in results.items():
+            for flow, rule in zip(flows, matches):
+                row = [firewall] + ['' if flow[column] is None else flow[column] for column in FLOW_COLUMNS]
+                if rule is None:
+                    row += ['', 'no match']
+                else:
+                    row += [rule.name, rule.action]
+                writer.writerow(row)
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description='Find the first dataplane rule each flow matches on every '
+                                                 'firewall in config.yml.')
+    parser.add_argument('flows', help='CSV file of flows, columns: {}'.format(', '.join(FLOW_COLUMNS)))
+    parser.add_argument('--output', default='panlookup-results.csv',
+                        help='CSV file the results are written to. Defaults to %(default)s')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    arguments = parse_arguments(argv)
+    script_config = pancompare.Config('config.yml')
+    panapi.set_client(panapi.client_from_config(script_config.api_options))
+    flows = read_flows(arguments.flows)
+    results, failures = panfleet.run_across_firewalls(lookup_firewall,
+                                                      script_config.firewall_hostnames,
+                                                      script_config.max_workers,
+                                                      script_config.firewall_api_key,
+                                                      flows)
+    write_lookup_results(results, flows, arguments.output)
+    print('{} flow(s) looked up on {} firewall(s), results written to {}'.format(
+        len(flows), len(results), arguments.output))
+    panfleet.report_failures(failures)
+    panapi.print_metrics(panapi.get_client().metrics)
+
+
+if __name__ == '__main__':
+    main()
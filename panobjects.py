@@ -0,0 +1,130 @@
+"""
+Resolution of address and address-group objects referenced by rules into the networks they stand for.
+"""
+import netaddr
+
+ADDRESS_TYPES = ['ip-netmask', 'ip-range', 'ip-wildcard', 'fqdn']
+
+
+class AddressGroupCycleError(ValueError):
+    pass
+
+
+def members(value):
+    """
+    Takes a rule or group field as parsed from the config and returns its members as a list.
+    :param value: {'member': [...]}, {'member': 'x'}, a string, a list, a tuple as held by panrules.Rule or None
+    :return: List or tuple of member names
+    """
+    if isinstance(value, dict):
+        value = value.get('member', [])
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple)):
+        return value
+    return [value]
+
+
+def _text(value):
+    """
+    Returns the text of a parsed element, which is a dict when the element has attributes.
+    """
+    if isinstance(value, dict):
+        return value.get('#text', '')
+    return value
+
+
+class AddressResolver:
+    def __init__(self, addresses, address_groups):
+        """
+        Indexes the address objects of a config once so groups can be expanded for every rule.
+        Expanded groups are memoized, each group is only walked once however many rules reference it.
+        When several objects share a name, the last one given wins.
+        :param addresses: List of address entries, as returned by safeget
+        :param address_groups: List of address-group entries, as returned by safeget
+        """
+        self.addresses = {}
+        for entry in addresses:
+            for address_type in ADDRESS_TYPES:
+                if address_type in entry:
+                    self.addresses[entry['@name']] = (address_type, _text(entry[address_type]))
+                    break
+        self.groups = {entry['@name']: entry for entry in address_groups}
+        self._expanded = {}
+        self._expanding = []
+
+    def _address_values(self, name):
+        address_type, value = self.addresses[name]
+        if address_type == 'ip-range':
+            first, _, last = value.partition('-')
+            try:
+                return tuple(str(cidr) for cidr in netaddr.iprange_to_cidrs(first, last))
+            except (netaddr.AddrFormatError, ValueError):
+                return (value,)
+        return (value,)
+
+    def _expand_group(self, name):
+        if name in self._expanding:
+            cycle = self._expanding[self._expanding.index(name):] + [name]
+            raise AddressGroupCycleError('address group cycle: {}'.format(' -> '.join(cycle)))
+
+        group = self.groups[name]
+        if 'dynamic' in group:
+            # Dynamic groups are only known to the firewall, keep the match criteria
+            dynamic = group['dynamic'] or {}
+            expanded = ('dynamic: {}'.format(_text(dynamic.get('filter', ''))),)
+        else:
+            self._expanding.append(name)
+            try:
+                expanded = self.resolve_members(members(group.get('static')))
+            finally:
+                self._expanding.pop()
+        self._expanded[name] = expanded
+        return expanded
+
+    def resolve(self, name):
+        """
+        Resolves a single name from a rule's source or destination.
+        :param name: Address object, address group, 'any' or a literal IP/network/range
+        :return: Tuple of the networks, ranges or FQDNs it stands for. Names which aren't objects, such as literal
+        IPs or 'any', are returned as they are.
+        """
+        if name in self._expanded:
+            return self._expanded[name]
+        if name in self.groups:
+            return self._expand_group(name)
+        if name in self.addresses:
+            return self._address_values(name)
+        return (name,)
+
+    def resolve_members(self, names):
+        """
+        Resolves every name of a rule field and removes duplicates, keeping the first occurrence.
+        :param names: List of names
+        :return: Tuple of the networks, ranges or FQDNs they stand for
+        """
+        resolved = []
+        seen = set()
+        for name in names:
+            for value in self.resolve(name):
+                if value not in seen:
+                    seen.add(value)
+                    resolved.append(value)
+        return tuple(resolved)
+
+
+def add_resolved_addresses(rule_list, resolver):
+    """
+    Returns copies of the rules with source-resolved and destination-resolved fields listing the networks
+    their source and destination stand for.
+    :param rule_list: panrules.Rule or rules as dictionaries
+    :param resolver: AddressResolver for the config the rules come from
+    :return: List of rules of the same type
+    """
+    resolved_rules = []
+    for rule in rule_list:
+        resolved_rule = rule.copy()
+        for field in ('source', 'destination'):
+            resolved_rule[field + '-resolved'] = list(resolver.resolve_members(members(rule.get(field))))
+        resolved_rules.append(resolved_rule)
+    return resolved_rules
@@ -0,0 +1,248 @@
+"""
+Per-stage instrumentation of the scripts: wall time, peak memory, bytes and rule counts per firewall and stage.
+
+Stages are recorded through stage(), which does nothing until a Profiler is installed with set_profiler,
+so the instrumentation costs nothing on normal runs.
+"""
+import cProfile
+import json
+import pstats
+import threading
+import time
+import tracemalloc
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+class Profiler:
+    def __init__(self, memory=True, cprofile=False):
+        """
+        Records every stage run while it is installed with set_profiler.
+        :param memory: Trace allocations to record the peak memory of each stage. Tracing slows Python down.
+        The tracemalloc peak is process wide, so a stage only gets a peak of its own when no other stage ran
+        alongside it. Stages overlapping others, ex. the configs fetched at the same time, get the peak of the
+        process while they ran, marked shared.
+        :param cprofile: Also collect cProfile statistics of the tasks run through wrap
+        """
+        self.memory = memory
+        self.cprofile = cprofile
+        self.lock = threading.Lock()
+        self.records = []
+        self.profiles = []
+        # Running stages, by id of their record, to whether another stage ran alongside them
+        self.active = {}
+        self.peak_memory = 0
+        self.started = time.time()
+        self.started_tracing = memory and not tracemalloc.is_tracing()
+        if self.started_tracing:
+            tracemalloc.start()
+
+    @contextmanager
+    def stage(self, firewall, name):
+        """
+        Times a stage. The yielded dictionary is added to the record, set 'bytes' or 'rules' on it to report them.
+        :param firewall: Firewall the stage runs for
+        :param name: Stage name, ex. 'fetch running'
+        """
+        record = OrderedDict([('firewall', firewall), ('stage', name)])
+        if self.memory:
+            with self.lock:
+                if self.active:
+                    for key in self.active:
+                        self.active[key] = True
+                else:
+                    # reset_peak is only available from Python 3.9, before that the peak is the one since tracing
+                    # started
+                    self.peak_memory = max(self.peak_memory, tracemalloc.get_traced_memory()[1])
+                    if hasattr(tracemalloc, 'reset_peak'):
+                        tracemalloc.reset_peak()
+                self.active[id(record)] = bool(self.active)
+                memory_before = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        try:
+            yield record
+        except BaseException:
+            record['failed'] = True
+            raise
+        finally:
+            record['seconds'] = time.perf_counter() - start
+            with self.lock:
+                if self.memory:
+                    peak = tracemalloc.get_traced_memory()[1]
+                    self.peak_memory = max(self.peak_memory, peak)
+                    record['peak_memory_bytes'] = max(0, peak - memory_before)
+                    if self.active.pop(id(record)):
+                        record['shared'] = True
+                self.records.append(record)
+
+    def wrap(self, task):
+        """
+        Wraps a task run in a worker thread so it is profiled with cProfile, which only sees the thread it runs in.
+        :param task: Function, ex. panexport.do_the_things
+        :return: Function taking the same arguments
+        """
+        if not self.cprofile:
+            return task
+
+        def profiled_task(*args, **kwargs):
+            profile = cProfile.Profile()
+            try:
+                return profile.runcall(task, *args, **kwargs)
+            finally:
+                with self.lock:
+                    self.profiles.append(profile)
+        return profiled_task
+
+    def report(self):
+        """
+        :return: Dictionary with the records grouped per firewall and totals per stage, and the peak memory of the
+        whole run when memory is traced. A total is marked shared when any of its peaks is.
+        """
+        with self.lock:
+            records = list(self.records)
+            peak_memory = self.peak_memory
+            if self.memory and tracemalloc.is_tracing():
+                peak_memory = max(peak_memory, tracemalloc.get_traced_memory()[1])
+        firewalls = OrderedDict()
+        totals = OrderedDict()
+        for record in records:
+            firewalls.setdefault(record['firewall'], []).append(record)
+            total = totals.setdefault(record['stage'], OrderedDict([('calls', 0), ('seconds', 0.0)]))
+            total['calls'] += 1
+            total['seconds'] += record['seconds']
+            for key in ('bytes', 'rules'):
+                if key in record:
+                    total[key] = total.get(key, 0) + record[key]
+            if 'peak_memory_bytes' in record:
+                total['peak_memory_bytes'] = max(total.get('peak_memory_bytes', 0), record['peak_memory_bytes'])
+                if record.get('shared'):
+                    total['shared'] = True
+        report = OrderedDict([('started', self.started),
+                              ('seconds', time.time() - self.started)])
+        if self.memory:
+            report['peak_memory_bytes'] = peak_memory
+        report['stages'] = totals
+        report['firewalls'] = firewalls
+        return report
+
+    def write_report(self, filename):
+        """
+        Writes the report as JSON.
+        :param filename: Output file
+        :return:
+        """
+        with open(filename, mode='w', encoding='utf-8') as file:
+            json.dump(self.report(), file, indent=2)
+
+    def dump_stats(self, filename):
+        """
+        Writes the combined cProfile statistics of every wrapped task, readable with pstats or snakeviz.
+        :param filename: Output file
+        :return:
+        """
+        with self.lock:
+            profiles = list(self.profiles)
+        if profiles:
+            pstats.Stats(*profiles).dump_stats(filename)
+
+    def close(self):
+        if self.started_tracing:
+            self.peak_memory = max(self.peak_memory, tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+            self.started_tracing = False
+
+
+class NullProfiler:
+    """
+    Installed by default, records nothing.
+    """
+    @contextmanager
+    def stage(self, firewall, name):
+        yield {}
+
+    def wrap(self, task):
+        return task
+
+
+_profiler = NullProfiler()
+
+
+def get_profiler():
+    return _profiler
+
+
+def set_profiler(profiler):
+    """
+    Installs the profiler stage() records to, None installs a NullProfiler.
+    :param profiler: Profiler or None
+    :return:
+    """
+    global _profiler
+    _profiler = NullProfiler() if profiler is None else profiler
+
+
+def stage(firewall, name):
+    """
+    Times a stage with the installed profiler, see Profiler.stage.
+    :param firewall: Firewall the stage runs for
+    :param name: Stage name
+    :return: Context manager yielding the record dictionary
+    """
+    return _profiler.stage(firewall, name)
+
+
+def add_arguments(parser):
+    """
+    Adds the --profile and --profile-stats options to a script's argument parser.
+    :param parser: argparse.ArgumentParser
+    :return:
+    """
+    parser.add_argument('--profile', metavar='FILE',
+                        help='Write the time, peak memory, bytes and rules of every stage per firewall to this '
+                             'JSON file')
+    parser.add_argument('--profile-stats', metavar='FILE',
+                        help='Write cProfile statistics of the whole run to this file, readable with pstats')
+
+
+def start(arguments):
+    """
+    Installs a Profiler when --profile or --profile-stats is given.
+    Memory is only traced for --profile, tracing would distort the cProfile statistics.
+    :param arguments: Parsed arguments of a parser set up with add_arguments
+    :return: The Profiler or None
+    """
+    if not (arguments.profile or arguments.profile_stats):
+        return None
+    profiler = Profiler(memory=bool(arguments.profile), cprofile=bool(arguments.profile_stats))
+    set_profiler(profiler)
+    return profiler
+
+
+def finish(profiler, arguments):
+    """
+    Writes the files asked for with --profile and --profile-stats and uninstalls the profiler.
+    :param profiler: Profiler returned by start or None
+    :param arguments: Parsed arguments of a parser set up with add_arguments
+    :return:
+    """
+    if profiler is None:
+        return
+    set_profiler(None)
+    profiler.close()
+    if arguments.profile:
+        profiler.write_report(arguments.profile)
+        print_summary(profiler.report())
+    if arguments.profile_stats:
+        profiler.dump_stats(arguments.profile_stats)
+
+
+def print_summary(report):  # pragma: no cover
+    print('Stage timings over {:.2f}s{}:'.format(
+        report['seconds'], ', peak {:.1f} MB'.format(report['peak_memory_bytes'] / 1024 / 1024)
+        if 'peak_memory_bytes' in report else ''))
+    for name, total in report['stages'].items():
+        print('  {:<28} {:>5} call(s) {:>9.3f}s{}'.format(
+            name, total['calls'], total['seconds'],
+            '  peak {:.1f} MB{}'.format(total['peak_memory_bytes'] / 1024 / 1024,
+                                       ' (shared)' if total.get('shared') else '')
+            if 'peak_memory_bytes' in total else ''))
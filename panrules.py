@@ -0,0 +1,201 @@
+"""
+Compact record of a security rule, built once from the parsed config and shared by the writers and the analyses.
+
+xmltodict and parse_config give every rule as a dictionary of dictionaries, with member lists wrapped in
+{'member': [...]}. A Rule keeps the common fields in slots instead, member lists as tuples of interned strings, so
+the zone, application and service names repeated across thousands of rules are stored once. It reads like the
+dictionary it was built from: get, [], in and iteration over the field names all work the same.
+"""
+import sys
+
+# Fields holding a list of members, stored as tuples
+MEMBER_SLOTS = {
+    'from': 'from_zones',
+    'to': 'to_zones',
+    'source': 'source',
+    'destination': 'destination',
+    'source-user': 'source_user',
+    'category': 'category',
+    'application': 'application',
+    'service': 'service',
+    'hip-profiles': 'hip_profiles',
+    'tag': 'tag',
+}
+
+# Fields holding a single text, stored as strings. The short ones repeat across rules and are interned.
+TEXT_SLOTS = {
+    '@name': 'name',
+    '@uuid': 'uuid',
+    'action': 'action',
+    'rule-type': 'rule_type',
+    'negate-source': 'negate_source',
+    'negate-destination': 'negate_destination',
+    'disabled': 'disabled',
+    'log-start': 'log_start',
+    'log-end': 'log_end',
+    'log-setting': 'log_setting',
+    'description': 'description',
+}
+INTERNED_FIELDS = {'action', 'rule-type', 'negate-source', 'negate-destination', 'disabled', 'log-start', 'log-end',
+                   'log-setting'}
+
+FIELD_SLOTS = dict(MEMBER_SLOTS, **TEXT_SLOTS)
+
+
+def _member_tuple(value):
+    """
+    :return: Tuple of interned members, None when the value isn't a plain member list
+    """
+    if isinstance(value, dict) and len(value) == 1 and 'member' in value:
+        value = value['member']
+        if isinstance(value, str):
+            return (sys.intern(value),)
+    if isinstance(value, (list, tuple)):
+        try:
+            return tuple(map(sys.intern, value))
+        except TypeError:
+            # Members with attributes are parsed as dictionaries
+            return None
+    return None
+
+
+def format_value(value):
+    """
+    Turns a field as parsed from the config into the text of an export cell.
+    :param value: {'member': [...]}, a list, a string or any other parsed value
+    :return: String, members are joined with ', '
+    """
+    if isinstance(value, dict):
+        value = value.get('member', value)
+    if isinstance(value, (list, tuple)):
+        return ', '.join(value)
+    return str(value)
+
+
+class Rule:
+    __slots__ = tuple(FIELD_SLOTS.values()) + ('extra',)
+
+    def __init__(self, fields=None):
+        """
+        :param fields: Dictionary of field to value as parsed from the config, ex. a rulebase entry
+        """
+        # Slots stay unset until the field is set. Fields without a slot, or whose value doesn't fit it, are kept
+        # as parsed.
+        self.extra = None
+        if fields is not None:
+            for field, value in fields.items():
+                self[field] = value
+
+    def __setitem__(self, field, value):
+        slot = FIELD_SLOTS.get(field)
+        if slot is not None:
+            if field in MEMBER_SLOTS:
+                stored = _member_tuple(value)
+            elif isinstance(value, str):
+                stored = sys.intern(value) if field in INTERNED_FIELDS else value
+            else:
+                stored = None
+            setattr(self, slot, stored)
+            if stored is not None:
+                if self.extra is not None:
+                    self.extra.pop(field, None)
+                return
+        if self.extra is None:
+            self.extra = {}
+        self.extra[field] = value
+
+    def get(self, field, default=None):
+        """
+        :param field: Field name as in the config, ex. '@name' or 'source'
+        :return: The value, a tuple for member lists. default when the rule doesn't have the field.
+        """
+        slot = FIELD_SLOTS.get(field)
+        if slot is not None:
+            value = getattr(self, slot, None)
+            if value is not None:
+                return value
+        if self.extra is not None:
+            return self.extra.get(field, default)
+        return default
+
+    def __getitem__(self, field):
+        value = self.get(field, KeyError)
+        if value is KeyError:
+            raise KeyError(field)
+        return value
+
+    def __contains__(self, field):
+        return self.get(field, KeyError) is not KeyError
+
+    def __iter__(self):
+        for field, slot in FIELD_SLOTS.items():
+            if getattr(self, slot, None) is not None:
+                yield field
+        if self.extra is not None:
+            yield from self.extra
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def keys(self):
+        return list(self)
+
+    def items(self):
+        return [(field, self[field]) for field in self]
+
+    def copy(self):
+        """
+        :return: A Rule with the same fields, adding fields to it leaves this one unchanged
+        """
+        rule = Rule.__new__(Rule)
+        for slot in FIELD_SLOTS.values():
+            value = getattr(self, slot, None)
+            if value is not None:
+                setattr(rule, slot, value)
+        rule.extra = None if self.extra is None else dict(self.extra)
+        return rule
+
+    def cells(self, headers):
+        """
+        Formats the fields of the rule as export cells, member lists joined with ', '.
+        :param headers: List of field names
+        :return: List of strings, '' for the fields the rule doesn't have
+        """
+        extra = self.extra or {}
+        cells = []
+        for header in headers:
+            slot = FIELD_SLOTS.get(header)
+            value = getattr(self, slot, None) if slot is not None else None
+            if value is None:
+                cells.append(format_value(extra[header]) if header in extra else '')
+            elif header in MEMBER_SLOTS:
+                cells.append(', '.join(value))
+            else:
+                cells.append(value)
+        return cells
+
+    def __eq__(self, other):
+        if not isinstance(other, Rule):
+            return NotImplemented
+        return dict(self.items()) == dict(other.items())
+
+    __hash__ = None
+
+    def __repr__(self):
+        return 'Rule({!r})'.format(dict(self.items()))
+
+
+def as_rule(rule):
+    """
+    :param rule: Rule or dictionary as parsed from the config
+    :return: Rule
+    """
+    return rule if isinstance(rule, Rule) else Rule(rule)
+
+
+def build_rules(entries):
+    """
+    :param entries: Rulebase entries as returned by panexport.safeget
+    :return: List of Rule
+    """
+    return [as_rule(entry) for entry in entries]
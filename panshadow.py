@@ -0,0 +1,268 @@
+"""
+Detection of rules which can never match because an earlier rule of the combined rulebase covers all their traffic.
+
+A later rule is covered when an earlier rule matches at least every zone, address, user, application, service,
+URL category and HIP profile it does. Covered rules are shadowed when the covering rule has another action,
+and redundant when it has the same one.
+Disabled rules and rules negating their source or destination are left out of the analysis. Rules limited to a
+schedule or to source or destination HIP objects only match part of the time, they never cover later rules.
+"""
+import bisect
+from typing import NamedTuple
+
+import netaddr
+
+import pancompare
+import panobjects
+
+SHADOWED = 'shadowed'
+REDUNDANT = 'redundant'
+
+# Fields compared as sets of names, a missing field or 'any' matches everything
+TOKEN_FIELDS = ['from', 'to', 'source-user', 'application', 'service', 'category', 'hip-profiles']
+ADDRESS_FIELDS = ['source', 'destination']
+# Fields narrowing when a rule matches, which aren't compared
+CONDITION_FIELDS = ['source-hip', 'destination-hip']
+
+# The default rules don't state their rule type in the config
+DEFAULT_RULE_TYPES = {'intrazone-default': 'intrazone', 'interzone-default': 'interzone'}
+
+
+class ShadowFinding(NamedTuple):
+    """
+    A rule covered by an earlier rule, both given as positions in the rulebase.
+    """
+    position: int
+    kind: str
+    covered_by: int
+
+
+class AddressSet(NamedTuple):
+    """
+    Resolved addresses of a rule field. intervals are merged (first, last) integers in the IPv6 space used by
+    pancompare, tokens are the values which aren't addresses (FQDNs, dynamic groups, unknown objects).
+    """
+    intervals: tuple
+    tokens: frozenset
+
+
+def _value_to_interval(value):
+    """
+    :return: (first, last) integers of an IP, network or range, None for anything else
+    """
+    address, _, mask = value.partition('/')
+    # Wildcard masks such as 10.0.0.1/0.0.255.0 don't describe a single interval
+    if '.' in mask:
+        return None
+    try:
+        if '-' in value:
+            first, last = value.split('-')
+            return int(pancompare.map_to_address(first)), int(pancompare.map_to_address(last))
+        network = pancompare.map_to_address(value)
+    except (netaddr.AddrFormatError, ValueError):
+        return None
+    if isinstance(network, netaddr.IPNetwork):
+        return network.first, network.last
+    return int(network), int(network)
+
+
+def address_set(values):
+    """
+    :param values: Resolved values of a rule field, as returned by AddressResolver.resolve_members
+    :return: AddressSet or None if the field matches any address, as it does when it is empty
+    """
+    if not values:
+        return None
+    intervals = []
+    tokens = set()
+    for value in values:
+        if value == 'any':
+            return None
+        interval = _value_to_interval(value)
+        if interval is None:
+            tokens.add(value)
+        else:
+            intervals.append(interval)
+    return AddressSet(pancompare.merge_intervals(intervals), frozenset(tokens))
+
+
+def _contains_intervals(outer, inner):
+    """
+    :param outer: Merged (first, last) tuples
+    :param inner: Merged (first, last) tuples
+    :return: True if every interval of inner lies within an interval of outer
+    """
+    firsts = [first for first, _ in outer]
+    for first, last in inner:
+        position = bisect.bisect_right(firsts, first) - 1
+        if position < 0 or outer[position][1] < last:
+            return False
+    return True
+
+
+def _address_covers(outer, inner):
+    if outer is None:
+        return True
+    if inner is None:
+        return False
+    return inner.tokens <= outer.tokens and _contains_intervals(outer.intervals, inner.intervals)
+
+
+def _field_tokens(rule, field):
+    """
+    :return: frozenset of the members of a field or None if it matches anything
+    """
+    values = panobjects.members(rule.get(field))
+    if not values or 'any' in values:
+        return None
+    return frozenset(values)
+
+
+def _rule_type(rule):
+    return rule.get('rule-type') or DEFAULT_RULE_TYPES.get(rule.get('@name'), 'universal')
+
+
+def _analyzable(rule):
+    if rule.get('disabled') == 'yes':
+        return False
+    return rule.get('negate-source') != 'yes' and rule.get('negate-destination') != 'yes'
+
+
+def _can_cover(rule):
+    """
+    :return: False for rules matching only at times or only some hosts, ex. with a schedule or HIP match
+    """
+    if rule.get('schedule'):
+        return False
+    return all(_field_tokens(rule, field) is None for field in CONDITION_FIELDS)
+
+
+class _CoverageIndex:
+    def __init__(self, tokens, addresses):
+        """
+        Bitmasks with a bit per rule position, used to narrow down the earlier rules which could cover a rule.
+        :param tokens: Per rule, dictionary of TOKEN_FIELDS to _field_tokens
+        :param addresses: Per rule, dictionary of ADDRESS_FIELDS to address_set, None for rules not analyzed
+        """
+        self.any_tokens = {field: 0 for field in TOKEN_FIELDS}
+        self.token_masks = {field: {} for field in TOKEN_FIELDS}
+        self.any_address = {field: 0 for field in ADDRESS_FIELDS}
+        self.address_token_masks = {field: {} for field in ADDRESS_FIELDS}
+        address_items = {field: [] for field in ADDRESS_FIELDS}
+
+        for position, (rule_tokens, rule_addresses) in enumerate(zip(tokens, addresses)):
+            if rule_addresses is None:
+                continue
+            bit = 1 << position
+            for field in TOKEN_FIELDS:
+                if rule_tokens[field] is None:
+                    self.any_tokens[field] |= bit
+                else:
+                    for token in rule_tokens[field]:
+                        self.token_masks[field][token] = self.token_masks[field].get(token, 0) | bit
+            for field in ADDRESS_FIELDS:
+                value = rule_addresses[field]
+                if value is None:
+                    self.any_address[field] |= bit
+                    continue
+                for token in value.tokens:
+                    masks = self.address_token_masks[field]
+                    masks[token] = masks.get(token, 0) | bit
+                address_items[field].extend((first, last, position) for first, last in value.intervals)
+
+        self.addresses = {field: pancompare.IntervalTree(items) for field, items in address_items.items()}
+
+    def candidates(self, rule_tokens, rule_addresses, mask):
+        """
+        :param mask: Bitmask of the rules which may cover, ex. every earlier rule
+        :return: Bitmask of the rules of mask which match at least every token and the first address of each
+        interval of the given rule
+        """
+        for field in TOKEN_FIELDS:
+            if not mask:
+                return 0
+            tokens = rule_tokens[field]
+            if tokens is None:
+                mask &= self.any_tokens[field]
+                continue
+            for token in tokens:
+                mask &= self.any_tokens[field] | self.token_masks[field].get(token, 0)
+        for field in ADDRESS_FIELDS:
+            if not mask:
+                return 0
+            value = rule_addresses[field]
+            if value is None:
+                mask &= self.any_address[field]
+                continue
+            for token in value.tokens:
+                mask &= self.any_address[field] | self.address_token_masks[field].get(token, 0)
+            for first, _ in value.intervals:
+                covering = self.any_address[field]
+                for position in self.addresses[field].query(first, first):
+                    covering |= 1 << position
+                mask &= covering
+        return mask
+
+
+def find_shadowed_rules(rule_list, resolver):
+    """
+    Finds every rule covered by an earlier rule of the rulebase.
+    Each field is indexed as bitmasks over the rule positions, so a rule is only compared in full with the earlier
+    rules already matching all its zones, users, applications, services and the start of its address ranges.
+    :param rule_list: Rules as dictionaries in rulebase order, ex. from combine_the_rulebase
+    :param resolver: panobjects.AddressResolver for the config the rules come from
+    :return: List of ShadowFinding, in rulebase order. A rule is reported against the first rule covering it.
+    """
+    tokens = []
+    addresses = []
+    for rule in rule_list:
+        tokens.append({field: _field_tokens(rule, field) for field in TOKEN_FIELDS})
+        if _analyzable(rule):
+            addresses.append({field: address_set(resolver.resolve_members(panobjects.members(rule.get(field))))
+                              for field in ADDRESS_FIELDS})
+        else:
+            addresses.append(None)
+    index = _CoverageIndex(tokens, addresses)
+    covering = 0
+    for position, rule in enumerate(rule_list):
+        if addresses[position] is not None and _can_cover(rule):
+            covering |= 1 << position
+
+    findings = []
+    for position, rule in enumerate(rule_list):
+        if addresses[position] is None:
+            continue
+        candidates = index.candidates(tokens[position], addresses[position], covering & ((1 << position) - 1))
+        rule_type = _rule_type(rule)
+        while candidates:
+            lowest = candidates & -candidates
+            earlier = lowest.bit_length() - 1
+            candidates ^= lowest
+            if _rule_type(rule_list[earlier]) not in ('universal', rule_type):
+                continue
+            if all(_address_covers(addresses[earlier][field], addresses[position][field])
+                   for field in ADDRESS_FIELDS):
+                same_action = rule_list[earlier].get('action') == rule.get('action')
+                findings.append(ShadowFinding(position, REDUNDANT if same_action else SHADOWED, earlier))
+                break
+    return findings
+
+
+def add_shadow_column(rule_list, resolver, header='shadowed-by'):
+    """
+    Returns copies of the rules with a column naming the earlier rule covering them and whether they are shadowed
+    or redundant, ex. 'Deny All (shadowed)'. The column is empty for rules which can match.
+    :param rule_list: Rules as dictionaries in rulebase order
+    :param resolver: panobjects.AddressResolver for the config the rules come from
+    :param header: Name of the column
+    :return: List of rules as dictionaries
+    """
+    findings = {finding.position: finding for finding in find_shadowed_rules(rule_list, resolver)}
+    analyzed_rules = []
+    for position, rule in enumerate(rule_list):
+        analyzed_rule = rule.copy()
+        finding = findings.get(position)
+        if finding is not None:
+            analyzed_rule[header] = '{} ({})'.format(rule_list[finding.covered_by].get('@name', ''), finding.kind)
+        analyzed_rules.append(analyzed_rule)
+    return analyzed_rules
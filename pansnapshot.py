@@ -0,0 +1,178 @@
+"""
+Offline runs of the scripts against a saved fleet snapshot instead of the firewalls.
+
+A snapshot is a directory, or a tar or zip archive of one, with a directory per firewall holding the output of the
+commands the scripts would otherwise run over the API:
+    <snapshot>/<hostname>/running.xml                 show config running
+    <snapshot>/<hostname>/pushed-shared-policy.xml    show config pushed-shared-policy
+    <snapshot>/<hostname>/dataplane.txt               show running security-policy
+    <snapshot>/<hostname>/hit-count.xml               show rule-hit-count of the vsys1 security rules
+The files hold the content of the <result> element of the API response. The firewall directories may sit below a
+single top level directory, as they do in most archives, and the panexport cache directory is a valid snapshot.
+"""
+import os
+import shutil
+import tarfile
+import tempfile
+import zipfile
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import panapi
+import panfleet
+import panhits
+
+SNAPSHOT_FILES = OrderedDict([
+    ('show config running', 'running.xml'),
+    ('show config pushed-shared-policy', 'pushed-shared-policy.xml'),
+    ('show running security-policy', 'dataplane.txt'),
+    (' '.join(panhits.HIT_COUNT_COMMAND.format(panhits.DEFAULT_VSYS).split()), 'hit-count.xml'),
+])
+
+# Firewalls which aren't managed by Panorama have no pushed policy
+MISSING_FILE_DEFAULTS = {'pushed-shared-policy.xml': '<policy/>'}
+
+
+class SnapshotError(ValueError):
+    """
+    Raised when a snapshot can't be read.
+    """
+
+
+class SnapshotClient:
+    def __init__(self, firewalls):
+        """
+        Answers the operational commands of the scripts from the files of a snapshot. Installed with
+        panapi.set_client it takes the place of panapi.PanApiClient, so the scripts run unchanged.
+        :param firewalls: Dictionary of hostname to the directory holding its files, see find_firewalls
+        """
+        self.firewalls = firewalls
+
+    @property
+    def metrics(self):
+        # Nothing goes over the network
+        return panapi.ApiMetrics()
+
+    def hostnames(self):
+        return list(self.firewalls)
+
+    def op(self, hostname, api_key, cmd):
+        """
+        :param hostname: Firewall directory name in the snapshot
+        :param api_key: Ignored
+        :param cmd: One of SNAPSHOT_FILES
+        :return: Content of the file saved for the command
+        """
+        filename = SNAPSHOT_FILES.get(' '.join(cmd.split()))
+        if filename is None:
+            raise panapi.PanApiError('{}: "{}" is not saved in snapshots'.format(hostname, cmd))
+        if hostname not in self.firewalls:
+            raise panapi.PanApiError('{}: not in the snapshot'.format(hostname))
+        path = os.path.join(self.firewalls[hostname], filename)
+        if not os.path.exists(path) and filename in MISSING_FILE_DEFAULTS:
+            return MISSING_FILE_DEFAULTS[filename]
+        try:
+            with open(path, mode='r', encoding='utf-8') as file:
+                return file.read()
+        except FileNotFoundError:
+            raise panapi.PanApiError('{}: {} missing from the snapshot'.format(hostname, filename))
+
+    def close(self):
+        pass
+
+
+def find_firewalls(directory):
+    """
+    :param directory: Snapshot directory
+    :return: OrderedDict of hostname to the directory of its files, sorted by hostname
+    """
+    firewalls = {}
+    for root, directories, files in os.walk(directory):
+        if not any(filename in files for filename in SNAPSHOT_FILES.values()):
+            continue
+        hostname = os.path.basename(root)
+        if hostname in firewalls:
+            raise SnapshotError('{} is in the snapshot twice: {} and {}'.format(hostname, firewalls[hostname], root))
+        firewalls[hostname] = root
+    return OrderedDict(sorted(firewalls.items()))
+
+
+def _member_path(name, directory):
+    """
+    :return: Path an archive member is extracted to, refusing members which would land outside directory
+    """
+    parts = [part for part in name.replace('\\', '/').split('/') if part not in ('', '.')]
+    if not parts or '..' in parts:
+        raise SnapshotError('unsafe path in archive: {}'.format(name))
+    return os.path.join(directory, *parts)
+
+
+def _extract_member(source, name, directory):
+    if os.path.basename(name) not in SNAPSHOT_FILES.values():
+        return
+    path = _member_path(name, directory)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with source, open(path, mode='wb') as target:
+        shutil.copyfileobj(source, target)
+
+
+def extract_archive(filename, directory):
+    """
+    Extracts the snapshot files of a tar (optionally compressed) or zip archive. Only regular files named like
+    SNAPSHOT_FILES are extracted.
+    :param filename: Archive
+    :param directory: Directory to extract to
+    :return:
+    """
+    if zipfile.is_zipfile(filename):
+        with zipfile.ZipFile(filename) as archive:
+            for info in archive.infolist():
+                if not info.is_dir():
+                    _extract_member(archive.open(info), info.filename, directory)
+    elif tarfile.is_tarfile(filename):
+        with tarfile.open(filename) as archive:
+            for member in archive:
+                if member.isfile():
+                    _extract_member(archive.extractfile(member), member.name, directory)
+    else:
+        raise SnapshotError('{} is neither a directory nor a tar or zip archive'.format(filename))
+
+
+@contextmanager
+def open_snapshot(path):
+    """
+    Opens a snapshot directory or archive. Archives are extracted once to a temporary directory, removed on exit,
+    so worker processes read plain files.
+    :param path: Snapshot directory or archive
+    :return: Context manager yielding a SnapshotClient
+    """
+    if os.path.isdir(path):
+        yield SnapshotClient(find_firewalls(path))
+        return
+    if not os.path.exists(path):
+        raise SnapshotError('{} does not exist'.format(path))
+    directory = tempfile.mkdtemp(prefix='pansnapshot-')
+    try:
+        extract_archive(path, directory)
+        yield SnapshotClient(find_firewalls(directory))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def run_across_snapshot(task, client, max_workers=None, use_processes=True, *args, **kwargs):
+    """
+    Runs task(firewall, *args, **kwargs) for every firewall of a snapshot. Nothing waits on the network offline,
+    so the firewalls are spread over processes to use every core.
+    :param task: Module level function taking the firewall hostname as first argument, as for run_across_firewalls
+    :param client: SnapshotClient, installed in every worker process
+    :param max_workers: Number of workers, defaults to the number of cores
+    :param use_processes: False runs the firewalls in threads of this process, needed when the task shares state
+    such as a panexport.FleetWorkbook
+    :return: Tuple of (results, failures), see panfleet.run_across_firewalls
+    """
+    panapi.set_client(client)
+    if use_processes:
+        return panfleet.run_in_processes(task, client.hostnames(), max_workers, panapi.set_client, (client,),
+                                         *args, **kwargs)
+    return panfleet.run_across_firewalls(task, client.hostnames(), max_workers or os.cpu_count() or 1,
+                                         *args, **kwargs)
@@ -0,0 +1,181 @@
+"""
+Watch mode: keeps exports fresh by polling each firewall for a cheap change indicator, the id of its last commit job,
+and only running the full fetch and export for firewalls which committed since they were last exported.
+
+Every firewall has its own schedule. A firewall which can't be polled or exported is retried with exponential
+back-off, so one unreachable device neither stalls the others nor gets hammered.
+"""
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from xml.etree import ElementTree
+
+import panapi
+import panfleet
+
+DEFAULT_INTERVAL = 300
+DEFAULT_MAX_BACKOFF = 3600
+
+# The indicator of a firewall which hasn't been exported yet, never equal to a commit id
+NOT_EXPORTED = object()
+
+
+def latest_commit_id(hostname, api_key):
+    """
+    Asks a firewall for the id of its most recent finished commit, local or pushed from Panorama.
+    The job list is a few KB while a config can be tens of MB.
+    :param hostname: Hostname (FQDN) of the firewall
+    :param api_key: API key
+    :return: Job id as string, None if the job history holds no commit
+    """
+    jobs = panapi.get_client().op(hostname, api_key, 'show jobs all') or ''
+    latest = None
+    for job in ElementTree.fromstring('<jobs>{}</jobs>'.format(jobs)).iter('job'):
+        if 'commit' not in (job.findtext('type') or '').lower() or job.findtext('status') != 'FIN':
+            continue
+        job_id = job.findtext('id', '')
+        if job_id.isdigit() and (latest is None or int(job_id) > int(latest)):
+            latest = job_id
+    return latest
+
+
+class FirewallSchedule:
+    def __init__(self, firewall):
+        """
+        Watch state of a single firewall.
+        :param firewall: Hostname
+        """
+        self.firewall = firewall
+        self.indicator = NOT_EXPORTED
+        self.next_check = 0.0
+        self.failures = 0
+        self.in_flight = False
+
+
+class Watcher:
+    def __init__(self, firewalls, api_key, export, interval=DEFAULT_INTERVAL, max_backoff=DEFAULT_MAX_BACKOFF,
+                 max_workers=panfleet.DEFAULT_MAX_WORKERS, change_indicator=latest_commit_id, clock=time.monotonic):
+        """
+        :param firewalls: List of firewall hostnames
+        :param api_key: API key
+        :param export: Called as export(firewall) to fetch and export a firewall which changed
+        :param interval: Seconds between two polls of the same firewall
+        :param max_backoff: Longest wait in seconds before retrying a failing firewall
+        :param max_workers: Firewalls polled or exported at the same time
+        :param change_indicator: Called as change_indicator(firewall, api_key), returns a value which changes with
+        every commit. None means unknown, the firewall is then exported on every poll and left to the cache.
+        :param clock: Monotonic clock in seconds
+        """
+        self.api_key = api_key
+        self.export = export
+        self.interval = interval
+        self.max_backoff = max_backoff
+        self.max_workers = max_workers
+        self.change_indicator = change_indicator
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.schedules = [FirewallSchedule(firewall) for firewall in firewalls]
+        self.wakeup = threading.Event()
+        self.stopped = threading.Event()
+
+    def _backoff(self, failures):
+        """
+        :return: Seconds until a firewall which failed failures times in a row is tried again
+        """
+        limit = min(self.max_backoff, self.interval * 2 ** (failures - 1))
+        # Jitter keeps firewalls which failed together, ex. behind the same VPN, from retrying together
+        return random.uniform(limit / 2, limit)
+
+    def check(self, schedule):
+        """
+        Polls a single firewall and exports it if it changed.
+        :param schedule: FirewallSchedule
+        :return: True if the firewall was exported
+        """
+        indicator = self.change_indicator(schedule.firewall, self.api_key)
+        exported = indicator is None or indicator != schedule.indicator
+        if exported:
+            self.export(schedule.firewall)
+        with self.lock:
+            schedule.indicator = indicator
+        return exported
+
+    def due(self):
+        """
+        :return: Schedules due for a poll which aren't already being polled
+        """
+        now = self.clock()
+        with self.lock:
+            return [schedule for schedule in self.schedules if schedule.next_check <= now and not schedule.in_flight]
+
+    def _finished(self, schedule, error):
+        with self.lock:
+            schedule.in_flight = False
+            if error is None:
+                schedule.failures = 0
+                schedule.next_check = self.clock() + self.interval
+            else:
+                schedule.failures += 1
+                schedule.next_check = self.clock() + self._backoff(schedule.failures)
+
+    def submit_due(self, executor, report=None):
+        """
+        Starts polling every firewall which is due, without waiting for them.
+        :param executor: Executor the polls run in
+        :param report: Called as report(firewall, exported, exception) when a poll finishes
+        :return: List of futures of the polls, each resolving to True if the firewall was exported
+        """
+        futures = []
+        for schedule in self.due():
+            with self.lock:
+                schedule.in_flight = True
+            future = executor.submit(self.check, schedule)
+
+            def done(future, schedule=schedule):
+                error = future.exception()
+                self._finished(schedule, error)
+                if report is not None:
+                    report(schedule.firewall, error is None and future.result(), error)
+                self.wakeup.set()
+            future.add_done_callback(done)
+            futures.append(future)
+        return futures
+
+    def seconds_until_due(self):
+        """
+        :return: Seconds until the next firewall which isn't being polled is due, None if all are being polled
+        """
+        with self.lock:
+            waiting = [schedule.next_check for schedule in self.schedules if not schedule.in_flight]
+        if not waiting:
+            return None
+        return max(0.0, min(waiting) - self.clock())
+
+    def run(self, report=None):
+        """
+        Polls the firewalls until stop is called. A firewall is polled again as soon as it is due, whether or not
+        the others are still being polled or exported.
+        :param report: Called as report(firewall, exported, exception) when a poll finishes
+        :return:
+        """
+        with ThreadPoolExecutor(max_workers=max(1, self.max_workers)) as executor:
+            while not self.stopped.is_set():
+                self.submit_due(executor, report)
+                self.wakeup.wait(self.seconds_until_due())
+                self.wakeup.clear()
+
+    def stop(self):
+        """
+        Ends run once the polls in progress are finished.
+        """
+        self.stopped.set()
+        self.wakeup.set()
+
+
+def print_poll(firewall, exported, error):  # pragma: no cover
+    if error is not None:
+        print('{} {} failed: {}: {}'.format(time.strftime('%Y-%m-%d %H:%M:%S'), firewall, type(error).__name__,
+                                             error))
+    elif exported:
+        print('{} {} changed and was exported.'.format(time.strftime('%Y-%m-%d %H:%M:%S'), firewall))
@@ -0,0 +1,168 @@
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import TestCase
+from unittest.mock import patch
+from urllib.parse import parse_qs
+
+import pan.xapi
+
+import panapi
+
+SUCCESS = '<response status="success"><result><config><devices/></config></result></response>'
+ERROR = '<response status="error" code="403"><result><msg>Invalid credentials.</msg></result></response>'
+
+
+class MockApiHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        server = self.server
+        params = parse_qs(self.rfile.read(int(self.headers['Content-Length'])).decode())
+        with server.lock:
+            server.requests.append(params)
+            server.connections.add(self.client_address)
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+            status, body = server.responses.pop(0) if server.responses else (200, SUCCESS)
+        if server.delay:
+            time.sleep(server.delay)
+        with server.lock:
+            server.in_flight -= 1
+        data = body.encode()
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(data)))
+        if status == 429:
+            self.send_header('Retry-After', '0')
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ClientTests(TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), MockApiHandler)
+        self.server.daemon_threads = True
+        self.server.lock = threading.Lock()
+        self.server.requests = []
+        self.server.connections = set()
+        self.server.responses = []
+        self.server.in_flight = 0
+        self.server.max_in_flight = 0
+        self.server.delay = 0
+        threading.Thread(target=self.server.serve_forever, args=(0.01,), daemon=True).start()
+        self.client = panapi.PanApiClient(use_http=True, port=self.server.server_address[1], backoff=0.01)
+
+    def doCleanups(self):
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_cmd_to_xml_matches_pan_xapi(self):
+        xapi = pan.xapi.PanXapi(hostname='localhost', api_key='key')
+        for cmd in ('show config running', 'show running security-policy', 'show jobs id "5"',
+                    'show system info'):
+            self.assertEqual(panapi.cmd_to_xml(cmd), xapi.cmd_xml(cmd))
+
+    def test_op(self):
+        result = self.client.op('127.0.0.1', 'key', 'show config running')
+
+        self.assertEqual(result, '<config><devices /></config>')
+        self.assertEqual(self.server.requests[0], {'type': ['op'], 'key': ['key'],
+                                                   'cmd': ['<show><config><running></running></config></show>']})
+
+    def test_op_xml_sent_as_is(self):
+        cmd = '<show><jobs><id>5</id></jobs><entry name="vsys1"/></show>'
+        self.client.op('127.0.0.1', 'key', cmd)
+        self.assertEqual(self.server.requests[0]['cmd'], [cmd])
+
+    def test_connection_reused(self):
+        for _ in range(5):
+            self.client.op('127.0.0.1', 'key', 'show system info')
+        self.assertEqual(len(self.server.connections), 1)
+
+    def test_transient_errors_retried(self):
+        self.server.responses = [(503, 'busy'), (429, 'slow down')]
+
+        self.assertIsNotNone(self.client.op('127.0.0.1', 'key', 'show system info'))
+
+        self.assertEqual(len(self.server.requests), 3)
+        metrics = self.client.metrics.summary()['127.0.0.1']
+        self.assertEqual((metrics['requests'], metrics['retries'], metrics['failures']), (1, 2, 0))
+
+    def test_retries_exhausted(self):
+        self.server.responses = [(503, 'busy')] * 4
+        with self.assertRaises(panapi.PanApiError) as context:
+            self.client.op('127.0.0.1', 'key', 'show system info')
+        self.assertEqual(context.exception.status, 503)
+        self.assertEqual(len(self.server.requests), 4)
+
+    def test_api_error_not_retried(self):
+        self.server.responses = [(200, ERROR)]
+        with self.assertRaisesRegex(pan.xapi.PanXapiError, 'Invalid credentials'):
+            self.client.op('127.0.0.1', 'key', 'show system info')
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_connection_errors_retried(self):
+        client = panapi.PanApiClient(use_http=True, port=1, retries=2, backoff=0.01)
+        with self.assertRaises(panapi.PanApiError):
+            client.op('127.0.0.1', 'key', 'show system info')
+        self.assertEqual(client.metrics.summary()['127.0.0.1']['retries'], 2)
+
+    def test_slots_free_while_waiting(self):
+        self.server.responses = [(503, 'busy')]
+        client = panapi.PanApiClient(use_http=True, port=self.server.server_address[1], max_per_host=1,
+                                     max_total=1, backoff=0.01)
+        free_slots = []
+
+        def fake_sleep(seconds):
+            for slots in (client.host_slots['127.0.0.1'], client.total_slots):
+                free_slots.append(slots.acquire(blocking=False))
+                slots.release()
+
+        try:
+            with patch('panapi.time.sleep', side_effect=fake_sleep):
+                client.op('127.0.0.1', 'key', 'show system info')
+        finally:
+            client.close()
+
+        self.assertEqual(free_slots, [True, True])
+
+    def test_closed_idle_connection_replaced(self):
+        self.client.op('127.0.0.1', 'key', 'show system info')
+        # As if the server had dropped the connection while it sat in the pool
+        self.client.idle_connections['127.0.0.1'][0].sock.shutdown(socket.SHUT_RDWR)
+
+        with patch('panapi.time.sleep') as mock_sleep:
+            self.assertIsNotNone(self.client.op('127.0.0.1', 'key', 'show system info'))
+
+        mock_sleep.assert_not_called()
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual(self.client.metrics.summary()['127.0.0.1']['retries'], 0)
+
+    def test_client_from_config(self):
+        client = panapi.client_from_config({'api_max_per_host': 4, 'api_backoff': 0.5, 'api_max_backoff': 5})
+        self.assertEqual((client.max_per_host, client.backoff, client.max_backoff), (4, 0.5, 5))
+        self.assertEqual(panapi.client_from_config({}).max_backoff, panapi.DEFAULT_MAX_BACKOFF)
+
+    def test_per_host_limit(self):
+        self.server.delay = 0.05
+        threads = [threading.Thread(target=self.client.op, args=('127.0.0.1', 'key', 'show system info'))
+                   for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(self.server.requests), 6)
+        self.assertEqual(self.server.max_in_flight, panapi.DEFAULT_MAX_PER_HOST)
+
+    def test_backoff_jitter_bounded(self):
+        with patch('panapi.random.uniform', side_effect=lambda low, high: high):
+            self.assertEqual(self.client._wait(0, None), 0.01)
+            self.assertEqual(self.client._wait(3, None), 0.08)
+            self.assertEqual(self.client._wait(20, None), panapi.DEFAULT_MAX_BACKOFF)
+            self.assertEqual(self.client._wait(0, '5'), 5)
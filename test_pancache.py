@@ -0,0 +1,77 @@
+import os
+import shutil
+import tempfile
+import time
+from unittest import TestCase
+from unittest.mock import patch
+
+import pancache
+
+
+class ConfigCacheTests(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cache = pancache.ConfigCache(self.tmp_dir)
+
+    def doCleanups(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_store_and_load(self):
+        xml = '<config><devices/></config>'
+        parsed = {'config': {'devices': None}}
+
+        self.cache.store('fw-1.example.com', 'running', xml, parsed)
+
+        self.assertEqual(self.cache.lookup_hash('fw-1.example.com', 'running'), pancache.content_hash(xml))
+        self.assertEqual(self.cache.load_parsed('fw-1.example.com', 'running'), parsed)
+        self.assertEqual(self.cache.load_xml('fw-1.example.com', 'running'), xml)
+
+    def test_missing_entry(self):
+        self.assertIsNone(self.cache.lookup_hash('fw-1.example.com', 'running'))
+        self.assertIsNone(self.cache.load_parsed('fw-1.example.com', 'running'))
+        self.assertIsNone(self.cache.load_xml('fw-1.example.com', 'running'))
+
+    def test_older_parse_version_ignored(self):
+        self.cache.store('fw-1.example.com', 'running', '<config/>', {'config': None}, 'options')
+        with patch('pancache.PARSE_VERSION', pancache.PARSE_VERSION + 1):
+            self.assertIsNone(self.cache.lookup_hash('fw-1.example.com', 'running'))
+            self.assertIsNone(self.cache.load_parsed('fw-1.example.com', 'running'))
+            self.assertIsNone(self.cache.lookup_options('fw-1.example.com', 'running'))
+
+    def test_store_options(self):
+        self.cache.store('fw-1.example.com', 'running', '<config/>', None, 'xlsx')
+        self.assertEqual(self.cache.lookup_options('fw-1.example.com', 'running'), 'xlsx')
+
+        self.cache.store_options('fw-1.example.com', 'running', 'csv')
+
+        self.assertEqual(self.cache.lookup_options('fw-1.example.com', 'running'), 'csv')
+        self.assertEqual(self.cache.lookup_hash('fw-1.example.com', 'running'), pancache.content_hash('<config/>'))
+
+    def test_evict_by_age(self):
+        self.cache.store('fw-1.example.com', 'running', '<config/>', None)
+        self.cache.store('fw-2.example.com', 'running', '<config/>', None)
+        old = time.time() - 40 * 24 * 60 * 60
+        meta = os.path.join(self.tmp_dir, 'fw-1.example.com', 'running' + pancache.META_SUFFIX)
+        os.utime(meta, (old, old))
+
+        evicted = self.cache.evict()
+
+        self.assertEqual(evicted, 1)
+        self.assertIsNone(self.cache.lookup_hash('fw-1.example.com', 'running'))
+        self.assertIsNotNone(self.cache.lookup_hash('fw-2.example.com', 'running'))
+        self.assertEqual(os.listdir(os.path.join(self.tmp_dir, 'fw-1.example.com')), [])
+
+    def test_evict_by_size_removes_oldest_first(self):
+        cache = pancache.ConfigCache(self.tmp_dir, max_age_days=None, max_size_mb=0.005)
+        now = time.time()
+        for age, hostname in enumerate(['fw-new', 'fw-mid', 'fw-old']):
+            cache.store(hostname, 'running', 'x' * 4000, None)
+            meta = os.path.join(self.tmp_dir, hostname, 'running' + pancache.META_SUFFIX)
+            os.utime(meta, (now - age * 60, now - age * 60))
+
+        evicted = cache.evict()
+
+        self.assertEqual(evicted, 2)
+        self.assertIsNotNone(cache.lookup_hash('fw-new', 'running'))
+        self.assertIsNone(cache.lookup_hash('fw-mid', 'running'))
+        self.assertIsNone(cache.lookup_hash('fw-old', 'running'))
@@ -1,9 +1,14 @@
+import json
 import os
+import random
+import shutil
+import tempfile
 from unittest import TestCase
 
 import netaddr
 
 import pancompare
+from benchmarks.generate import generate_dataplane
 
 TEST_FILE_DIR = "testfiles/"
 
@@ -37,3 +42,311 @@ class PancompareTests(TestCase):
 
         self.assertIsInstance(host, netaddr.IPAddress)
         self.assertIsInstance(network, netaddr.IPNetwork)
+
+    def test_dataplane_match(self):
+        filters = {
+            'zones': ['Internet', 'Lan'],
+            'ip_addresses': ['10.11.12.0/24', '0:0:0:0:0:0:a00:0/120'],
+            'rule_names': {'include': [], 'exclude': []},
+        }
+        with open(get_path('raw_dataplane_nomatch.txt'), 'r') as file:
+            test_rule = file.read()
+
+        self.assertEqual(pancompare.filter_dataplane_rules(test_rule, filters), {'Test Dataplane', 'IPV6 New Version'})
+
+
+class IntervalTests(TestCase):
+    def ipset_to_intervals(self, ipset):
+        return pancompare.merge_intervals((ip_range.first, ip_range.last) for ip_range in ipset.iter_ipranges())
+
+    def test_intervals_match_ipobject(self):
+        strings = [
+            'any',
+            '192.168.1.1',
+            '[ 10.11.0.5/16 192.168.1.1-192.168.1.20 172.16.0.0/12 ]',
+            '[ 0:0:0:0:0:0:0:0/101 0:0:0:0:0:0:800:0/103 0:0:0:0:0:0:a00:0/107 ]',
+            '[ 0x2607f8b0400a0806000000000000200a/128 0x20010db8000000000000000000000000/32 10.0.0.0/8 ]',
+        ]
+        for string in strings:
+            with self.subTest(string=string):
+                self.assertEqual(pancompare.convert_to_intervals(string),
+                                 self.ipset_to_intervals(pancompare.convert_to_ipobject(string)))
+
+    def test_cached_ipobject_is_a_copy(self):
+        ipset = pancompare.convert_to_ipobject('10.0.0.0/8')
+        ipset.add('192.0.2.1')
+
+        self.assertEqual(pancompare.convert_to_ipobject('10.0.0.0/8'),
+                         netaddr.IPSet([pancompare.map_to_address('10.0.0.0/8')]))
+
+    def test_convert_many(self):
+        pancompare.clear_address_caches()
+        strings = ['any', '[ 10.0.0.1 10.0.0.2 ]', 'any', '[ 10.0.0.2 10.0.0.1 ]', '10.0.0.1-10.0.0.2']
+
+        converted = pancompare.convert_many_to_intervals(strings)
+
+        self.assertEqual(converted, [pancompare.convert_to_intervals(string) for string in strings])
+        self.assertEqual(converted[1], converted[3])
+        self.assertEqual(converted[1], converted[4])
+        self.assertEqual(pancompare.convert_to_intervals.cache_info().misses, 4)
+
+    def test_index_overlaps(self):
+        index = pancompare.IPIntervalIndex.from_networks(['192.168.0.0/16', '10.0.0.1', '2001:db8::/32'])
+
+        self.assertEqual(len(index), 3)
+        self.assertTrue(index.overlaps(pancompare.convert_to_intervals('192.168.200.0/24')))
+        self.assertTrue(index.overlaps(pancompare.convert_to_intervals('10.0.0.0-10.0.0.3')))
+        self.assertTrue(index.overlaps(pancompare.convert_to_intervals('0x20010db8000000000000000000000001/128')))
+        self.assertTrue(index.overlaps(pancompare.convert_to_intervals('any')))
+        self.assertFalse(index.overlaps(pancompare.convert_to_intervals('[ 10.0.0.2-10.0.0.255 172.16.0.0/12 ]')))
+        self.assertFalse(pancompare.IPIntervalIndex([]).overlaps(pancompare.convert_to_intervals('any')))
+
+
+class DataplaneParserTests(TestCase):
+    def test_rule_records(self):
+        with open(get_path('raw_dataplane_nomatch.txt'), 'r') as file:
+            rules = list(pancompare.iter_dataplane_rules(file))
+
+        self.assertEqual([rule.name for rule in rules], ['Test Dataplane', 'IPV6 New Version'])
+        self.assertEqual(rules[0].from_zones, ('Lan',))
+        self.assertEqual(rules[0].to_zones, ('Internet',))
+        self.assertEqual(rules[0].source, '192.168.1.1')
+        self.assertEqual(rules[0].destination, '10.11.0.0/16')
+        self.assertEqual(rules[0].application_service, '[ any/tcp/any/20 any/tcp/any/21 ]')
+        self.assertEqual(rules[0].action, 'allow')
+        self.assertEqual(rules[1].parameters['icmp-unreachable'], 'no')
+        self.assertEqual(rules[1].parameters['terminal'], 'yes')
+
+    def test_all_sections(self):
+        with open(get_path('raw_dataplane_nomatch.txt'), 'r') as file:
+            sections = [dataplane for dataplane, _ in pancompare.iter_dataplane_sections(file.read())]
+
+        self.assertEqual(sections, ['dp0', 'dp0', 'dp1', 'dp1'])
+
+    def test_single_dataplane_and_wrapped_lists(self):
+        dataplane = (
+            'DP dp0:\n'
+            '\n'
+            '"Wrapped" {\n'
+            '        from [ Lan "External DMZ" ];\n'
+            '        source [ 10.0.0.1\n'
+            '                 10.0.0.2 ];\n'
+            '        to any;\n'
+            '        destination any;\n'
+            '        action deny;\n'
+            '}\n'
+        )
+
+        rules = list(pancompare.iter_dataplane_rules(dataplane))
+
+        self.assertEqual(len(rules), 1)
+        self.assertEqual(rules[0].from_zones, ('Lan', 'External DMZ'))
+        self.assertEqual(rules[0].source, '[ 10.0.0.1 10.0.0.2 ]')
+        self.assertEqual(rules[0].action, 'deny')
+        self.assertEqual(list(pancompare.iter_dataplane_rules(dataplane, 'dp1')), [])
+
+
+class MultiDataplaneTests(TestCase):
+    def read_dataplane(self):
+        with open(get_path('raw_dataplane_nomatch.txt'), 'r') as file:
+            return file.read()
+
+    def test_split_sections(self):
+        sections = pancompare.split_dataplane_sections(self.read_dataplane())
+
+        self.assertEqual(list(sections), ['dp0', 'dp1'])
+        self.assertTrue(sections['dp1'].startswith('\n"Test Dataplane" {\n'))
+
+    def test_matching_dataplanes(self):
+        dataplanes = pancompare.parse_dataplanes(self.read_dataplane())
+
+        self.assertEqual([len(rules) for rules in dataplanes.values()], [2, 2])
+        self.assertEqual(pancompare.find_dataplane_differences(dataplanes), {})
+
+    def test_parse_in_processes(self):
+        dataplane = self.read_dataplane() + self.read_dataplane().replace('dp0', 'dp2').replace('dp1', 'dp3')
+
+        self.assertEqual(pancompare.parse_dataplanes(dataplane, processes=2),
+                         pancompare.parse_dataplanes(dataplane))
+
+    def test_diverging_dataplanes(self):
+        dataplane = self.read_dataplane()
+        dp0, dp1 = dataplane.split('DP dp1:')
+        dp1 = dp1.replace('destination 10.11.0.0/16;', 'destination 10.12.0.0/16;')
+        dp1 = dp1.replace('"IPV6 New Version"', '"IPV6 Old Version"')
+
+        differences = pancompare.find_dataplane_differences(pancompare.parse_dataplanes(dp0 + 'DP dp1:' + dp1))
+
+        self.assertEqual(list(differences), ['Test Dataplane', 'IPV6 New Version', 'IPV6 Old Version'])
+        self.assertEqual(differences['Test Dataplane']['dp1'][1].destination, '10.12.0.0/16')
+        self.assertIsNone(differences['IPV6 New Version']['dp1'])
+        self.assertIsNone(differences['IPV6 Old Version']['dp0'])
+
+    def test_relative_order(self):
+        rules = list(pancompare.iter_dataplane_rules(generate_dataplane(10, seed=2)))
+        names = [rule.name for rule in rules]
+
+        differences = pancompare.find_dataplane_differences({'dp0': rules, 'dp1': rules[:2] + rules[3:]})
+        self.assertEqual(list(differences), [names[2]])
+
+        differences = pancompare.find_dataplane_differences({'dp0': rules, 'dp1': [rules[7]] + rules[:7] + rules[8:]})
+        self.assertEqual(list(differences), [names[7]])
+        self.assertEqual(differences[names[7]]['dp1'][0], 0)
+
+    def test_longest_increasing_subsequence(self):
+        values = [3, 0, 1, 4, 2, 5]
+        self.assertEqual(sorted(values[index] for index in pancompare.longest_increasing_subsequence(values)),
+                         [0, 1, 2, 5])
+
+
+class BatchFilterTests(TestCase):
+    def setUp(self):
+        with open(get_path('raw_dataplane_nomatch.txt'), 'r') as file:
+            self.index = pancompare.RulebaseIndex(pancompare.iter_dataplane_rules(file))
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def doCleanups(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_interval_tree_matches_linear_scan(self):
+        rng = random.Random(1)
+        items = []
+        for value in range(500):
+            first = rng.randrange(10000)
+            items.append((first, first + rng.randrange(300), value))
+        tree = pancompare.IntervalTree(items)
+
+        for _ in range(200):
+            first = rng.randrange(10000)
+            last = first + rng.randrange(100)
+            expected = {value for item_first, item_last, value in items if item_first <= last and item_last >= first}
+            self.assertEqual(set(tree.query(first, last)), expected)
+
+    def test_evaluate_filters(self):
+        named_filters = pancompare.load_filters(get_path('batch_filters_test.yml'))
+
+        results = pancompare.evaluate_filters(self.index, named_filters)
+
+        self.assertEqual(list(results), ['Lan Servers', 'IPv6 Inbound', 'Named Only', 'Nothing'])
+        self.assertEqual(results['Lan Servers'], {'Test Dataplane'})
+        self.assertEqual(results['IPv6 Inbound'], {'IPV6 New Version'})
+        self.assertEqual(results['Named Only'], {'Test Dataplane'})
+        self.assertEqual(results['Nothing'], set())
+
+    def test_write_batch_results(self):
+        results = {'fw-1': pancompare.evaluate_filters(
+            self.index, pancompare.load_filters(get_path('batch_filters_test.yml')))}
+        csv_file = os.path.join(self.tmp_dir, 'results.csv')
+        json_file = os.path.join(self.tmp_dir, 'results.json')
+
+        pancompare.write_batch_results(results, csv_file)
+        pancompare.write_batch_results(results, json_file)
+
+        with open(csv_file, 'r') as file:
+            self.assertEqual(file.read().splitlines(), [
+                'firewall,filter,rule',
+                'fw-1,Lan Servers,Test Dataplane',
+                'fw-1,IPv6 Inbound,IPV6 New Version',
+                'fw-1,Named Only,Test Dataplane',
+            ])
+        with open(json_file, 'r') as file:
+            self.assertEqual(json.load(file)['fw-1']['Nothing'], [])
+
+
+class FilterExpressionTests(TestCase):
+    def setUp(self):
+        with open(get_path('raw_dataplane_expressions.txt'), 'r') as file:
+            self.index = pancompare.RulebaseIndex(pancompare.iter_dataplane_rules(file))
+
+    def evaluate(self, filters):
+        return pancompare.evaluate_filter(self.index, filters)
+
+    def test_negated_source(self):
+        # 'Negated Source' allows everything but 10.0.0.0/8
+        self.assertEqual(self.evaluate({'zones': ['Lan'], 'ip_addresses': ['10.2.3.4']}), {'Web Users'})
+        self.assertEqual(self.evaluate({'zones': ['Lan'], 'ip_addresses': ['192.0.2.1']}),
+                         {'Negated Source', 'Web Users'})
+        self.assertEqual(self.evaluate({'zones': ['Lan'], 'ip_addresses': ['10.2.0.0/16', '11.0.0.0/8']}),
+                         {'Negated Source', 'Web Users'})
+
+    def test_negated_destination(self):
+        self.assertEqual(self.evaluate({'zones': ['DMZ'], 'ip_addresses': ['198.51.100.10']}), {'Negated Source'})
+        self.assertEqual(self.evaluate({'zones': ['DMZ'], 'ip_addresses': ['203.0.113.1']}), {'Any App'})
+        self.assertEqual(self.evaluate({'destination': '198.51.100.0/23'}),
+                         {'Negated Source', 'Web Users', 'Any App', 'Dns Out'})
+
+    def test_rule_names(self):
+        filters = {'zones': ['DMZ'], 'ip_addresses': ['203.0.113.1'],
+                   'rule_names': {'include': ['Dns Out', 'Missing'], 'exclude': 'Any App'}}
+        self.assertEqual(self.evaluate(filters), {'Dns Out'})
+
+    def test_boolean_operators(self):
+        self.assertEqual(self.evaluate({'and': [{'zone': 'Lan'}, {'not': {'application': 'web-browsing'}}]}),
+                         {'Negated Source'})
+        self.assertEqual(self.evaluate({'and': [{'user': 'corp\\alice'}, {'not': {'user': 'any'}}]}),
+                         {'Web Users'})
+        self.assertEqual(self.evaluate({'user': 'corp\\web users', 'from_zone': 'DMZ'}), {'Any App', 'Dns Out'})
+        self.assertEqual(self.evaluate({'or': [{'rule_name': 'Dns Out'}, {'source': '10.1.2.3', 'to_zone': 'DMZ'}]}),
+                         {'Dns Out', 'Any App'})
+        self.assertEqual(self.evaluate({'not': {'address': '::/0'}}), set())
+
+    def test_service_filters(self):
+        self.assertEqual(self.evaluate({'service': 'tcp/443'}), {'Negated Source', 'Web Users', 'Any App'})
+        self.assertEqual(self.evaluate({'service': ['6/80', 'udp/53']}), {'Web Users', 'Any App', 'Dns Out'})
+        self.assertEqual(self.evaluate({'service': 'tcp/8000-8100'}), {'Any App'})
+        # Web Users allows web-browsing and tcp/443, but not in the same entry
+        self.assertEqual(self.evaluate({'service': 'web-browsing/tcp/443'}), {'Any App'})
+        self.assertEqual(self.evaluate({'and': [{'to_zone': 'DMZ'}, {'service': 'tcp/443'}, {'action': 'allow'}]}),
+                         {'Negated Source'})
+        self.assertEqual(self.index.rules_with_services(['udp']), {'Any App', 'Dns Out'})
+
+    def test_invalid_service_filters(self):
+        for service in ('tcp/http', 'tcp/70000', 'tcp/443-80', 'any/443', 'ssl/tcp/any/443', 'tcp/'):
+            with self.assertRaises(pancompare.FilterError):
+                pancompare.compile_filter({'service': service})
+
+    def test_malformed_application_service(self):
+        self.assertEqual(pancompare.parse_application_service('[ ssl/tcp/any/443 ssl/tcp/443 dns ssl/tcp/any/https ]'),
+                         (pancompare.ServiceEntry('ssl', 'tcp', (0, 65535), (443, 443)),))
+        self.assertEqual(pancompare.parse_application_service('incomplete/'), ())
+
+    def test_services_match_rule_by_rule(self):
+        rules = list(pancompare.iter_dataplane_rules(generate_dataplane(400, seed=7)))
+        index = pancompare.RulebaseIndex(rules)
+        for service in ('tcp/443', 'udp/50-60', 'ssl/tcp/443', 'tcp/1-79,81-442'):
+            application, protocol, ranges = pancompare.parse_service_filter(service)
+            expected = {rule.name for rule in rules
+                        for entry in pancompare.parse_application_service(rule.application_service)
+                        if entry.application in ('any', application or entry.application) and
+                        entry.protocol in ('any', protocol) and
+                        any(entry.destination_ports[0] <= last and first <= entry.destination_ports[1]
+                            for first, last in ranges)}
+            self.assertTrue(expected, service)
+            self.assertEqual(pancompare.evaluate_filter(index, {'service': service}), expected, service)
+
+    def test_invalid_filters(self):
+        for filters in ({'zone': 'DMZ', 'port': 443}, {'or': {'zone': 'DMZ'}}, {'source': 'not-an-address'},
+                        {'not': 'DMZ'}):
+            with self.assertRaises(pancompare.FilterError):
+                pancompare.compile_filter(filters)
+        with self.assertRaises(SystemExit):
+            pancompare.check_filters({'Typo': {'zones': ['DMZ'], 'aplication': 'ssl'}})
+
+    def test_matches_rule_by_rule(self):
+        rules = list(pancompare.iter_dataplane_rules(generate_dataplane(400, seed=5)))
+        index = pancompare.RulebaseIndex(rules)
+        filters = {'zones': ['DMZ', 'External DMZ'], 'ip_addresses': ['10.20.0.0/16', '172.20.5.0/24']}
+        ip_filter = pancompare.IPIntervalIndex.from_networks(filters['ip_addresses'])
+
+        expected = {rule.name for rule in rules
+                    if any(set(zones) & set(filters['zones']) and
+                           ip_filter.overlaps(pancompare.convert_to_intervals(addresses))
+                           for zones, addresses in ((rule.from_zones, rule.source), (rule.to_zones, rule.destination)))}
+        self.assertTrue(expected)
+        self.assertEqual(pancompare.evaluate_filter(index, filters), expected)
+
+        expression = {'or': [{'not': {'zone': 'Lan'}}, {'application': 'ssh'}]}
+        expected = {rule.name for rule in rules
+                    if 'Lan' not in rule.from_zones + rule.to_zones or
+                    any(entry.startswith(('ssh/', 'any/')) for entry in rule.application_service.strip('[ ]').split())}
+        self.assertEqual(pancompare.evaluate_filter(index, expression), expected)
@@ -0,0 +1,157 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+import panapi
+import panexport
+import pandiff
+
+TEST_FILE_DIR = "testfiles/"
+
+
+def get_test_path(file):
+    path = os.path.join(os.path.dirname(__file__), TEST_FILE_DIR + file)
+    return path
+
+
+def rule(name, **fields):
+    fields['@name'] = name
+    fields.setdefault('action', 'allow')
+    return fields
+
+
+class DiffTests(TestCase):
+    def setUp(self):
+        self.old = [rule('a'), rule('b'), rule('c'), rule('d'), rule('e')]
+
+    def test_identical(self):
+        diff = pandiff.diff_rulebases(self.old, [dict(item) for item in self.old])
+        self.assertFalse(diff)
+
+    def test_added_removed_modified(self):
+        new = [rule('a'), rule('b', action='deny'), rule('d'), rule('e'), rule('f')]
+
+        diff = pandiff.diff_rulebases(self.old, new)
+
+        self.assertEqual(diff.added, ['f'])
+        self.assertEqual(diff.removed, ['c'])
+        self.assertEqual(diff.modified, [('b', {'action': ('allow', 'deny')})])
+        self.assertEqual(diff.moved, [])
+
+    def test_moved(self):
+        new = [self.old[0], self.old[3], self.old[1], self.old[2], self.old[4]]
+        self.assertEqual(pandiff.diff_rulebases(self.old, new).moved, ['d'])
+
+    def test_member_lists_and_defaults_normalized(self):
+        old = [{'@name': 'a', 'source': {'member': ['x', 'y']}, 'negate-source': 'no'}]
+        new = [{'@name': 'a', 'source': 'x, y', 'rule-type': 'universal', 'Order': '1'}]
+        self.assertFalse(pandiff.diff_rulebases(old, new))
+
+    def test_ignored_fields(self):
+        new = [dict(item, disabled='yes') for item in self.old]
+        self.assertEqual(len(pandiff.diff_rulebases(self.old, new).modified), 5)
+        self.assertFalse(pandiff.diff_rulebases(self.old, new, ignore_fields=['disabled']))
+
+    def test_duplicate_names(self):
+        index = pandiff.index_rulebase([rule('a'), rule('a')])
+        self.assertEqual(list(index), ['a', 'a (2)'])
+
+
+class SnapshotTests(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.snapshot = os.path.join(self.tmp_dir, 'fw-1')
+        os.mkdir(self.snapshot)
+        shutil.copy(get_test_path('test_running_config.xml'), os.path.join(self.snapshot, pandiff.RUNNING_FILE))
+        shutil.copy(get_test_path('test_pushed_config.xml'), os.path.join(self.snapshot, pandiff.PUSHED_FILE))
+
+    def doCleanups(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_snapshot_equals_its_exports(self):
+        rules, is_export = pandiff.load_rulebase(self.snapshot)
+        self.assertFalse(is_export)
+        self.assertEqual(len(rules), 6)
+
+        for output_format in ('csv', 'jsonl'):
+            filename = os.path.join(self.tmp_dir, 'export.' + output_format)
+            panexport.WRITERS[output_format](rules, filename, panexport.HEADERS_ORDER, panexport.HEADERS_REMOVE,
+                                             panexport.HEADERS_DEFAULT_MAP)
+            exported, is_export = pandiff.load_rulebase(filename)
+            self.assertTrue(is_export)
+            self.assertFalse(pandiff.diff_rulebases(rules, exported, panexport.HEADERS_REMOVE))
+
+    def test_export_with_analysis_columns(self):
+        rules, _ = pandiff.load_rulebase(self.snapshot)
+        analysis = {'hit-count': '12', 'last-hit': '2025-10-16 12:00:00', 'shadowed-by': 'Allow All (redundant)',
+                    'source-resolved': ['10.0.0.0/8'], 'destination-resolved': ['any']}
+        rules = [dict(rule.items(), **analysis) for rule in rules]
+        filename = os.path.join(self.tmp_dir, 'export.csv')
+        panexport.WRITERS['csv'](rules, filename, panexport.HEADERS_ORDER, panexport.HEADERS_REMOVE,
+                                 panexport.HEADERS_DEFAULT_MAP)
+
+        self.assertEqual(pandiff.main([self.snapshot, filename]), 0)
+        self.assertEqual(pandiff.main([filename, self.snapshot]), 0)
+
+    def test_cli_reports_changes(self):
+        changed = os.path.join(self.tmp_dir, 'fw-1-changed')
+        shutil.copytree(self.snapshot, changed)
+        pushed_path = os.path.join(changed, pandiff.PUSHED_FILE)
+        with open(pushed_path, mode='r') as file:
+            pushed = file.read()
+        with open(pushed_path, mode='w') as file:
+            file.write(pushed.replace('<action>deny</action>', '<action>drop</action>', 1))
+        output = os.path.join(self.tmp_dir, 'diff.json')
+
+        self.assertEqual(pandiff.main([self.snapshot, self.snapshot]), 0)
+        self.assertEqual(pandiff.main([self.snapshot, changed, '--output', output]), 1)
+        with open(output, mode='r') as file:
+            self.assertIn('"drop"', file.read())
+
+    def test_firewall_uses_configured_client(self):
+        clients = []
+
+        def fake_fetch(hostname, api_key, config='running'):
+            clients.append((panapi.get_client(), api_key))
+            filename = pandiff.RUNNING_FILE if config == 'running' else pandiff.PUSHED_FILE
+            with open(os.path.join(self.snapshot, filename), mode='r') as file:
+                return file.read()
+
+        script_config = MagicMock(api_options={'api_retries': 7}, firewall_api_key='key')
+        previous_client = panapi.get_client()
+        try:
+            with patch('panexport.Config', return_value=script_config), \
+                    patch('panexport.fetch_firewall_configuration', side_effect=fake_fetch):
+                self.assertEqual(pandiff.main([self.snapshot, 'fw-1.example.com']), 0)
+        finally:
+            panapi.set_client(previous_client)
+
+        self.assertEqual(len(clients), 2)
+        self.assertEqual([(client.retries, api_key) for client, api_key in clients], [(7, 'key')] * 2)
+
+    def test_every_vsys_compared(self):
+        shutil.copy(get_test_path('test_running_multivsys.xml'), os.path.join(self.snapshot, pandiff.RUNNING_FILE))
+        changed = os.path.join(self.tmp_dir, 'fw-1-changed')
+        shutil.copytree(self.snapshot, changed)
+        running_path = os.path.join(changed, pandiff.RUNNING_FILE)
+        with open(running_path, mode='r') as file:
+            running = file.read()
+        with open(running_path, mode='w') as file:
+            file.write(running.replace('<member>smtp</member>', '<member>smtp-base</member>'))
+
+        rules, _ = pandiff.load_rulebase(self.snapshot)
+        names = [rule['@name'] for rule in rules]
+        self.assertIn('vsys1/Tenant A Outbound', names)
+        self.assertIn('vsys2/Tenant B Mail', names)
+        self.assertEqual(names.count('vsys1/Block Bad Hosts') + names.count('vsys2/Block Bad Hosts'), 2)
+
+        diff = pandiff.diff_rulebases(rules, pandiff.load_rulebase(changed)[0])
+        self.assertEqual([name for name, _ in diff.modified], ['vsys2/Tenant B Mail'])
+        self.assertEqual((diff.added, diff.removed, diff.moved), ([], [], []))
+
+        vsys1, _ = pandiff.load_rulebase(self.snapshot, vsys='vsys1')
+        self.assertIn('Tenant A Outbound', [rule['@name'] for rule in vsys1])
+        self.assertEqual(pandiff.main([self.snapshot, changed, '--vsys', 'vsys1']), 0)
+        self.assertEqual(pandiff.main([self.snapshot, changed, '--vsys', 'vsys2']), 1)
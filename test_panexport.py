@@ -2,12 +2,14 @@ import datetime
 import os
 import shutil
 import tempfile
+import threading
 from unittest import TestCase
-from unittest.mock import patch
+from unittest.mock import MagicMock, patch
 
 import xmltodict
-from pandas import read_excel
+from pandas import read_csv, read_excel, read_json, read_parquet
 
+import pancache
 import panexport
 
 TEST_FILE_DIR = "testfiles/"
@@ -97,3 +99,340 @@ class FileTests(TestCase):
         test_file = self.excel_to_dictionary(test_filename)
 
         self.assertEqual(golden_file, test_file)
+
+
+class FetchTests(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        with open(get_test_path('test_running_config.xml'), mode='r') as file:
+            self.running_xml = file.read()
+        with open(get_test_path('test_pushed_config.xml'), mode='r') as file:
+            self.pushed_xml = file.read()
+
+    def doCleanups(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def patch_writer(self):
+        mock_write = MagicMock()
+        patcher = patch.dict('panexport.WRITERS', {'xlsx': mock_write})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return mock_write
+
+    def fake_fetch(self, hostname, api_key, config='running'):
+        return self.running_xml if config == 'running' else self.pushed_xml
+
+    def test_both_configurations_fetched_concurrently(self):
+        # Both calls have to be in flight at the same time for the barrier to release
+        barrier = threading.Barrier(2, timeout=5)
+
+        def fake_retrieve(hostname, api_key, config='running'):
+            barrier.wait()
+            return {'config': config}
+
+        with patch('panexport.retrieve_firewall_configuration', side_effect=fake_retrieve):
+            running, pushed = panexport.load_both_configurations('fw-1', 'key')
+
+        self.assertEqual(running.parsed, {'config': 'running'})
+        self.assertEqual(pushed.parsed, {'config': 'pushed-shared-policy'})
+
+    def test_unchanged_firewall_skipped(self):
+        mock_write = self.patch_writer()
+        cache = pancache.ConfigCache(self.tmp_dir)
+
+        with patch('panexport.fetch_firewall_configuration', side_effect=self.fake_fetch):
+            panexport.do_the_things('fw-1.example.com', 'key', 'example.com', cache)
+            panexport.do_the_things('fw-1.example.com', 'key', 'example.com', cache)
+
+        self.assertEqual(mock_write.call_count, 1)
+        self.assertEqual(len(mock_write.call_args[0][0]), 6)
+
+    def test_changed_firewall_exported(self):
+        mock_write = self.patch_writer()
+        cache = pancache.ConfigCache(self.tmp_dir)
+
+        with patch('panexport.fetch_firewall_configuration', side_effect=self.fake_fetch):
+            panexport.do_the_things('fw-1.example.com', 'key', 'example.com', cache)
+            self.pushed_xml = self.pushed_xml.replace('Block Bad Hosts', 'Block Worse Hosts')
+            panexport.do_the_things('fw-1.example.com', 'key', 'example.com', cache)
+
+        self.assertEqual(mock_write.call_count, 2)
+        self.assertEqual(mock_write.call_args[0][0][0]['@name'], 'Block Worse Hosts')
+
+    def test_unchanged_firewall_exported_with_other_options(self):
+        mock_write = self.patch_writer()
+        cache = pancache.ConfigCache(self.tmp_dir)
+
+        with patch('panexport.fetch_firewall_configuration', side_effect=self.fake_fetch):
+            panexport.do_the_things('fw-1.example.com', 'key', 'example.com', cache)
+            panexport.do_the_things('fw-1.example.com', 'key', 'example.com', cache, resolve_addresses=True)
+            panexport.do_the_things('fw-1.example.com', 'key', 'example.com', cache, resolve_addresses=True)
+
+        self.assertEqual(mock_write.call_count, 2)
+        self.assertIn('source-resolved', mock_write.call_args[1]['headers'])
+
+    def test_unchanged_firewall_skipped_when_output_exists(self):
+        mock_write = self.patch_writer()
+        cache = pancache.ConfigCache(self.tmp_dir)
+        filename = os.path.join(self.tmp_dir, 'fw-1-combined-rules.csv')
+
+        with patch('panexport.fetch_firewall_configuration', side_effect=self.fake_fetch), \
+                patch('panexport.get_filename', return_value=filename):
+            panexport.do_the_things('fw-1.example.com', 'key', 'example.com', cache)
+            open(filename, mode='w').close()
+            panexport.do_the_things('fw-1.example.com', 'key', 'example.com', cache, output_format='csv')
+
+        self.assertEqual(mock_write.call_count, 1)
+
+    def test_cache_used_when_unreachable(self):
+        mock_write = self.patch_writer()
+        cache = pancache.ConfigCache(self.tmp_dir, use_when_unreachable=True)
+        with patch('panexport.fetch_firewall_configuration', side_effect=self.fake_fetch):
+            panexport.do_the_things('fw-1.example.com', 'key', 'example.com', cache)
+
+        with patch('panexport.fetch_firewall_configuration', side_effect=OSError('timed out')):
+            panexport.do_the_things('fw-1.example.com', 'key', 'example.com', cache)
+            cache.use_when_unreachable = False
+            with self.assertRaises(OSError):
+                panexport.do_the_things('fw-1.example.com', 'key', 'example.com', cache)
+
+        self.assertEqual(mock_write.call_count, 2)
+        self.assertEqual(mock_write.call_args_list[0], mock_write.call_args_list[1])
+
+
+    def test_resolved_address_columns(self):
+        mock_write = self.patch_writer()
+
+        with patch('panexport.fetch_firewall_configuration', side_effect=self.fake_fetch):
+            panexport.do_the_things('fw-1.example.com', 'key', 'example.com', resolve_addresses=True)
+
+        rules = {rule['@name']: rule for rule in mock_write.call_args[0][0]}
+        self.assertEqual(rules['Block Bad Hosts']['source-resolved'],
+                         ['192.0.2.10/32', '203.0.113.10/31', '203.0.113.12/30', '203.0.113.16/30',
+                          '203.0.113.20/32'])
+        self.assertEqual(rules['Allow Web']['destination-resolved'], ['198.51.100.20/32'])
+        # The headers are gathered once, including the analysis columns, and handed to the writer
+        self.assertEqual(mock_write.call_args[1]['headers'],
+                         panexport.get_headers(mock_write.call_args[0][0], panexport.HEADERS_ORDER,
+                                               panexport.HEADERS_REMOVE))
+        self.assertIn('source-resolved', mock_write.call_args[1]['headers'])
+
+
+class ParseConfigTests(TestCase):
+    def read_test_file(self, file):
+        with open(get_test_path(file), mode='r') as stream:
+            return stream.read()
+
+    def test_rules_identical_to_xmltodict(self):
+        xml = self.read_test_file('test_rules.xml')
+
+        streamed = panexport.parse_config(xml, [('rules', 'entry')])
+
+        self.assertEqual(streamed['rules']['entry'], xmltodict.parse(xml)['rules']['entry'])
+
+    def test_combined_rulebase_identical_to_xmltodict(self):
+        running_xml = self.read_test_file('test_running_config.xml')
+        pushed_xml = self.read_test_file('test_pushed_config.xml')
+
+        streamed = panexport.combine_the_rulebase(
+            panexport.parse_config(pushed_xml, panexport.CONFIG_PATHS['pushed-shared-policy']),
+            panexport.parse_config(running_xml, panexport.CONFIG_PATHS['running']))
+        expected = panexport.combine_the_rulebase(xmltodict.parse(pushed_xml), xmltodict.parse(running_xml))
+
+        self.assertEqual(len(expected), 6)
+        self.assertEqual(streamed, expected)
+
+    def test_objects_identical_to_xmltodict(self):
+        with open(get_test_path('test_pushed_config.xml'), mode='r') as stream:
+            streamed = panexport.parse_config(stream, panexport.CONFIG_PATHS['pushed-shared-policy'])
+        expected = xmltodict.parse(self.read_test_file('test_pushed_config.xml'))
+
+        for section in ('address', 'address-group'):
+            self.assertEqual(panexport.safeget(streamed, 'policy', 'panorama', section, 'entry'),
+                             panexport.safeget(expected, 'policy', 'panorama', section, 'entry'))
+
+    def test_unused_sections_dropped(self):
+        streamed = panexport.parse_config(self.read_test_file('test_running_config.xml'),
+                                          panexport.CONFIG_PATHS['running'])
+
+        device = streamed['config']['devices']['entry']
+        self.assertEqual(list(device), ['@name', 'vsys'])
+        self.assertEqual(list(device['vsys']['entry']), ['@name', 'address', 'rulebase'])
+
+
+class StreamingWriterTests(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        with open(get_test_path('test_rules.xml'), mode='r') as file:
+            self.example_rules = xmltodict.parse(file.read())['rules']['entry']
+
+    def doCleanups(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_format_rule(self):
+        headers = ['@name', 'application', 'tag', 'rule-type']
+
+        row = panexport.format_rule(self.example_rules[0], headers, panexport.HEADERS_DEFAULT_MAP)
+
+        self.assertEqual(row, ['Very Important', 'web-browsing, ssl', '', 'universal'])
+
+    def test_write_from_generator_with_known_headers(self):
+        headers = panexport.get_headers(self.example_rules, panexport.HEADERS_ORDER, panexport.HEADERS_REMOVE)
+        list_filename = os.path.join(self.tmp_dir, "from_list.xlsx")
+        generator_filename = os.path.join(self.tmp_dir, "from_generator.xlsx")
+
+        panexport.write_to_excel(self.example_rules, list_filename, panexport.HEADERS_ORDER,
+                                 panexport.HEADERS_REMOVE, panexport.HEADERS_DEFAULT_MAP)
+        panexport.write_to_excel((rule for rule in self.example_rules), generator_filename,
+                                 default_map=panexport.HEADERS_DEFAULT_MAP, headers=headers)
+
+        self.assertEqual(read_excel(list_filename).to_dict(), read_excel(generator_filename).to_dict())
+
+
+class OutputFormatTests(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        with open(get_test_path('test_rules.xml'), mode='r') as file:
+            self.example_rules = xmltodict.parse(file.read())['rules']['entry']
+        self.golden = read_excel(get_test_path("panexport_golden_output.xlsx"), dtype=str).fillna('')
+
+    def doCleanups(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write(self, output_format):
+        filename = os.path.join(self.tmp_dir, 'rules.' + output_format)
+        panexport.WRITERS[output_format](self.example_rules, filename, panexport.HEADERS_ORDER,
+                                         panexport.HEADERS_REMOVE, panexport.HEADERS_DEFAULT_MAP)
+        return filename
+
+    def assertMatchesGolden(self, data_frame):
+        self.assertEqual(data_frame.astype(str).fillna('').to_dict(), self.golden.to_dict())
+
+    def test_csv(self):
+        self.assertMatchesGolden(read_csv(self.write('csv'), dtype=str, keep_default_na=False))
+
+    def test_jsonl(self):
+        self.assertMatchesGolden(read_json(self.write('jsonl'), lines=True, dtype=str))
+
+    def test_parquet(self):
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            self.skipTest('pyarrow not installed')
+        self.assertMatchesGolden(read_parquet(self.write('parquet')).replace({None: ''}))
+
+    def test_fleet_workbook(self):
+        filename = os.path.join(self.tmp_dir, 'fleet.xlsx')
+        workbook = panexport.FleetWorkbook(filename)
+        for name in ('fw-1', 'fw-1', 'a-very-long-firewall-name-beyond-excel-limits'):
+            workbook.add_rulebase(name, self.example_rules, panexport.HEADERS_ORDER, panexport.HEADERS_REMOVE,
+                                  panexport.HEADERS_DEFAULT_MAP)
+        workbook.close()
+
+        sheets = read_excel(filename, sheet_name=None, dtype=str)
+        self.assertEqual(list(sheets), ['fw-1', 'fw-1-2', 'a-very-long-firewall-name-beyon'])
+        for sheet in sheets.values():
+            self.assertMatchesGolden(sheet.fillna(''))
+
+
+class VsysAndDeviceGroupTests(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        with open(get_test_path('test_running_multivsys.xml'), mode='r') as file:
+            self.running_xml = file.read()
+        with open(get_test_path('test_pushed_config.xml'), mode='r') as file:
+            self.pushed_xml = file.read()
+        with open(get_test_path('test_panorama_config.xml'), mode='r') as file:
+            self.panorama_xml = file.read()
+        self.running = panexport.parse_firewall_configuration(self.running_xml, 'running')
+        self.pushed = panexport.parse_firewall_configuration(self.pushed_xml, 'pushed-shared-policy')
+        self.panorama = panexport.parse_firewall_configuration(self.panorama_xml, panexport.PANORAMA_CONFIG)
+
+    def doCleanups(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def fake_fetch(self, hostname, api_key, config='running'):
+        if hostname == 'fw-pan.example.com':
+            return self.panorama_xml
+        return self.running_xml if config == 'running' else self.pushed_xml
+
+    @staticmethod
+    def names(rules):
+        return [rule['@name'] for rule in rules]
+
+    def test_every_vsys_combined(self):
+        self.assertEqual([entry['@name'] for entry in panexport.list_vsys(self.running)], ['vsys1', 'vsys2'])
+
+        vsys2 = panexport.combine_the_rulebase(self.pushed, self.running, 'vsys2')
+
+        self.assertEqual(self.names(vsys2), ['Block Bad Hosts', 'Tenant B Mail', 'Tenant B Deny', 'Documentation Out',
+                                             'intrazone-default', 'interzone-default'])
+        self.assertEqual(vsys2, panexport.combine_the_rulebase(xmltodict.parse(self.pushed_xml),
+                                                               xmltodict.parse(self.running_xml), 'vsys2'))
+        self.assertIn('Tenant A Outbound', self.names(panexport.combine_the_rulebase(self.pushed, self.running)))
+
+    def test_vsys_objects_override_shared(self):
+        self.assertEqual(panexport.build_address_resolver(self.pushed, self.running, 'vsys1').resolve_members(
+            ['Mail Server']), ('192.0.2.25/32',))
+        self.assertEqual(panexport.build_address_resolver(self.pushed, self.running, 'vsys2').resolve_members(
+            ['Mail Server']), ('198.51.100.25/32',))
+
+    def test_output_per_vsys(self):
+        mock_write = MagicMock()
+        with patch.dict('panexport.WRITERS', {'xlsx': mock_write}), \
+                patch('panexport.fetch_firewall_configuration', side_effect=self.fake_fetch):
+            panexport.do_the_things('fw-1.example.com', 'key', '.example.com')
+            # Down to a single vsys the output is named after the firewall alone
+            self.running_xml = self.running_xml[:self.running_xml.index('<entry name="vsys2">')] + \
+                self.running_xml[self.running_xml.index('</vsys>'):]
+            panexport.do_the_things('fw-1.example.com', 'key', '.example.com')
+
+        filenames = [call[0][1] for call in mock_write.call_args_list]
+        self.assertTrue(filenames[0].endswith('-fw-1-vsys1-combined-rules.xlsx'), filenames)
+        self.assertTrue(filenames[1].endswith('-fw-1-vsys2-combined-rules.xlsx'), filenames)
+        self.assertTrue(filenames[2].endswith('-fw-1-combined-rules.xlsx'), filenames)
+
+    def test_device_group_hierarchy(self):
+        self.assertEqual(panexport.list_device_groups(self.panorama), ['Branches', 'Branch East', 'Datacenter'])
+
+        east = panexport.combine_device_group_rulebase(self.panorama, 'Branch East')
+        self.assertEqual(self.names(east), ['Shared Pre', 'Branches Pre', 'East Pre', 'East Post', 'Branches Post',
+                                            'Shared Post', 'interzone-default'])
+        self.assertEqual(east[-1]['action'], 'allow')
+
+        datacenter = panexport.combine_device_group_rulebase(self.panorama, 'Datacenter')
+        self.assertEqual(self.names(datacenter), ['Shared Pre', 'Shared Post', 'interzone-default'])
+        self.assertEqual(datacenter[-1]['action'], 'deny')
+
+        resolver = panexport.build_device_group_resolver(self.panorama, 'Branch East')
+        self.assertEqual(resolver.resolve_members(['Web Server', 'Shared Net']), ('198.51.100.80/32', '10.0.0.0/8'))
+        with self.assertRaises(KeyError):
+            panexport.combine_device_group_rulebase(self.panorama, 'Missing')
+
+    def test_panorama_pulled_once(self):
+        mock_write = MagicMock()
+        with patch.dict('panexport.WRITERS', {'xlsx': mock_write}), \
+                patch('panexport.fetch_firewall_configuration', side_effect=self.fake_fetch) as mock_fetch:
+            results, failures = panexport.export_panorama('fw-pan.example.com', 'key', '.example.com',
+                                                          use_processes=False)
+
+        mock_fetch.assert_called_once_with('fw-pan.example.com', 'key', 'running')
+        self.assertEqual(list(results), ['Branches', 'Branch East', 'Datacenter'])
+        self.assertEqual(failures, {})
+        self.assertEqual(sorted(call[0][1][11:] for call in mock_write.call_args_list),
+                         ['fw-pan-Branch East-combined-rules.xlsx', 'fw-pan-Branches-combined-rules.xlsx',
+                          'fw-pan-Datacenter-combined-rules.xlsx'])
+
+    def test_panorama_in_processes(self):
+        working_dir = os.getcwd()
+        os.chdir(self.tmp_dir)
+        try:
+            with patch('panexport.fetch_firewall_configuration', side_effect=self.fake_fetch):
+                _, failures = panexport.export_panorama('fw-pan.example.com', 'key', '.example.com', 'csv',
+                                                        max_workers=2)
+        finally:
+            os.chdir(working_dir)
+
+        self.assertEqual(failures, {})
+        east = [name for name in os.listdir(self.tmp_dir) if 'Branch East' in name]
+        self.assertEqual(len(read_csv(os.path.join(self.tmp_dir, east[0]))), 7)
@@ -0,0 +1,53 @@
+import threading
+import time
+from unittest import TestCase
+
+import panfleet
+
+
+class RunAcrossFirewallsTests(TestCase):
+    def test_failures_are_isolated(self):
+        def task(firewall, suffix):
+            if firewall == 'fw-2':
+                raise ConnectionError('unreachable')
+            return firewall + suffix
+
+        results, failures = panfleet.run_across_firewalls(task, ['fw-1', 'fw-2', 'fw-3'], 2, '-done')
+
+        self.assertEqual(list(results.items()), [('fw-1', 'fw-1-done'), ('fw-3', 'fw-3-done')])
+        self.assertEqual(list(failures), ['fw-2'])
+        self.assertIsInstance(failures['fw-2'], ConnectionError)
+
+    def test_concurrency_is_bounded(self):
+        lock = threading.Lock()
+        in_flight = [0]
+        peak = [0]
+
+        def task(firewall):
+            with lock:
+                in_flight[0] += 1
+                peak[0] = max(peak[0], in_flight[0])
+            time.sleep(0.02)
+            with lock:
+                in_flight[0] -= 1
+
+        firewalls = ['fw-{}'.format(n) for n in range(10)]
+        results, failures = panfleet.run_across_firewalls(task, firewalls, max_workers=3)
+
+        self.assertEqual(len(results), 10)
+        self.assertEqual(failures, {})
+        self.assertEqual(peak[0], 3)
+
+
+def double(firewall, factor):
+    if firewall == 'fw-2':
+        raise ValueError('bad config')
+    return firewall * factor
+
+
+class RunInProcessesTests(TestCase):
+    def test_results_and_failures(self):
+        results, failures = panfleet.run_in_processes(double, ['fw-1', 'fw-2', 'fw-3'], 2, None, (), 2)
+
+        self.assertEqual(list(results.items()), [('fw-1', 'fw-1fw-1'), ('fw-3', 'fw-3fw-3')])
+        self.assertIsInstance(failures['fw-2'], ValueError)
@@ -0,0 +1,124 @@
+import io
+import os
+import shutil
+import tempfile
+import threading
+from contextlib import redirect_stdout
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+import panapi
+import pancache
+import panexport
+import panhits
+import pansnapshot
+from test_panexport import get_test_path
+
+
+def recorded_hit_counts():
+    with open(get_test_path('hit_count_response.xml'), mode='r') as file:
+        return panapi.parse_response(file.read())
+
+
+class HitCountTests(TestCase):
+    def test_parse_recorded_response(self):
+        hit_counts = panhits.parse_hit_counts(recorded_hit_counts())
+        self.assertEqual(sorted(hit_counts), ['Allow Web', 'Block Bad Hosts', 'Documentation Out',
+                                              'interzone-default', 'intrazone-default'])
+        self.assertEqual(hit_counts['Allow Web'], panhits.HitCount(98765, 1760616000, 1727740801, 0))
+        self.assertEqual(hit_counts['Documentation Out'].hit_count, 0)
+        self.assertEqual(panhits.parse_hit_counts(None), {})
+
+    def test_one_call_per_vsys(self):
+        client = MagicMock()
+        client.op.return_value = recorded_hit_counts()
+        with patch('panapi.get_client', return_value=client):
+            hit_counts = panhits.load_hit_counts('fw-1', 'key', 'vsys2')
+        self.assertEqual(len(hit_counts), 5)
+        client.op.assert_called_once_with('fw-1', 'key', panhits.HIT_COUNT_COMMAND.format('vsys2'))
+        self.assertIn('<entry name="vsys2">', client.op.call_args[0][2])
+
+    def test_unavailable(self):
+        client = MagicMock()
+        client.op.side_effect = panapi.PanApiError('Unknown command')
+        output = io.StringIO()
+        with patch('panapi.get_client', return_value=client), redirect_stdout(output):
+            self.assertIsNone(panhits.load_hit_counts('fw-1', 'key'))
+        self.assertIn('exporting without them', output.getvalue())
+
+        client.op.side_effect = None
+        client.op.return_value = '<rule-hit-count><vsys>'
+        with patch('panapi.get_client', return_value=client), redirect_stdout(output):
+            self.assertIsNone(panhits.load_hit_counts('fw-1', 'key'))
+
+    def test_columns(self):
+        rules = [{'@name': 'Allow Web'}, {'@name': 'Documentation Out'}, {'@name': 'Committed Since'}]
+        enriched = panhits.add_hit_count_columns(rules, panhits.parse_hit_counts(recorded_hit_counts()))
+        self.assertEqual(enriched[0], {'@name': 'Allow Web', 'hit-count': '98765', 'last-hit': '2025-10-16 12:00:00'})
+        self.assertEqual(enriched[1]['last-hit'], panhits.NEVER_HIT)
+        self.assertEqual(enriched[2], {'@name': 'Committed Since'})
+        self.assertEqual(rules[0], {'@name': 'Allow Web'})
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        with open(get_test_path('test_running_config.xml'), mode='r') as file:
+            self.running_xml = file.read()
+        with open(get_test_path('test_pushed_config.xml'), mode='r') as file:
+            self.pushed_xml = file.read()
+        # Both configs and the hit counts have to be in flight at the same time for the barrier to release
+        self.barrier = threading.Barrier(3, timeout=5)
+        self.client = MagicMock()
+        self.client.op.side_effect = self.fake_op
+
+    def fake_fetch(self, hostname, api_key, config='running'):
+        self.barrier.wait()
+        return self.running_xml if config == 'running' else self.pushed_xml
+
+    def fake_op(self, hostname, api_key, cmd):
+        self.barrier.wait()
+        return recorded_hit_counts()
+
+    def export(self, **kwargs):
+        mock_write = MagicMock()
+        with patch.dict('panexport.WRITERS', {'xlsx': mock_write}), \
+                patch('panexport.fetch_firewall_configuration', side_effect=self.fake_fetch), \
+                patch('panapi.get_client', return_value=self.client):
+            panexport.do_the_things('fw-1.example.com', 'key', 'example.com', hit_counts=True, **kwargs)
+        return mock_write
+
+    def test_fetched_with_the_configs(self):
+        mock_write = self.export()
+
+        self.assertEqual(self.client.op.call_count, 1)
+        rules = {rule['@name']: rule for rule in mock_write.call_args[0][0]}
+        self.assertEqual(rules['Block Bad Hosts']['hit-count'], '1523')
+        self.assertEqual(rules['interzone-default']['last-hit'], '2025-10-14 12:00:00')
+        self.assertNotIn('hit-count', rules['Lan Outbound'])
+        headers = panexport.get_headers(mock_write.call_args[0][0], panexport.HEADERS_ORDER)
+        self.assertEqual(headers[:4], ['@name', 'action', 'hit-count', 'last-hit'])
+
+    def test_unchanged_firewall_exported(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            cache = pancache.ConfigCache(tmp_dir)
+            self.export(cache=cache)
+            mock_write = self.export(cache=cache)
+        finally:
+            shutil.rmtree(tmp_dir)
+        self.assertEqual(mock_write.call_count, 1)
+
+    def test_recorded_in_snapshot(self):
+        directory = tempfile.mkdtemp()
+        try:
+            firewall = os.path.join(directory, 'fw-1')
+            os.mkdir(firewall)
+            shutil.copy(get_test_path('test_running_config.xml'), os.path.join(firewall, 'running.xml'))
+            client = pansnapshot.SnapshotClient(pansnapshot.find_firewalls(directory))
+            with patch('panapi.get_client', return_value=client), redirect_stdout(io.StringIO()):
+                self.assertIsNone(panhits.load_hit_counts('fw-1', 'key'))
+                with open(os.path.join(firewall, 'hit-count.xml'), mode='w') as file:
+                    file.write(recorded_hit_counts())
+                self.assertEqual(len(panhits.load_hit_counts('fw-1', 'key')), 5)
+        finally:
+            shutil.rmtree(directory)
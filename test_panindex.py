@@ -0,0 +1,216 @@
+import os
+import random
+from unittest import TestCase
+from unittest.mock import patch
+
+import panexport
+import panindex
+from benchmarks.generate import generate_config
+
+TEST_FILE_DIR = "testfiles/"
+
+
+def get_test_path(file):
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), TEST_FILE_DIR + file)
+
+
+def read_test_file(file):
+    with open(get_test_path(file), mode='r', encoding='utf-8') as stream:
+        return stream.read()
+
+
+def index_configs(running_xml, pushed_xml):
+    return panindex.index_config_rules(panexport.parse_firewall_configuration(pushed_xml, 'pushed-shared-policy'),
+                                       panexport.parse_firewall_configuration(running_xml, 'running'))
+
+
+def names(results):
+    return [result.name for result in results]
+
+
+class BlockTests(TestCase):
+    def test_interval_to_blocks(self):
+        rng = random.Random(1)
+        for _ in range(200):
+            first = rng.getrandbits(rng.choice([8, 32, 128]))
+            last = first + rng.getrandbits(rng.choice([4, 16, 40]))
+            blocks = panindex.interval_to_blocks(first, last)
+
+            self.assertEqual(blocks[0][0], first)
+            self.assertEqual(blocks[-1][1], last)
+            for (_, previous_last), (block_first, _) in zip(blocks, blocks[1:]):
+                self.assertEqual(previous_last + 1, block_first)
+            for block_first, block_last in blocks:
+                size = block_last - block_first + 1
+                self.assertEqual(size & (size - 1), 0)
+                self.assertEqual(block_first % size, 0)
+
+    def test_whole_space(self):
+        self.assertEqual(panindex.interval_to_blocks(0, (1 << 128) - 1), [(0, (1 << 128) - 1)])
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        self.index = panindex.FleetIndex(':memory:')
+        self.addCleanup(self.index.close)
+        rules = index_configs(read_test_file('test_running_config.xml'), read_test_file('test_pushed_config.xml'))
+        self.index.store(panindex.IndexedFirewall('fw-1', panindex.CONFIG, 'hash', rules))
+        dataplane_rules = panindex.index_dataplane_rules(read_test_file('raw_dataplane_nomatch.txt'))
+        self.index.store(panindex.IndexedFirewall('fw-2', panindex.DATAPLANE, 'hash', dataplane_rules))
+
+    def test_address_overlap(self):
+        # Contains a stored block, inside a stored block, partially overlapping a resolved range
+        self.assertEqual(names(self.index.search(addresses=['203.0.113.0/24'])),
+                         ['Block Bad Hosts', 'Documentation Out'])
+        self.assertEqual(names(self.index.search(sources=['10.11.200.7'])), ['Lan Outbound'])
+        self.assertEqual(names(self.index.search(sources=['192.168.0.0/16'])), ['Test Dataplane'])
+        self.assertEqual(names(self.index.search(addresses=['203.0.113.19-203.0.113.40'])),
+                         ['Block Bad Hosts', 'Documentation Out'])
+        self.assertEqual(names(self.index.search(destinations=['10.11.12.0/24'])),
+                         ['Test Dataplane', 'IPV6 New Version'])
+        self.assertEqual(names(self.index.search(addresses=['2001:db8::/32'])), [])
+
+    def test_object_names(self):
+        self.assertEqual(names(self.index.search(sources=['documentation group'])), ['Block Bad Hosts'])
+
+    def test_criteria_combined(self):
+        self.assertEqual(names(self.index.search(applications=['ssl'])), ['Allow Web', 'Documentation Out'])
+        self.assertEqual(names(self.index.search(addresses=['198.51.100.20'], applications=['ssl'])),
+                         ['Allow Web', 'Documentation Out'])
+        self.assertEqual(names(self.index.search(addresses=['198.51.100.20'], applications=['ssl'],
+                                                 from_zones=['lan'])), ['Documentation Out'])
+        self.assertEqual(names(self.index.search(services=['tcp/21'])), ['Test Dataplane'])
+        self.assertEqual(names(self.index.search(tags=['Outbound'], firewalls=['fw-1'])), ['Lan Outbound'])
+        self.assertEqual(names(self.index.search(names=['%Dataplane'], origins=[panindex.DATAPLANE])),
+                         ['Test Dataplane'])
+
+    def test_include_any(self):
+        self.assertEqual(names(self.index.search(applications=['ssl'], firewalls=['fw-1'], include_any=True)),
+                         ['Block Bad Hosts', 'Allow Web', 'Lan Outbound', 'Documentation Out'])
+        self.assertEqual(names(self.index.search(destinations=['192.0.2.1'], include_any=True)),
+                         ['Block Bad Hosts', 'Lan Outbound', 'Documentation Out', 'intrazone-default',
+                          'interzone-default'])
+
+    def test_matches_brute_force(self):
+        configs = generate_config(300, seed=3)
+        rules = index_configs(configs['running'], configs['pushed-shared-policy'])
+        fleet_index = panindex.FleetIndex(':memory:')
+        self.addCleanup(fleet_index.close)
+        fleet_index.store(panindex.IndexedFirewall('fw-1', panindex.CONFIG, 'hash', rules))
+        rng = random.Random(3)
+        for network in ['10.{}.0.0/16'.format(rng.randrange(256)) for _ in range(10)] + \
+                       ['172.{}.{}.0/24'.format(rng.randrange(16, 32), rng.randrange(256)) for _ in range(10)] + \
+                       ['2001:db8:{:x}::/48'.format(rng.randrange(16)) for _ in range(5)]:
+            first, last = panindex.panshadow.address_set([network]).intervals[0]
+            expected = [rule.name for rule in rules
+                        if any(block_first <= last and block_last >= first for _, block_first, block_last in rule.blocks)]
+            self.assertEqual(names(fleet_index.search(addresses=[network])), expected, network)
+
+    def test_negated_addresses(self):
+        fleet_index = panindex.FleetIndex(':memory:')
+        self.addCleanup(fleet_index.close)
+        rules = panindex.index_dataplane_rules(read_test_file('raw_dataplane_expressions.txt'))
+        fleet_index.store(panindex.IndexedFirewall('fw-3', panindex.DATAPLANE, 'hash', rules))
+        rules = index_configs(read_test_file('test_running_config.xml').replace(
+            '10.11.0.0/16</member>\n              </source>',
+            '10.11.0.0/16</member>\n              </source><negate-source>yes</negate-source>'),
+            read_test_file('test_pushed_config.xml'))
+        fleet_index.store(panindex.IndexedFirewall('fw-1', panindex.CONFIG, 'hash', rules))
+
+        # Negated Source excludes 10.0.0.0/8, Any App excludes the destination 198.51.100.0/24
+        self.assertEqual(names(fleet_index.search(sources=['10.1.2.3'], firewalls=['fw-3'])), ['Any App'])
+        self.assertEqual(names(fleet_index.search(sources=['192.0.2.1', '10.1.2.3'], firewalls=['fw-3'])),
+                         ['Negated Source', 'Any App'])
+        self.assertEqual(names(fleet_index.search(sources=['10.0.0.0/7'], firewalls=['fw-3'])),
+                         ['Negated Source', 'Any App'])
+        self.assertEqual(names(fleet_index.search(destinations=['198.51.100.0/25'], firewalls=['fw-3'])),
+                         ['Negated Source'])
+        self.assertEqual(names(fleet_index.search(destinations=['198.51.100.128/26'], firewalls=['fw-3'])), [])
+        self.assertEqual(names(fleet_index.search(destinations=['198.51.101.1'], firewalls=['fw-3'])), ['Any App'])
+        self.assertEqual(names(fleet_index.search(addresses=['198.51.100.10'], firewalls=['fw-3'])),
+                         ['Negated Source'])
+
+        # Lan Outbound negates 10.11.0.0/16 of the running config, the pushed rules keep their source
+        self.assertEqual(names(fleet_index.search(sources=['10.11.200.7'], firewalls=['fw-1'])), [])
+        self.assertIn('Lan Outbound', names(fleet_index.search(sources=['192.168.1.1'], firewalls=['fw-1'])))
+
+    def test_service_port_ranges(self):
+        fleet_index = panindex.FleetIndex(':memory:')
+        self.addCleanup(fleet_index.close)
+        dataplane = read_test_file('raw_dataplane_expressions.txt').replace(
+            'application/service ssl/tcp/any/443;', 'application/service [ ssl/tcp/any/8000-8100,443 dns/udp/any/53 ];')
+        fleet_index.store(panindex.IndexedFirewall('fw-3', panindex.DATAPLANE, 'hash',
+                                                   panindex.index_dataplane_rules(dataplane)))
+
+        self.assertEqual(names(fleet_index.search(services=['tcp/8050'])), ['Negated Source'])
+        self.assertEqual(names(fleet_index.search(services=['tcp/8050'], include_any=True)),
+                         ['Negated Source', 'Any App'])
+        self.assertEqual(names(fleet_index.search(services=['tcp/7000-8000'])), ['Negated Source'])
+        self.assertEqual(names(fleet_index.search(services=['tcp/443'])), ['Negated Source', 'Web Users'])
+        self.assertEqual(names(fleet_index.search(services=['6'])), ['Negated Source', 'Web Users'])
+        self.assertEqual(names(fleet_index.search(services=['ssl/tcp/8050'])), ['Negated Source'])
+        self.assertEqual(names(fleet_index.search(services=['web-browsing/tcp/8050'])), [])
+        self.assertEqual(names(fleet_index.search(services=['udp/53', 'tcp/9000'])), ['Negated Source', 'Dns Out'])
+        self.assertEqual(names(fleet_index.search(services=['tcp/8101'])), [])
+
+    def test_every_vsys_indexed(self):
+        rules = index_configs(read_test_file('test_running_multivsys.xml'), read_test_file('test_pushed_config.xml'))
+        fleet_index = panindex.FleetIndex(':memory:')
+        self.addCleanup(fleet_index.close)
+        fleet_index.store(panindex.IndexedFirewall('fw-3', panindex.CONFIG, 'hash', rules))
+
+        self.assertEqual([(result.vsys, result.position, result.name)
+                          for result in fleet_index.search(names=['Tenant%'])],
+                         [('vsys1', 1, 'Tenant A Outbound'), ('vsys2', 1, 'Tenant B Mail'),
+                          ('vsys2', 2, 'Tenant B Deny')])
+        # Mail Server of vsys2 overrides the shared object
+        self.assertEqual(names(fleet_index.search(destinations=['198.51.100.25'], vsys=['vsys2'])), ['Tenant B Mail'])
+        self.assertEqual(names(fleet_index.search(destinations=['192.0.2.25'])), [])
+        self.assertEqual(len(fleet_index.search(names=['Block Bad Hosts'])), 2)
+
+
+class UpdateTests(TestCase):
+    def setUp(self):
+        self.running_xml = read_test_file('test_running_config.xml')
+        self.pushed_xml = read_test_file('test_pushed_config.xml')
+        self.index = panindex.FleetIndex(':memory:')
+        self.addCleanup(self.index.close)
+
+    def fake_fetch(self, hostname, api_key, config='running'):
+        return self.running_xml if config == 'running' else self.pushed_xml
+
+    def update(self, hostnames):
+        indexed = ((hostname, panindex.index_firewall(hostname, 'key', self.index.hashes()), None)
+                   for hostname in hostnames)
+        return panindex.update_index(self.index, indexed)
+
+    def test_unchanged_firewalls_skipped(self):
+        with patch('panexport.fetch_firewall_configuration', side_effect=self.fake_fetch):
+            self.assertEqual(self.update(['fw-1', 'fw-2']), (2, 0, {}))
+            self.assertEqual(self.update(['fw-1', 'fw-2']), (0, 2, {}))
+            self.pushed_xml = self.pushed_xml.replace('Block Bad Hosts', 'Block Worse Hosts')
+            self.assertEqual(self.update(['fw-2']), (1, 0, {}))
+
+        self.assertEqual(names(self.index.search(names=['Block%'])), ['Block Bad Hosts', 'Block Worse Hosts'])
+        self.assertEqual([row[:2] + row[3:] for row in self.index.firewalls()],
+                         [('fw-1', 'config', 6), ('fw-2', 'config', 6)])
+
+    def test_prune(self):
+        with patch('panexport.fetch_firewall_configuration', side_effect=self.fake_fetch):
+            self.update(['fw-1', 'fw-2'])
+
+        self.assertEqual(self.index.prune(['fw-2']), ['fw-1'])
+        self.assertEqual({result.hostname for result in self.index.search()}, {'fw-2'})
+        self.assertEqual(self.index.connection.execute('SELECT COUNT(*) FROM members WHERE rule_id NOT IN '
+                                                       '(SELECT id FROM rules)').fetchone(), (0,))
+
+    def test_older_index_indexed_again(self):
+        with patch('panexport.fetch_firewall_configuration', side_effect=self.fake_fetch):
+            self.update(['fw-1'])
+        self.index.connection.executescript('ALTER TABLE rules DROP COLUMN vsys; PRAGMA user_version = 1')
+        self.index._upgrade()
+
+        self.assertEqual(self.index.hashes(), {('fw-1', 'config'): ''})
+        with patch('panexport.fetch_firewall_configuration', side_effect=self.fake_fetch):
+            self.assertEqual(self.update(['fw-1']), (1, 0, {}))
+        self.assertEqual({result.vsys for result in self.index.search()}, {'vsys1'})
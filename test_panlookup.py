@@ -0,0 +1,154 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import pancompare
+import panlookup
+
+TEST_FILE_DIR = "testfiles/"
+
+ORDERED_DATAPLANE = """DP dp0:
+
+"Block Host" {
+        from any;
+        source 10.0.0.66;
+        to Internet;
+        destination any;
+        application/service any;
+        action deny;
+}
+
+"Web Out" {
+        from Lan;
+        source 10.0.0.0/24;
+        to Internet;
+        destination any;
+        application/service [ web-browsing/tcp/any/80 ssl/tcp/any/443 dns/udp/any/53 ];
+        action allow;
+}
+
+"High Ports" {
+        from [ Lan "Partner Net" ];
+        source any;
+        to Internet;
+        destination 203.0.113.0-203.0.113.127;
+        application/service any/tcp/any/1024-65535;
+        action allow;
+}
+
+"Catch All" {
+        from any;
+        source any;
+        to any;
+        destination any;
+        application/service any;
+        action drop;
+}
+"""
+
+
+def get_path(file):
+    path = os.path.join(os.path.dirname(__file__), TEST_FILE_DIR + file)
+    return path
+
+
+class ServiceParsingTests(TestCase):
+    def test_parse_application_service(self):
+        self.assertEqual(pancompare.parse_application_service('any'), (pancompare.ANY_SERVICE,))
+        self.assertEqual(pancompare.parse_application_service('[ any/tcp/any/20 ssl/tcp/1024-65535/443,8443 ]'), (
+            pancompare.ServiceEntry('any', 'tcp', (0, 65535), (20, 20)),
+            pancompare.ServiceEntry('ssl', 'tcp', (1024, 65535), (443, 443)),
+            pancompare.ServiceEntry('ssl', 'tcp', (1024, 65535), (8443, 8443)),
+        ))
+
+    def test_segment_index(self):
+        index = panlookup.SegmentIndex([(80, 80, 0), (1, 1024, 1), (443, 443, 0), (1000, 2000, 2), (1500, 1600, 2)])
+
+        self.assertEqual(index.mask_at(0), 0)
+        self.assertEqual(index.mask_at(80), 0b011)
+        self.assertEqual(index.mask_at(1024), 0b110)
+        self.assertEqual(index.mask_at(1550), 0b100)
+        self.assertEqual(index.mask_at(3000), 0)
+
+
+class LookupTests(TestCase):
+    def setUp(self):
+        self.policy = panlookup.PolicyLookup(pancompare.iter_dataplane_rules(ORDERED_DATAPLANE))
+
+    def assertMatches(self, expected, *args, **kwargs):
+        rule = self.policy.lookup(*args, **kwargs)
+        self.assertEqual(None if rule is None else rule.name, expected)
+
+    def test_first_match(self):
+        self.assertMatches('Block Host', 'Lan', 'Internet', '10.0.0.66', '198.51.100.1', 'tcp', 443)
+        self.assertMatches('Web Out', 'Lan', 'Internet', '10.0.0.5', '198.51.100.1', 'tcp', 443)
+        self.assertMatches('High Ports', 'Partner Net', 'Internet', '10.9.9.9', '203.0.113.10', 6, 8080)
+        self.assertMatches('Catch All', 'Partner Net', 'Internet', '10.9.9.9', '203.0.113.200', 'tcp', 8080)
+
+    def test_service_entries_match_as_a_whole(self):
+        # udp/443 matches neither the tcp/443 nor the udp/53 entry of Web Out
+        self.assertMatches('Catch All', 'Lan', 'Internet', '10.0.0.5', '198.51.100.1', 'udp', 443)
+        self.assertMatches('Web Out', 'Lan', 'Internet', '10.0.0.5', '198.51.100.1', 'udp', 53, application='dns')
+        self.assertMatches('Catch All', 'Lan', 'Internet', '10.0.0.5', '198.51.100.1', 'tcp', 443,
+                           application='dns')
+
+    def test_negated_addresses(self):
+        with open(get_path('raw_dataplane_expressions.txt'), 'r') as file:
+            policy = panlookup.PolicyLookup(pancompare.iter_dataplane_rules(file))
+
+        # 'Negated Source' allows everything to 198.51.100.10 except 10.0.0.0/8
+        self.assertIsNone(policy.lookup('Lan', 'DMZ', '10.1.2.3', '198.51.100.10', 'tcp', 443))
+        self.assertEqual(policy.lookup('Lan', 'DMZ', '192.0.2.1', '198.51.100.10', 'tcp', 443).name,
+                         'Negated Source')
+        # 'Any App' denies 10.1.0.0/16 to everything in the DMZ except 198.51.100.0/24
+        self.assertEqual(policy.lookup('Lan', 'DMZ', '10.1.2.3', '203.0.113.1', 'tcp', 22).name, 'Any App')
+        self.assertIsNone(policy.lookup('Lan', 'DMZ', '10.1.2.3', '198.51.100.20', 'tcp', 22))
+
+    def test_user_and_category_conditions(self):
+        with open(get_path('raw_dataplane_expressions.txt'), 'r') as file:
+            policy = panlookup.PolicyLookup(pancompare.iter_dataplane_rules(file))
+
+        # 'Web Users' only matches the users it lists, a flow without user passes it over
+        self.assertIsNone(policy.lookup('Lan', 'Internet', '10.1.2.3', '198.51.100.1', 'tcp', 80))
+        self.assertEqual(policy.lookup('Lan', 'Internet', '10.1.2.3', '198.51.100.1', 'tcp', 80,
+                                       user='corp\\web users').name, 'Web Users')
+        self.assertIsNone(policy.lookup('Lan', 'Internet', '10.1.2.3', '198.51.100.1', 'tcp', 80, user='corp\\bob'))
+
+        self.policy = panlookup.PolicyLookup(pancompare.iter_dataplane_rules(ORDERED_DATAPLANE.replace(
+            '        application/service [ web', '        category [ news "social networking" ];\n'
+                                                 '        application/service [ web')))
+        self.assertMatches('Catch All', 'Lan', 'Internet', '10.0.0.5', '198.51.100.1', 'tcp', 443)
+        self.assertMatches('Web Out', 'Lan', 'Internet', '10.0.0.5', '198.51.100.1', 'tcp', 443,
+                           category='social networking')
+        self.assertMatches('Catch All', 'Lan', 'Internet', '10.0.0.5', '198.51.100.1', 'tcp', 443, category='games')
+
+    def test_no_match(self):
+        with open(get_path('raw_dataplane_nomatch.txt'), 'r') as file:
+            policy = panlookup.PolicyLookup(pancompare.iter_dataplane_rules(file))
+
+        self.assertIsNone(policy.lookup('Lan', 'Internet', '192.168.1.1', '10.12.0.1', 'tcp', 21))
+
+
+class BulkLookupTests(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def doCleanups(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_lookup_flows(self):
+        flows = panlookup.read_flows(get_path('flows_test.csv'))
+        with open(get_path('raw_dataplane_nomatch.txt'), 'r') as file:
+            policy = panlookup.PolicyLookup(pancompare.iter_dataplane_rules(file))
+        output = os.path.join(self.tmp_dir, 'results.csv')
+
+        matches = panlookup.lookup_flows(policy, flows)
+        panlookup.write_lookup_results({'fw-1': matches}, flows, output)
+
+        self.assertEqual([None if rule is None else rule.name for rule in matches],
+                         ['Test Dataplane', None, 'IPV6 New Version', None])
+        with open(output, 'r') as file:
+            rows = file.read().splitlines()
+        self.assertEqual(rows[1], 'fw-1,Lan,Internet,192.168.1.1,10.11.4.4,tcp,21,,,,,Test Dataplane,allow')
+        self.assertEqual(rows[2], 'fw-1,Lan,Internet,192.168.1.1,10.11.4.4,tcp,22,,,,,,no match')
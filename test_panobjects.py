@@ -0,0 +1,63 @@
+from unittest import TestCase
+
+import panobjects
+
+
+def address(name, value, address_type='ip-netmask'):
+    return {'@name': name, address_type: value}
+
+
+def group(name, *member_names):
+    return {'@name': name, 'static': {'member': list(member_names)}}
+
+
+class AddressResolverTests(TestCase):
+    def setUp(self):
+        self.resolver = panobjects.AddressResolver(
+            [address('Host', '192.0.2.10/32'),
+             address('Range', '203.0.113.10-203.0.113.13', 'ip-range'),
+             address('Site', 'www.example.com', 'fqdn')],
+            [group('Inner', 'Host', 'Range'),
+             group('Outer', 'Inner', 'Site', 'Host'),
+             {'@name': 'Tagged', 'dynamic': {'filter': "'web' and 'prod'"}}])
+
+    def test_members(self):
+        self.assertEqual(panobjects.members({'member': 'any'}), ['any'])
+        self.assertEqual(panobjects.members({'member': ['a', 'b']}), ['a', 'b'])
+        self.assertEqual(panobjects.members(None), [])
+
+    def test_address_objects(self):
+        self.assertEqual(self.resolver.resolve('Host'), ('192.0.2.10/32',))
+        self.assertEqual(self.resolver.resolve('Range'), ('203.0.113.10/31', '203.0.113.12/31'))
+        self.assertEqual(self.resolver.resolve('Site'), ('www.example.com',))
+
+    def test_literals_returned_as_they_are(self):
+        self.assertEqual(self.resolver.resolve('any'), ('any',))
+        self.assertEqual(self.resolver.resolve('10.0.0.0/8'), ('10.0.0.0/8',))
+
+    def test_nested_groups_expanded_without_duplicates(self):
+        self.assertEqual(self.resolver.resolve('Outer'),
+                         ('192.0.2.10/32', '203.0.113.10/31', '203.0.113.12/31', 'www.example.com'))
+
+    def test_dynamic_group(self):
+        self.assertEqual(self.resolver.resolve('Tagged'), ("dynamic: 'web' and 'prod'",))
+
+    def test_groups_expanded_once(self):
+        self.resolver.resolve('Outer')
+        self.resolver.groups = {}
+        self.assertEqual(self.resolver.resolve_members(['Inner', 'Outer']),
+                         ('192.0.2.10/32', '203.0.113.10/31', '203.0.113.12/31', 'www.example.com'))
+
+    def test_cycle_detected(self):
+        resolver = panobjects.AddressResolver([], [group('A', 'B'), group('B', 'C'), group('C', 'A')])
+        with self.assertRaisesRegex(panobjects.AddressGroupCycleError, 'A -> B -> C -> A'):
+            resolver.resolve('A')
+
+    def test_add_resolved_addresses(self):
+        rule = {'@name': 'rule', 'source': {'member': 'Inner'}, 'destination': {'member': 'any'}}
+
+        resolved, = panobjects.add_resolved_addresses([rule], self.resolver)
+
+        self.assertEqual(resolved['source-resolved'], ['192.0.2.10/32', '203.0.113.10/31', '203.0.113.12/31'])
+        self.assertEqual(resolved['destination-resolved'], ['any'])
+        self.assertNotIn('source-resolved', rule)
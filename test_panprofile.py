@@ -0,0 +1,110 @@
+import json
+import os
+import pstats
+import shutil
+import tempfile
+import threading
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+import pancompare
+import panexport
+import panprofile
+from test_panexport import get_test_path
+
+
+class ProfilerTests(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.profiler = panprofile.Profiler(cprofile=True)
+        panprofile.set_profiler(self.profiler)
+
+    def doCleanups(self):
+        panprofile.set_profiler(None)
+        self.profiler.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_disabled_by_default(self):
+        panprofile.set_profiler(None)
+        with panprofile.stage('fw-1', 'fetch') as record:
+            record['bytes'] = 10
+        self.assertEqual(self.profiler.records, [])
+
+    def test_stage_recorded(self):
+        with panprofile.stage('fw-1', 'parse') as record:
+            data = [bytearray(1024) for _ in range(100)]
+            record['bytes'] = len(data)
+        with self.assertRaises(ValueError):
+            with panprofile.stage('fw-1', 'write'):
+                raise ValueError()
+
+        parse, write = self.profiler.records
+        self.assertEqual((parse['firewall'], parse['stage'], parse['bytes']), ('fw-1', 'parse', 100))
+        self.assertGreaterEqual(parse['peak_memory_bytes'], 100 * 1024)
+        self.assertGreaterEqual(parse['seconds'], 0)
+        self.assertTrue(write['failed'])
+
+    def test_overlapping_stages_peak_shared(self):
+        barrier = threading.Barrier(2, timeout=5)
+
+        def fetch(config):
+            with panprofile.stage('fw-1', 'fetch ' + config):
+                barrier.wait()
+                data = bytearray(1024 * 1024)
+                barrier.wait()
+                del data
+
+        threads = [threading.Thread(target=fetch, args=(config,)) for config in ('running', 'pushed')]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        with panprofile.stage('fw-1', 'combine'):
+            pass
+
+        combine, fetch_pushed, fetch_running = sorted(self.profiler.records, key=lambda record: record['stage'])
+        for fetch_record in (fetch_running, fetch_pushed):
+            self.assertTrue(fetch_record['shared'])
+            self.assertGreaterEqual(fetch_record['peak_memory_bytes'], 2 * 1024 * 1024)
+        self.assertIn('peak_memory_bytes', combine)
+        self.assertNotIn('shared', combine)
+        report = self.profiler.report()
+        self.assertGreaterEqual(report['peak_memory_bytes'], 2 * 1024 * 1024)
+        self.assertTrue(report['stages']['fetch running']['shared'])
+        self.assertNotIn('shared', report['stages']['combine'])
+
+    def test_export_stages(self):
+        with open(get_test_path('test_running_config.xml'), mode='r') as file:
+            running_xml = file.read()
+        with open(get_test_path('test_pushed_config.xml'), mode='r') as file:
+            pushed_xml = file.read()
+        client = MagicMock()
+        client.op.side_effect = lambda hostname, api_key, cmd: running_xml if 'running' in cmd else pushed_xml
+
+        with patch('panapi.get_client', return_value=client), patch.dict('panexport.WRITERS', {'xlsx': MagicMock()}):
+            self.profiler.wrap(panexport.do_the_things)('fw-1', 'key')
+
+        report = self.profiler.report()
+        self.assertEqual(sorted(report['stages']), ['combine', 'fetch pushed-shared-policy', 'fetch running',
+                                                    'format and write', 'parse pushed-shared-policy',
+                                                    'parse running'])
+        self.assertEqual(report['stages']['combine']['rules'], 6)
+        self.assertEqual(report['stages']['fetch running']['bytes'], len(running_xml))
+        self.assertEqual(len(report['firewalls']['fw-1']), 6)
+
+        filename = os.path.join(self.tmp_dir, 'profile.json')
+        self.profiler.write_report(filename)
+        with open(filename, mode='r') as file:
+            self.assertEqual(json.load(file)['stages']['combine']['calls'], 1)
+
+        stats_filename = os.path.join(self.tmp_dir, 'profile.prof')
+        self.profiler.dump_stats(stats_filename)
+        functions = {function for _, _, function in pstats.Stats(stats_filename).stats}
+        self.assertIn('combine_the_rulebase', functions)
+
+    def test_filter_stages(self):
+        with open(get_test_path('raw_dataplane_nomatch.txt'), mode='r') as file:
+            pancompare.filter_dataplane_rules(file, {'zones': ['DMZ']}, 'fw-1')
+
+        self.assertEqual([record['stage'] for record in self.profiler.records], ['parse dataplane', 'filter'])
+        self.assertGreater(self.profiler.records[0]['rules'], 0)
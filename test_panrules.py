@@ -0,0 +1,70 @@
+from unittest import TestCase
+
+import panexport
+import panrules
+from test_panexport import get_test_path
+
+ENTRY = {
+    '@name': 'Allow Web',
+    '@uuid': '6f2a0c1e-0000-4000-8000-000000000001',
+    'from': {'member': ['Lan', 'Guest']},
+    'to': {'member': 'Internet'},
+    'source': {'member': ['any']},
+    'application': {'member': ['web-browsing', 'ssl']},
+    'action': 'allow',
+    'profile-setting': {'group': {'member': 'default'}},
+}
+
+
+class RuleTests(TestCase):
+    def test_reads_like_the_entry(self):
+        rule = panrules.Rule(ENTRY)
+        self.assertEqual(rule['@name'], 'Allow Web')
+        self.assertEqual(rule['from'], ('Lan', 'Guest'))
+        self.assertEqual(rule.get('to'), ('Internet',))
+        self.assertEqual(rule['profile-setting'], {'group': {'member': 'default'}})
+        self.assertIsNone(rule.get('service'))
+        self.assertEqual(rule.get('service', 'any'), 'any')
+        self.assertIn('action', rule)
+        self.assertNotIn('disabled', rule)
+        with self.assertRaises(KeyError):
+            rule['disabled']
+        self.assertEqual(set(rule), set(ENTRY))
+        self.assertEqual(len(rule), len(ENTRY))
+
+    def test_members_interned(self):
+        first = panrules.Rule({'from': {'member': ['Lan']}})
+        second = panrules.Rule({'from': {'member': ''.join(['L', 'an'])}})
+        self.assertIs(first['from'][0], second['from'][0])
+
+    def test_unexpected_value_kept_as_parsed(self):
+        rule = panrules.Rule({'source': {'member': [{'#text': 'Host', '@loc': 'shared'}]}})
+        self.assertEqual(rule['source'], {'member': [{'#text': 'Host', '@loc': 'shared'}]})
+        rule['source'] = {'member': 'Host'}
+        self.assertEqual(rule['source'], ('Host',))
+        self.assertEqual(rule.items(), [('source', ('Host',))])
+
+    def test_copy_is_independent(self):
+        rule = panrules.Rule(ENTRY)
+        copy = rule.copy()
+        copy['shadowed-by'] = 'Allow All'
+        copy['action'] = 'deny'
+        self.assertNotIn('shadowed-by', rule)
+        self.assertEqual(rule['action'], 'allow')
+        self.assertEqual(rule, panrules.Rule(ENTRY))
+        self.assertNotEqual(rule, copy)
+
+    def test_cells_match_legacy_format(self):
+        headers = ['@name', 'from', 'to', 'service', 'profile-setting', 'action']
+        self.assertEqual(panrules.Rule(ENTRY).cells(headers),
+                         ['Allow Web', 'Lan, Guest', 'Internet', '', "{'group': {'member': 'default'}}", 'allow'])
+
+    def test_combined_rulebase(self):
+        with open(get_test_path('test_pushed_config.xml')) as pushed, \
+                open(get_test_path('test_running_config.xml')) as running:
+            rulebase = panexport.combine_the_rulebase(
+                panexport.parse_config(pushed, panexport.CONFIG_PATHS['pushed-shared-policy']),
+                panexport.parse_config(running, panexport.CONFIG_PATHS['running']))
+        self.assertTrue(rulebase)
+        self.assertTrue(all(isinstance(rule, panrules.Rule) for rule in rulebase))
+        self.assertIs(panrules.as_rule(rulebase[0]), rulebase[0])
@@ -0,0 +1,151 @@
+import random
+from unittest import TestCase
+from unittest.mock import patch
+
+import panexport
+import panobjects
+import panshadow
+from test_panexport import get_test_path
+
+
+def rule(name, action='allow', **fields):
+    fields = {key.replace('_', '-'): {'member': value} if isinstance(value, list) else value
+              for key, value in fields.items()}
+    fields['@name'] = name
+    fields['action'] = action
+    return fields
+
+
+class ShadowTests(TestCase):
+    def setUp(self):
+        self.resolver = panobjects.AddressResolver(
+            [{'@name': 'Web', 'ip-netmask': '198.51.100.10/32'},
+             {'@name': 'Site', 'fqdn': 'www.example.com'}],
+            [{'@name': 'Servers', 'static': {'member': ['Web', '198.51.100.20']}}])
+
+    def findings(self, rules):
+        return [(rules[finding.position]['@name'], finding.kind, rules[finding.covered_by]['@name'])
+                for finding in panshadow.find_shadowed_rules(rules, self.resolver)]
+
+    def test_shadowed_and_redundant(self):
+        rules = [
+            rule('Allow Net', from_=['Lan'], to=['DMZ'], destination=['198.51.100.0/24'], application=['any']),
+            rule('Allow Web', from_=['Lan'], to=['DMZ'], destination=['Web'], application=['ssl']),
+            rule('Deny Servers', 'deny', from_=['Lan'], to=['DMZ'], destination=['Servers']),
+            rule('Deny Wider', 'deny', from_=['Lan'], to=['DMZ'], destination=['198.51.0.0/16']),
+        ]
+        self.assertEqual(self.findings(rules), [('Allow Web', 'redundant', 'Allow Net'),
+                                                ('Deny Servers', 'shadowed', 'Allow Net')])
+
+    def test_partial_overlap_not_reported(self):
+        rules = [
+            rule('Web Only', to=['DMZ'], destination=['Web'], service=['service-https']),
+            rule('Servers', to=['DMZ'], destination=['Servers'], service=['service-https']),
+            rule('More Services', to=['DMZ'], destination=['Web'], service=['service-https', 'service-http']),
+            rule('Other Zone', to=['DMZ', 'Lan'], destination=['Web'], service=['service-https']),
+        ]
+        self.assertEqual(self.findings(rules), [])
+
+    def test_tokens_need_an_equal_or_any_match(self):
+        rules = [
+            rule('Site', destination=['Site']),
+            rule('Site Again', 'deny', destination=['Site'], application=['ssl']),
+            rule('Any', destination=['any']),
+            rule('Site Last', destination=['www.example.com']),
+        ]
+        self.assertEqual(self.findings(rules), [('Site Again', 'shadowed', 'Site'), ('Site Last', 'redundant', 'Site')])
+
+    def test_negated_and_disabled_rules_skipped(self):
+        rules = [
+            rule('Negated', source=['Web'], negate_source='yes'),
+            rule('Disabled', disabled='yes'),
+            rule('Later', source=['198.51.100.99']),
+        ]
+        self.assertEqual(self.findings(rules), [])
+
+    def test_scheduled_and_hip_rules_cover_nothing(self):
+        rules = [
+            rule('Office Hours', 'deny', to=['DMZ'], schedule='Weekdays'),
+            rule('Managed Hosts', 'deny', to=['DMZ'], source_hip=['Compliant']),
+            rule('Managed Servers', 'deny', to=['DMZ'], destination_hip=['Patched']),
+            rule('Allow DMZ', to=['DMZ'], destination=['Web']),
+            rule('Allow DMZ Hours', to=['DMZ'], destination=['Web'], schedule='Weekdays'),
+        ]
+        self.assertEqual(self.findings(rules), [('Allow DMZ Hours', 'redundant', 'Allow DMZ')])
+
+    def test_rule_types(self):
+        rules = [
+            rule('Intrazone', rule_type='intrazone'),
+            rule('Universal'),
+            rule('intrazone-default'),
+            rule('interzone-default', 'deny'),
+        ]
+        self.assertEqual(self.findings(rules), [('intrazone-default', 'redundant', 'Intrazone'),
+                                                ('interzone-default', 'shadowed', 'Universal')])
+
+    def test_matches_pairwise_check(self):
+        generator = random.Random(3)
+        zones = ['Lan', 'DMZ', 'Internet', 'any']
+        networks = ['10.0.0.0/8', '10.1.0.0/16', '10.1.2.0/24', '10.1.2.3', '192.0.2.0/24', 'Web', 'Site', 'any']
+        applications = ['ssl', 'web-browsing', 'dns', 'any']
+        rules = []
+        for number in range(300):
+            rules.append(rule('rule {}'.format(number), generator.choice(['allow', 'deny']),
+                              from_=generator.sample(zones, generator.randint(1, 2)),
+                              to=generator.sample(zones, 1),
+                              source=generator.sample(networks, generator.randint(1, 2)),
+                              destination=generator.sample(networks, 1),
+                              application=generator.sample(applications, 1)))
+
+        expected = []
+        for position, later in enumerate(rules):
+            for earlier in rules[:position]:
+                if self.covers(earlier, later):
+                    kind = panshadow.REDUNDANT if earlier['action'] == later['action'] else panshadow.SHADOWED
+                    expected.append((later['@name'], kind, earlier['@name']))
+                    break
+
+        self.assertTrue(expected)
+        self.assertEqual(self.findings(rules), expected)
+
+    def covers(self, earlier, later):
+        for field in ('from', 'to', 'application'):
+            outer = panshadow._field_tokens(earlier, field)
+            inner = panshadow._field_tokens(later, field)
+            if outer is not None and (inner is None or not inner <= outer):
+                return False
+        for field in ('source', 'destination'):
+            outer = self.resolver.resolve_members(panobjects.members(earlier[field]))
+            inner = self.resolver.resolve_members(panobjects.members(later[field]))
+            if not panshadow._address_covers(panshadow.address_set(outer), panshadow.address_set(inner)):
+                return False
+        return True
+
+
+class ExportColumnTests(TestCase):
+    def test_shadowed_by_column(self):
+        with open(get_test_path('test_running_config.xml'), mode='r') as file:
+            running_xml = file.read()
+        with open(get_test_path('test_pushed_config.xml'), mode='r') as file:
+            pushed_xml = file.read()
+        # A narrower copy of the device rule Allow Web in the post rulebase
+        pushed_xml = pushed_xml.replace(
+            '<rules>\n          <entry name="Documentation Out">',
+            '<rules>\n          <entry name="Late Web"><from><member>Internet</member></from>'
+            '<to><member>DMZ</member></to><destination><member>198.51.100.20</member></destination>'
+            '<application><member>ssl</member></application><service><member>application-default</member>'
+            '</service><action>allow</action></entry>\n'
+            '          <entry name="Documentation Out">')
+
+        def fake_fetch(hostname, api_key, config='running'):
+            return running_xml if config == 'running' else pushed_xml
+
+        with patch('panexport.fetch_firewall_configuration', side_effect=fake_fetch), \
+                patch.dict('panexport.WRITERS', {'xlsx': lambda rules, *args, **kwargs: written.extend(rules)}):
+            written = []
+            panexport.do_the_things('fw-1.example.com', 'key', 'example.com', detect_shadowed_rules=True)
+
+        shadowed = {rule['@name']: rule.get('shadowed-by') for rule in written}
+        self.assertEqual(shadowed['Late Web'], 'Allow Web (redundant)')
+        self.assertEqual(shadowed['Documentation Out'], None)
+        self.assertEqual(shadowed['interzone-default'], None)
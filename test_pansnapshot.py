@@ -0,0 +1,130 @@
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+import zipfile
+from unittest import TestCase
+
+import panapi
+import pancompare
+import panexport
+import pansnapshot
+
+TEST_FILE_DIR = "testfiles/"
+
+FILTERS = {
+    'zones': ['Internet', 'Lan'],
+    'ip_addresses': ['10.11.12.0/24', '0:0:0:0:0:0:a00:0/120'],
+    'rule_names': {'include': [], 'exclude': []},
+}
+
+
+def get_test_path(file):
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), TEST_FILE_DIR + file)
+
+
+class SnapshotTests(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.snapshot = os.path.join(self.tmp_dir, 'fleet-2024-01-01')
+        for hostname in ('fw-1.example.com', 'fw-2.example.com'):
+            os.makedirs(os.path.join(self.snapshot, hostname))
+            shutil.copy(get_test_path('test_running_config.xml'),
+                        os.path.join(self.snapshot, hostname, 'running.xml'))
+            shutil.copy(get_test_path('raw_dataplane_nomatch.txt'),
+                        os.path.join(self.snapshot, hostname, 'dataplane.txt'))
+        # fw-2 isn't managed by Panorama
+        shutil.copy(get_test_path('test_pushed_config.xml'),
+                    os.path.join(self.snapshot, 'fw-1.example.com', 'pushed-shared-policy.xml'))
+        previous_client = panapi.get_client()
+        self.addCleanup(panapi.set_client, previous_client)
+
+    def doCleanups(self):
+        super().doCleanups()
+        shutil.rmtree(self.tmp_dir)
+
+    def make_tar(self):
+        filename = os.path.join(self.tmp_dir, 'fleet.tar.gz')
+        with tarfile.open(filename, 'w:gz') as archive:
+            archive.add(self.snapshot, arcname='fleet-2024-01-01')
+        return filename
+
+    def make_zip(self):
+        filename = os.path.join(self.tmp_dir, 'fleet.zip')
+        with zipfile.ZipFile(filename, 'w') as archive:
+            for root, _, files in os.walk(self.snapshot):
+                for name in files:
+                    path = os.path.join(root, name)
+                    archive.write(path, os.path.relpath(path, self.tmp_dir))
+        return filename
+
+    def test_directory_and_archives(self):
+        with open(get_test_path('test_running_config.xml'), mode='r', encoding='utf-8') as file:
+            running_xml = file.read()
+
+        for path in (self.snapshot, self.make_tar(), self.make_zip()):
+            with self.subTest(path=os.path.basename(path)), pansnapshot.open_snapshot(path) as client:
+                self.assertEqual(client.hostnames(), ['fw-1.example.com', 'fw-2.example.com'])
+                self.assertEqual(client.op('fw-1.example.com', None, 'show config running'), running_xml)
+                self.assertIn('DP dp0:', client.op('fw-2.example.com', None, 'show  running security-policy'))
+                self.assertEqual(client.op('fw-2.example.com', None, 'show config pushed-shared-policy'),
+                                 '<policy/>')
+                with self.assertRaises(panapi.PanApiError):
+                    client.op('fw-3.example.com', None, 'show config running')
+                with self.assertRaises(panapi.PanApiError):
+                    client.op('fw-1.example.com', None, 'show system info')
+
+    def test_archive_removed_on_exit(self):
+        with pansnapshot.open_snapshot(self.make_tar()) as client:
+            directory = client.firewalls['fw-1.example.com']
+            self.assertTrue(os.path.isdir(directory))
+        self.assertFalse(os.path.exists(directory))
+
+    def test_unsafe_archive_refused(self):
+        filename = os.path.join(self.tmp_dir, 'unsafe.tar')
+        with tarfile.open(filename, 'w') as archive:
+            data = b'<config/>'
+            member = tarfile.TarInfo('../fw-1/running.xml')
+            member.size = len(data)
+            archive.addfile(member, io.BytesIO(data))
+
+        with self.assertRaises(pansnapshot.SnapshotError):
+            with pansnapshot.open_snapshot(filename):
+                pass
+
+    def test_not_a_snapshot(self):
+        filename = os.path.join(self.tmp_dir, 'notes.txt')
+        with open(filename, mode='w') as file:
+            file.write('not an archive')
+
+        with self.assertRaises(pansnapshot.SnapshotError):
+            with pansnapshot.open_snapshot(filename):
+                pass
+
+    def test_export_in_processes(self):
+        output_dir = os.path.join(self.tmp_dir, 'output')
+        os.makedirs(output_dir)
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(output_dir)
+
+        with pansnapshot.open_snapshot(self.make_tar()) as client:
+            results, failures = pansnapshot.run_across_snapshot(panexport.do_the_things, client, 2, True,
+                                                                None, '.example.com', None, 'jsonl')
+
+        self.assertEqual(failures, {})
+        self.assertEqual(list(results), ['fw-1.example.com', 'fw-2.example.com'])
+        written = sorted(os.listdir(output_dir))
+        self.assertEqual(len(written), 2)
+        self.assertTrue(written[0].endswith('-fw-1-combined-rules.jsonl'))
+        with open(written[0], mode='r', encoding='utf-8') as file:
+            self.assertEqual(len(file.readlines()), 6)
+
+    def test_compare_in_processes(self):
+        with pansnapshot.open_snapshot(self.snapshot) as client:
+            results, failures = pansnapshot.run_across_snapshot(pancompare.compare_firewall, client, 2, True,
+                                                                None, FILTERS)
+
+        self.assertEqual(failures, {})
+        self.assertEqual(dict(results), {'fw-1.example.com': {'Test Dataplane', 'IPV6 New Version'},
+                                         'fw-2.example.com': {'Test Dataplane', 'IPV6 New Version'}})
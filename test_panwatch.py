@@ -0,0 +1,140 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+import panwatch
+
+JOBS_XML = (
+    '<job><id>7</id><type>Commit</type><status>FIN</status></job>'
+    '<job><id>12</id><type>CommitAll</type><status>FIN</status></job>'
+    '<job><id>13</id><type>Commit</type><status>ACT</status></job>'
+    '<job><id>14</id><type>Download</type><status>FIN</status></job>'
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class CommitIdTests(TestCase):
+    def test_latest_finished_commit(self):
+        client = MagicMock()
+        client.op.return_value = JOBS_XML
+        with patch('panapi.get_client', return_value=client):
+            self.assertEqual(panwatch.latest_commit_id('fw-1', 'key'), '12')
+        client.op.assert_called_once_with('fw-1', 'key', 'show jobs all')
+
+    def test_no_commit(self):
+        client = MagicMock()
+        client.op.return_value = None
+        with patch('panapi.get_client', return_value=client):
+            self.assertIsNone(panwatch.latest_commit_id('fw-1', 'key'))
+
+
+class WatcherTests(TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.commits = {'fw-1': '1', 'fw-2': '1'}
+        self.unreachable = set()
+        self.exported = []
+        self.executor = ThreadPoolExecutor(max_workers=2)
+        self.addCleanup(self.executor.shutdown)
+        self.watcher = panwatch.Watcher(['fw-1', 'fw-2'], 'key', self.exported.append, interval=60, max_backoff=600,
+                                        change_indicator=self.indicator, clock=self.clock)
+
+    def indicator(self, firewall, api_key):
+        if firewall in self.unreachable:
+            raise ConnectionError('unreachable')
+        return self.commits[firewall]
+
+    def poll(self):
+        wait(self.watcher.submit_due(self.executor))
+
+    def test_only_committed_firewalls_exported(self):
+        self.poll()
+        self.assertEqual(sorted(self.exported), ['fw-1', 'fw-2'])
+
+        self.clock.now = 30
+        self.commits['fw-2'] = '2'
+        self.poll()
+        self.assertEqual(len(self.exported), 2)
+        self.assertEqual(self.watcher.seconds_until_due(), 30)
+
+        self.clock.now = 60
+        self.poll()
+        self.assertEqual(sorted(self.exported), ['fw-1', 'fw-2', 'fw-2'])
+
+    def test_unknown_indicator_always_exports(self):
+        self.commits['fw-1'] = None
+        self.poll()
+        self.clock.now = 60
+        self.poll()
+        self.assertEqual(sorted(self.exported), ['fw-1', 'fw-1', 'fw-2'])
+
+    def test_backoff(self):
+        self.unreachable.add('fw-1')
+        waits = []
+        for _ in range(6):
+            self.poll()
+            schedule = self.watcher.schedules[0]
+            waits.append(schedule.next_check - self.clock.now)
+            self.clock.now = schedule.next_check
+
+        self.assertEqual(self.watcher.schedules[0].failures, 6)
+        limits = [60, 120, 240, 480, 600, 600]
+        for waited, limit in zip(waits, limits):
+            self.assertTrue(limit / 2 <= waited <= limit, (waited, limit))
+        self.assertEqual(self.exported.count('fw-1'), 0)
+
+        self.unreachable.clear()
+        self.poll()
+        self.assertEqual(self.watcher.schedules[0].failures, 0)
+        self.assertEqual(self.watcher.schedules[0].next_check, self.clock.now + 60)
+        self.assertIn('fw-1', self.exported)
+
+    def test_failed_export_retried(self):
+        def export(firewall):
+            if not self.exported:
+                self.exported.append(None)
+                raise OSError('disk full')
+            self.exported.append(firewall)
+
+        watcher = panwatch.Watcher(['fw-1'], 'key', export, interval=60, change_indicator=self.indicator,
+                                   clock=self.clock)
+        wait(watcher.submit_due(self.executor))
+        self.clock.now = watcher.schedules[0].next_check
+        wait(watcher.submit_due(self.executor))
+
+        self.assertEqual(self.exported, [None, 'fw-1'])
+
+    def test_slow_firewall_doesnt_hold_others(self):
+        release = threading.Event()
+
+        def export(firewall):
+            if firewall == 'fw-1':
+                release.wait(5)
+
+        watcher = panwatch.Watcher(['fw-1', 'fw-2'], 'key', export, interval=60, change_indicator=self.indicator,
+                                   clock=self.clock)
+        reports = []
+        futures = watcher.submit_due(self.executor, lambda *report: reports.append(report))
+        futures[1].result(5)
+        self.clock.now = 60
+        # fw-1 is still exporting, fw-2 is due again
+        self.assertEqual([schedule.firewall for schedule in watcher.due()], ['fw-2'])
+        release.set()
+        wait(futures)
+        self.assertEqual(sorted(reports), [('fw-1', True, None), ('fw-2', True, None)])
+
+    def test_run_until_stopped(self):
+        watcher = panwatch.Watcher(['fw-1'], 'key', lambda firewall: watcher.stop(), interval=60,
+                                   change_indicator=self.indicator)
+        thread = threading.Thread(target=watcher.run)
+        thread.start()
+        thread.join(5)
+        self.assertFalse(thread.is_alive())